@@ -11,7 +11,7 @@ echo Activating environment...
 CALL %VENV_DIR%\Scripts\activate.bat
 
 echo Checking for package installations...
-pip install pygame
+pip install pygame numpy
 
 echo Launching script...
 python yyr.py
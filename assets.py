@@ -0,0 +1,133 @@
+import time
+from collections import OrderedDict
+
+import pygame
+
+image_files = {
+    "yin": "img/yin.png",
+    "yang": "img/yang.png",
+    "spike-wall": "img/spike-wall.png",
+    "background-tile": "img/background-tile.png",
+    "exit": "img/exit.png",
+    "exit-yin": "img/exit-yin.png",
+    "exit-yang": "img/exit-yang.png",
+    "exit-complete": "img/exit-complete.png",
+    "heart": "img/heart.png",
+    "background": "img/background.png",
+    "ui-bar": "img/ui-bar.png",
+}
+# Images without transparency are converted to the display format without an alpha channel
+opaque_images = {"background-tile", "background", "ui-bar"}
+
+# Small sprites that are packed into one atlas surface, as (image, size) pairs.
+# A size of None keeps the image at its file size.
+atlas_entries = [
+    ("yin", None),
+    ("yang", None),
+    ("yin", (26, 35)),
+    ("yang", (26, 35)),
+    ("exit", None),
+    ("exit-yin", None),
+    ("exit-yang", None),
+    ("exit-complete", None),
+    ("spike-wall", None),
+    ("heart", None),
+]
+
+# Scaled images are kept until they hold this many bytes of pixel data, older window sizes
+# are dropped first. Atlas entries and unscaled images share their pixels and are not counted.
+max_cache_bytes = 64 * 1024 * 1024
+
+images = {}
+scaled = OrderedDict()
+cache_bytes = 0
+atlas = None
+atlas_rects = {}
+
+# (phase, seconds) pairs for everything loaded so far, used by the startup report
+load_timings = []
+
+
+def load_image(name):
+    image = images.get(name)
+    if image is None:
+        start = time.perf_counter()
+        image = pygame.image.load(image_files[name])
+        if name in opaque_images:
+            image = image.convert()
+        else:
+            image = image.convert_alpha()
+        images[name] = image
+        load_timings.append((f"load {image_files[name]}", time.perf_counter() - start))
+    return image
+
+
+def build_atlas():
+    global atlas
+    start = time.perf_counter()
+    sources = []
+    for name, size in atlas_entries:
+        image = load_image(name)
+        if size is not None:
+            image = pygame.transform.scale(image, size)
+        sources.append((name, size, image))
+
+    # Everything is small, so a single row is enough
+    atlas_width = sum(image.get_width() for name, size, image in sources)
+    atlas_height = max(image.get_height() for name, size, image in sources)
+    atlas = pygame.Surface((atlas_width, atlas_height), pygame.SRCALPHA).convert_alpha()
+    atlas.fill((0, 0, 0, 0))
+    x = 0
+    for name, size, image in sources:
+        atlas.blit(image, (x, 0))
+        atlas_rects[(name, size)] = pygame.Rect(x, 0, image.get_width(), image.get_height())
+        x += image.get_width()
+    load_timings.append(("build sprite atlas", time.perf_counter() - start))
+
+
+def owned_bytes(name, surface):
+    # Pixel data that only the cache entry holds
+    if surface.get_parent() is not None or surface is images.get(name):
+        return 0
+    return surface.get_width() * surface.get_height() * surface.get_bytesize()
+
+
+def get(name, size=None):
+    global cache_bytes
+    if size is not None:
+        size = tuple(size)
+    key = (name, size)
+    surface = scaled.get(key)
+    if surface is not None:
+        scaled.move_to_end(key)
+        return surface
+
+    source = key
+    if any(entry_name == name for entry_name, entry_size in atlas_entries):
+        if atlas is None:
+            build_atlas()
+        # Asking for the file size is the same as asking for the unscaled image
+        if size is not None and atlas_rects[(name, None)].size == size:
+            source = (name, None)
+    if source in atlas_rects:
+        surface = atlas.subsurface(atlas_rects[source])
+    else:
+        surface = load_image(name)
+        if size is not None and size != surface.get_size():
+            surface = pygame.transform.scale(surface, size)
+    scaled[key] = surface
+    cache_bytes += owned_bytes(name, surface)
+    # Drop the least recently used images once the cache is over budget
+    while cache_bytes > max_cache_bytes and len(scaled) > 1:
+        (old_name, old_size), old_surface = scaled.popitem(last=False)
+        cache_bytes -= owned_bytes(old_name, old_surface)
+    return surface
+
+
+def clear():
+    global atlas, cache_bytes
+    images.clear()
+    scaled.clear()
+    cache_bytes = 0
+    atlas_rects.clear()
+    atlas = None
@@ -0,0 +1,288 @@
+import sys
+import time
+
+import numpy as np
+
+import levelgen
+import sim
+import snapshot
+
+# Many independent games stepped together with numpy, following the same rules as
+# sim.step. Per-game values are arrays with one entry per game, and per-character
+# values are (games, 2) arrays where column 0 is Yin (A) and column 1 is Yang (B).
+# Actions are the sim input bits (sim.LEFT, sim.BOOST, sim.REWIND_A, ...), one int per game.
+playing = snapshot.status_codes["playing"]
+win = snapshot.status_codes["win"]
+game_over = snapshot.status_codes["game_over"]
+
+# Columns of the observation array, one row per game
+observation_fields = (
+    "a_x", "a_y", "b_x", "b_y",
+    "a_lives", "b_lives", "a_invincible", "b_invincible",
+    "a_at_exit", "b_at_exit", "a_history", "b_history",
+    "exit_x", "exit_y", "tick",
+)
+
+win_reward = 1.0
+game_over_reward = -1.0
+hit_reward = -0.1  # For every life lost
+
+
+class BatchEnv:
+    def __init__(self, count, rows=levelgen.grid_rows, cols=levelgen.grid_cols, seed=None,
+                 history_length=sim.max_history_length, rewind_speed=sim.rewind_speed,
+                 bounds_width=None, bounds_height=None, max_ticks=None):
+        self.count = count
+        self.rows = rows
+        self.cols = cols
+        self.history_length = history_length
+        self.rewind_speed = rewind_speed
+        level_width, level_height = sim.world_size(rows, cols)
+        self.bounds_width = level_width if bounds_width is None else bounds_width
+        self.bounds_height = level_height if bounds_height is None else bounds_height
+        self.max_ticks = max_ticks  # Games still playing after this many ticks are ended as truncated
+        self.rng = np.random.default_rng(seed)
+
+        # Level of every game, as a stacked wall tensor plus the exit tile position
+        self.seeds = np.zeros(count, np.uint64)
+        self.walls = np.zeros((count, rows, cols), bool)
+        self.exit_x = np.zeros(count, np.int32)
+        self.exit_y = np.zeros(count, np.int32)
+
+        self.x = np.zeros((count, 2), np.int32)
+        self.y = np.zeros((count, 2), np.int32)
+        self.lives = np.zeros((count, 2), np.int32)
+        self.alive = np.zeros((count, 2), bool)
+        self.invincible = np.zeros((count, 2), bool)
+        self.invincibility_timer = np.zeros((count, 2), np.int32)
+        self.flash_red = np.zeros((count, 2), bool)
+        self.at_exit = np.zeros((count, 2), bool)
+        # Position histories as per-character ring buffers, like history.PositionHistory
+        self.history_x = np.zeros((count, 2, history_length), np.int16)
+        self.history_y = np.zeros((count, 2, history_length), np.int16)
+        self.history_start = np.zeros((count, 2), np.int32)
+        self.history_count = np.zeros((count, 2), np.int32)
+
+        self.tick = np.zeros(count, np.int32)
+        self.status = np.zeros(count, np.int8)
+        self.exit_state = np.zeros(count, np.int8)
+        self.flash_time = np.zeros(count, np.int32)
+        self.flashing = np.zeros(count, bool)
+        self.done = np.zeros(count, bool)
+
+        self.direction = np.array([1, -1], np.int32)  # Yang's horizontal input is mirrored
+        # Offsets into the flattened wall and history arrays, which index much faster than
+        # fancy indexing on several axes
+        self.wall_offset = (np.arange(count) * rows * cols)[:, None]
+        self.history_offset = np.arange(count * 2).reshape(count, 2) * history_length
+        self.walls_flat = self.walls.reshape(-1)
+        self.history_x_flat = self.history_x.reshape(-1)
+        self.history_y_flat = self.history_y.reshape(-1)
+        self.observation = np.zeros((count, len(observation_fields)), np.int32)
+        self.reset()
+
+    def load_level(self, index, level, seed=0):
+        chars = np.frombuffer("".join(level).encode(), np.uint8).reshape(self.rows, self.cols)
+        self.seeds[index] = seed
+        self.walls[index] = chars == ord(levelgen.wall)
+        exit_row, exit_col = divmod(int(np.argmax(chars == ord(levelgen.exit_marker))), self.cols)
+        self.exit_x[index] = exit_col * sim.tile_size
+        self.exit_y[index] = exit_row * sim.tile_size
+        for side, marker in enumerate((levelgen.character_a_marker, levelgen.character_b_marker)):
+            row, col = divmod(int(np.argmax(chars == ord(marker))), self.cols)
+            # Centered in the tile, like CharacterState
+            x = col * sim.tile_size + (sim.tile_size - sim.character_width) // 2
+            y = row * sim.tile_size + (sim.tile_size - sim.character_height) // 2
+            self.x[index, side] = x
+            self.y[index, side] = y
+            self.history_x[index, side, 0] = x
+            self.history_y[index, side, 0] = y
+        self.history_start[index] = 0
+        self.history_count[index] = 1
+        self.lives[index] = sim.initial_lives
+        self.alive[index] = True
+        self.invincible[index] = False
+        self.invincibility_timer[index] = 0
+        self.flash_red[index] = False
+        self.at_exit[index] = False
+        self.tick[index] = 0
+        self.status[index] = playing
+        self.exit_state[index] = sim.EXIT_EMPTY
+        self.flash_time[index] = 0
+        self.flashing[index] = False
+        self.done[index] = False
+
+    def reset(self, indices=None, levels=None, seeds=None):
+        # Starts new games in the given slots (all of them by default) and returns the
+        # observations. Without `levels`, fresh solvable levels are generated from `seeds`,
+        # or from random seeds.
+        if indices is None:
+            indices = range(self.count)
+        for position, index in enumerate(indices):
+            seed = int(seeds[position]) if seeds is not None else int(self.rng.integers(2 ** 63))
+            if levels is not None:
+                level = levels[position]
+            else:
+                level = levelgen.generate_level(self.rows, self.cols, seed=seed)
+            self.load_level(index, level, seed)
+        return self.observe()
+
+    def collides(self, x, y):
+        # TileGrid.collides for every character at once. Characters are smaller than a
+        # tile, so each one overlaps at most the 2x2 cells between its first and last row
+        # and column.
+        tile_size = sim.tile_size
+        wall_size = sim.wall_size
+        first_col = np.maximum(x // tile_size, 0)
+        last_col = np.minimum((x + sim.character_width - 1) // tile_size, self.cols - 1)
+        first_row = np.maximum(y // tile_size, 0)
+        last_row = np.minimum((y + sim.character_height - 1) // tile_size, self.rows - 1)
+        cols_valid = first_col <= last_col
+        rows_valid = first_row <= last_row
+        hit = np.zeros(x.shape, bool)
+        for row in (first_row, last_row):
+            row_offset = self.wall_offset + np.clip(row, 0, self.rows - 1) * self.cols
+            row_hit = rows_valid & (y < row * tile_size + wall_size)
+            for col in (first_col, last_col):
+                cell = row_offset + np.clip(col, 0, self.cols - 1)
+                hit |= row_hit & cols_valid & (x < col * tile_size + wall_size) & self.walls_flat[cell]
+        return hit
+
+    def history_position(self, positions_back):
+        slot = self.history_offset + (self.history_start + self.history_count - positions_back) % self.history_length
+        return self.history_x_flat[slot].astype(np.int32), self.history_y_flat[slot].astype(np.int32)
+
+    def step(self, actions):
+        # Advances every unfinished game by one tick. Returns (observations, rewards,
+        # dones, info); dones is only set on the tick a game ends, and finished games
+        # stay frozen until they are reset.
+        actions = np.asarray(actions, dtype=np.int32)
+        active = ~self.done
+        active_characters = active[:, None]
+        tile_size = sim.tile_size
+        width = sim.character_width
+        height = sim.character_height
+
+        # Detect which characters are at the exit and lock them there
+        exit_x = self.exit_x[:, None]
+        exit_y = self.exit_y[:, None]
+        at_exit = (active_characters & (self.x < exit_x + tile_size) & (exit_x < self.x + width)
+                   & (self.y < exit_y + tile_size) & (exit_y < self.y + height))
+        self.exit_state = np.where(active, at_exit[:, 0] + 2 * at_exit[:, 1], self.exit_state).astype(np.int8)
+        self.at_exit |= at_exit
+
+        counting = active_characters & self.invincible
+        self.invincibility_timer -= counting
+        self.invincible &= ~(counting & (self.invincibility_timer <= 0))
+
+        moving = active_characters & ~self.at_exit
+        manual_rewind = np.stack([actions & sim.REWIND_A, actions & sim.REWIND_B], axis=1) != 0
+        rewinding = moving & manual_rewind & (self.history_count > 0)
+        walking = moving & ~manual_rewind
+
+        # Manual rewind steps back through the history
+        if rewinding.any():
+            steps = np.minimum(self.rewind_speed, self.history_count)
+            rewind_x, rewind_y = self.history_position(steps)
+            self.x = np.where(rewinding, rewind_x, self.x)
+            self.y = np.where(rewinding, rewind_y, self.y)
+            self.history_count -= np.where(rewinding, steps, 0)
+            self.alive |= rewinding
+
+        # Walking records the current position if it changed, then moves
+        last_x, last_y = self.history_position(1)
+        record = walking & ((self.history_count == 0) | (last_x != self.x) | (last_y != self.y))
+        slot = (self.history_offset + (self.history_start + self.history_count) % self.history_length)[record]
+        self.history_x_flat[slot] = self.x[record]
+        self.history_y_flat[slot] = self.y[record]
+        full = self.history_count == self.history_length
+        self.history_start = np.where(record & full, (self.history_start + 1) % self.history_length, self.history_start)
+        self.history_count += record & ~full
+
+        # Only one direction applies per tick: left, right, up, then down
+        speed = np.where(actions & sim.BOOST, 5, 3)[:, None]
+        horizontal = np.where(actions & sim.LEFT, -1, np.where(actions & sim.RIGHT, 1, 0))
+        vertical = np.where(horizontal == 0, np.where(actions & sim.UP, -1, np.where(actions & sim.DOWN, 1, 0)), 0)
+        self.x += walking * speed * horizontal[:, None] * self.direction
+        self.y += walking * speed * vertical[:, None]
+
+        # Hitting a wall costs a life and puts the character back a few positions
+        hit = walking & ~self.invincible & self.collides(self.x, self.y)
+        revived = hit & (self.lives > 0)
+        if hit.any():
+            self.alive &= ~hit
+            self.lives -= revived
+            back = revived & (self.history_count >= sim.hit_rewind_positions)
+            back_x, back_y = self.history_position(sim.hit_rewind_positions)
+            self.x = np.where(back, back_x, self.x)
+            self.y = np.where(back, back_y, self.y)
+            self.alive |= back
+            self.invincible |= revived
+            self.invincibility_timer = np.where(revived, sim.invincibility_duration, self.invincibility_timer)
+            self.flash_red |= revived
+
+        # Keep the characters inside the bounds
+        self.x = np.where(moving, np.clip(self.x, 0, self.bounds_width - width), self.x)
+        self.y = np.where(moving, np.clip(self.y, 0, self.bounds_height - height), self.y)
+
+        lost = (~self.alive & (self.lives == 0)).any(axis=1)
+        won = at_exit.all(axis=1)
+        self.status = np.where(active & lost, game_over, np.where(active & won, win, self.status)).astype(np.int8)
+
+        flashing = active & self.flash_red.any(axis=1)
+        self.flashing = np.where(active, flashing, self.flashing)
+        self.flash_time += flashing
+        expired = flashing & (self.flash_time > sim.flash_ticks)
+        self.flash_red &= ~expired[:, None]
+        self.flash_time[expired] = 0
+
+        self.tick += active
+
+        finished = active & (self.status != playing)
+        truncated = np.zeros(self.count, bool)
+        if self.max_ticks is not None:
+            truncated = active & ~finished & (self.tick >= self.max_ticks)
+        dones = finished | truncated
+        self.done |= dones
+
+        rewards = (revived.sum(axis=1) * hit_reward
+                   + np.where(finished & (self.status == win), win_reward, 0.0)
+                   + np.where(finished & (self.status == game_over), game_over_reward, 0.0)).astype(np.float32)
+        info = {"status": self.status, "truncated": truncated}
+        return self.observe(), rewards, dones, info
+
+    def observe(self):
+        observation = self.observation
+        observation[:, 0] = self.x[:, 0]
+        observation[:, 1] = self.y[:, 0]
+        observation[:, 2] = self.x[:, 1]
+        observation[:, 3] = self.y[:, 1]
+        observation[:, 4:6] = self.lives
+        observation[:, 6:8] = self.invincible
+        observation[:, 8:10] = self.at_exit
+        observation[:, 10:12] = self.history_count
+        observation[:, 12] = self.exit_x
+        observation[:, 13] = self.exit_y
+        observation[:, 14] = self.tick
+        return observation.copy()
+
+
+def main(count=4096, ticks=600):
+    # Steps a batch of games with random inputs and prints the throughput
+    rng = np.random.default_rng(1)
+    start = time.perf_counter()
+    env = BatchEnv(count, seed=1)
+    print(f"reset {count} games: {time.perf_counter() - start:.2f} s")
+    choices = np.array([sim.LEFT, sim.RIGHT, sim.UP, sim.DOWN, sim.LEFT | sim.BOOST, sim.REWIND_A, sim.REWIND_B, 0])
+    actions = rng.choice(choices, count)
+    start = time.perf_counter()
+    for tick in range(ticks):
+        change = rng.random(count) < 0.1
+        actions = np.where(change, rng.choice(choices, count), actions)
+        env.step(actions)
+    elapsed = time.perf_counter() - start
+    print(f"{count * ticks / elapsed / 1e6:.2f} M game ticks/s ({ticks / elapsed:.0f} batch steps/s)")
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
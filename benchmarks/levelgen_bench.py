@@ -0,0 +1,30 @@
+# Maze generation throughput at small, large and huge grid sizes.
+# Run from the repository root: python -m benchmarks.levelgen_bench
+import time
+
+import levelgen
+
+sizes = [
+    (12, 16, 2000),
+    (256, 256, 5),
+    (2048, 2048, 1),
+]
+
+
+def bench_size(rows, cols, count):
+    start = time.perf_counter()
+    for seed in range(count):
+        levelgen.create_prim_maze(rows, cols, seed=seed)
+    elapsed = time.perf_counter() - start
+    return count / elapsed, rows * cols * count / elapsed
+
+
+def main():
+    print(f"{'grid':>11} {'mazes/s':>12} {'Mcells/s':>10}")
+    for rows, cols, count in sizes:
+        mazes_per_second, cells_per_second = bench_size(rows, cols, count)
+        print(f"{cols:>5}x{rows:<5} {mazes_per_second:>12.2f} {cells_per_second / 1e6:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
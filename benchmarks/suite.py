@@ -0,0 +1,302 @@
+# Headless benchmark suite. Compares every metric against benchmarks/baseline.json and
+# exits with status 1 if one got worse by more than its tolerance.
+# Run from the repository root:
+#   python -m benchmarks.suite            compare against the baseline
+#   python -m benchmarks.suite --update   record the current numbers as the new baseline
+#   python -m benchmarks.suite frame_ms_p50 show_text_cached_us   only run some metrics
+# Baselines are machine specific, record one with --update on the machine you compare on.
+import os
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+import csv
+import json
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+import pygame
+
+import assets
+import levelgen
+import profiler
+import sim
+import textcache
+import tilegrid
+import yyr
+
+baseline_path = os.path.join(os.path.dirname(__file__), "baseline.json")
+default_tolerance = 0.25
+repeats = 3  # Every metric is measured this many times and the median is kept
+# Frames whose flash phase took longer than this were tinted red after a hit, which costs
+# far more than the rest of the frame. They are reported apart from the others.
+flash_frame_ms = 1.0
+
+# name: True if a higher value is better
+metrics = {
+    "levelgen_levels_per_s": True,
+    "create_level_ms": False,
+    "collision_checks_per_s": True,
+    "sim_ticks_per_s": True,
+    "frame_ms_p50": False,
+    "frame_ms_p95": False,
+    "flash_frame_ms_p50": False,
+    "flash_frame_ms_p95": False,
+    "show_text_cached_us": False,
+    "show_text_uncached_us": False,
+}
+
+
+def setup_display():
+    assets.clear()
+    textcache.clear()
+    yyr.init_display()
+
+
+def bench_levelgen(count=200):
+    start = time.perf_counter()
+    for seed in range(count):
+        levelgen.generate_level(seed=seed)
+    return {"levelgen_levels_per_s": count / (time.perf_counter() - start)}
+
+
+def bench_create_level(count=50):
+    setup_display()
+    yyr.create_level(seed=0)  # Builds the sprite atlas, which only happens once per run
+    start = time.perf_counter()
+    for seed in range(count):
+        yyr.create_level(seed=seed)
+    return {"create_level_ms": (time.perf_counter() - start) / count * 1000}
+
+
+def bench_collisions(count=200000):
+    level = levelgen.generate_level(seed=1)
+    tiles = tilegrid.TileGrid(level, sim.tile_size, sim.wall_size)
+    rng = random.Random(1)
+    positions = [(rng.randrange(-20, sim.width), rng.randrange(-20, sim.height)) for _ in range(1000)]
+    collides = tiles.collides
+    width = sim.character_width
+    height = sim.character_height
+    start = time.perf_counter()
+    for _ in range(count // len(positions)):
+        for x, y in positions:
+            collides(x, y, width, height)
+    return {"collision_checks_per_s": count / (time.perf_counter() - start)}
+
+
+def bench_sim(ticks=20000):
+    # Characters that never run out of lives, so every tick moves and checks collisions
+    rng = random.Random(1)
+    state = sim.GameState(levelgen.generate_level(seed=1))
+    state.character_a.lives = state.character_b.lives = ticks
+    choices = [sim.LEFT, sim.RIGHT, sim.UP, sim.DOWN, sim.LEFT | sim.BOOST, sim.REWIND_A]
+    inputs = [rng.choice(choices) for _ in range(ticks // 10)]
+    start = time.perf_counter()
+    for tick in range(ticks):
+        sim.step(state, inputs[tick // 10])
+    return {"sim_ticks_per_s": ticks / (time.perf_counter() - start)}
+
+
+class TickClock:
+    # Stands in for the time module in yyr so that every frame is one tick later than the
+    # last, however long it really took. A hair over one tick, so rounding never drops one.
+    def __init__(self):
+        self.now = 0.0
+        self.step = 1.0001 / sim.tick_rate
+
+    def perf_counter(self):
+        return self.now
+
+    def advance(self):
+        self.now += self.step
+
+
+def bench_frames(frames=4000):
+    # Plays through main() with a scripted input sequence and an uncapped frame rate,
+    # one tick per frame, and reads the time of every frame back from the frame
+    # profiler. The profiler still times the frames with the real clock.
+    rng = random.Random(1)
+    random.seed(1)
+    keys = [pygame.K_LEFT, pygame.K_RIGHT, pygame.K_UP, pygame.K_DOWN, pygame.K_LSHIFT, pygame.K_q, pygame.K_e]
+    script = {}
+    held = None
+    for frame in range(0, frames, 15):
+        events = []
+        if held is not None:
+            events.append(pygame.event.Event(pygame.KEYUP, key=held, mod=0, unicode="", scancode=0))
+        held = rng.choice(keys)
+        events.append(pygame.event.Event(pygame.KEYDOWN, key=held, mod=0, unicode="", scancode=0))
+        script[frame] = events
+    enter = pygame.event.Event(pygame.KEYDOWN, key=pygame.K_RETURN, mod=0, unicode="\r", scancode=0)
+    played = [0]
+    ticks = [0]
+    clock = TickClock()
+
+    def scripted_get(*args, **kwargs):
+        events = original_get(*args, **kwargs)
+        frame = played[0]
+        played[0] += 1
+        clock.advance()
+        events.extend(script.get(frame, []))
+        if frame >= frames:
+            events.append(pygame.event.Event(pygame.QUIT))
+        return events
+
+    def scripted_wait(timeout):
+        # The static screens only ever see ENTER, so a lost game starts again straight away
+        return [enter]
+
+    def counted_step(*args, **kwargs):
+        ticks[0] += 1
+        return original_step(*args, **kwargs)
+
+    original_get = pygame.event.get
+    original_wait = yyr.wait_for_events
+    original_step = sim.step
+    settings = (yyr.fps, yyr.frame_budget, yyr.profile_frames, yyr.profile_dir, yyr.profile_capacity,
+                yyr.save_replays)
+    with tempfile.TemporaryDirectory() as directory:
+        pygame.event.get = scripted_get
+        yyr.wait_for_events = scripted_wait
+        yyr.time = clock
+        sim.step = counted_step
+        yyr.fps = 0
+        yyr.frame_budget = "cap"
+        yyr.profile_frames = True
+        yyr.profile_dir = directory
+        yyr.profile_capacity = frames + 1
+        yyr.save_replays = False
+        assets.clear()
+        textcache.clear()
+        stdout = sys.stdout
+        sys.stdout = open(os.devnull, "w")
+        try:
+            yyr.main()
+        except SystemExit:
+            pass
+        finally:
+            sys.stdout.close()
+            sys.stdout = stdout
+            pygame.event.get = original_get
+            yyr.wait_for_events = original_wait
+            yyr.time = time
+            sim.step = original_step
+            (yyr.fps, yyr.frame_budget, yyr.profile_frames, yyr.profile_dir, yyr.profile_capacity,
+             yyr.save_replays) = settings
+        frames_name = next(name for name in os.listdir(directory) if name.endswith(".csv"))
+        with open(os.path.join(directory, frames_name), newline="") as frames_file:
+            rows = list(csv.DictReader(frames_file))
+    # Frames that end a game run no tick, everything else should have run one
+    if ticks[0] < frames * 0.9:
+        raise RuntimeError(f"Only {ticks[0]} ticks ran in {frames} frames, the scripted inputs were not played")
+    plain = sorted(float(row["frame_ms"]) for row in rows if float(row["flash_ms"]) <= flash_frame_ms)
+    flashed = sorted(float(row["frame_ms"]) for row in rows if float(row["flash_ms"]) > flash_frame_ms)
+    if not flashed:
+        raise RuntimeError("No character was hit, the flash frames were not measured")
+    return {
+        "frame_ms_p50": profiler.percentile(plain, 50),
+        "frame_ms_p95": profiler.percentile(plain, 95),
+        "flash_frame_ms_p50": profiler.percentile(flashed, 50),
+        "flash_frame_ms_p95": profiler.percentile(flashed, 95),
+    }
+
+
+def bench_show_text(count=5000):
+    setup_display()
+    window = yyr.window
+    start = time.perf_counter()
+    for _ in range(count):
+        yyr.show_text(window, "Press ENTER to Restart", 36, yyr.black, (400, 300))
+    cached = (time.perf_counter() - start) / count * 1e6
+
+    strings = [f"Time taken: {index / 100:.2f} seconds" for index in range(count // 10)]
+    start = time.perf_counter()
+    for text in strings:
+        yyr.show_text(window, text, 36, yyr.black, (400, 300))
+    uncached = (time.perf_counter() - start) / len(strings) * 1e6
+    textcache.clear()
+    return {"show_text_cached_us": cached, "show_text_uncached_us": uncached}
+
+
+# Each benchmark with the metrics it reports. The frame benchmark shuts pygame down
+# when main() exits, so it goes last.
+benchmarks = [
+    (bench_levelgen, ("levelgen_levels_per_s",)),
+    (bench_create_level, ("create_level_ms",)),
+    (bench_collisions, ("collision_checks_per_s",)),
+    (bench_sim, ("sim_ticks_per_s",)),
+    (bench_show_text, ("show_text_cached_us", "show_text_uncached_us")),
+    (bench_frames, ("frame_ms_p50", "frame_ms_p95", "flash_frame_ms_p50", "flash_frame_ms_p95")),
+]
+
+
+def run(selected=None):
+    results = {}
+    for benchmark, names in benchmarks:
+        names = [name for name in names if not selected or name in selected]
+        if not names:
+            continue
+        runs = [benchmark() for _ in range(repeats)]
+        for name in names:
+            values = [run_results[name] for run_results in runs]
+            # The best run is the one noise was kindest to, the median is steadier
+            results[name] = statistics.median(values)
+    return results
+
+
+def compare(results, baseline):
+    tolerances = baseline.get("tolerances", {})
+    regressions = []
+    print(f"{'metric':<24} {'value':>12} {'baseline':>12} {'change':>8}")
+    for name, value in results.items():
+        expected = baseline["metrics"].get(name)
+        if expected is None:
+            print(f"{name:<24} {value:>12.3f} {'-':>12} {'new':>8}")
+            continue
+        change = (value - expected) / expected
+        # Positive means worse, whichever direction the metric goes
+        worse = -change if metrics[name] else change
+        tolerance = tolerances.get(name, baseline.get("tolerance", default_tolerance))
+        flag = ""
+        if worse > tolerance:
+            regressions.append(name)
+            flag = f"  REGRESSION (tolerance {tolerance:.0%})"
+        print(f"{name:<24} {value:>12.3f} {expected:>12.3f} {change:>+8.1%}{flag}")
+    return regressions
+
+
+def main(args):
+    update = "--update" in args
+    selected = [arg for arg in args if not arg.startswith("--")]
+    unknown = [name for name in selected if name not in metrics]
+    if unknown:
+        print(f"Unknown metrics: {', '.join(unknown)}")
+        return 2
+    results = run(selected)
+
+    baseline = {"tolerance": default_tolerance, "tolerances": {}, "metrics": {}}
+    if os.path.exists(baseline_path):
+        with open(baseline_path) as baseline_file:
+            baseline = json.load(baseline_file)
+    if update:
+        baseline["metrics"].update({name: round(value, 4) for name, value in results.items()})
+        with open(baseline_path, "w") as baseline_file:
+            json.dump(baseline, baseline_file, indent=2)
+            baseline_file.write("\n")
+        print(f"Baseline written to {baseline_path}")
+        for name, value in results.items():
+            print(f"{name:<24} {value:>12.3f}")
+        return 0
+
+    regressions = compare(results, baseline)
+    if regressions:
+        print(f"{len(regressions)} metric(s) regressed: {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
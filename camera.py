@@ -0,0 +1,296 @@
+import time
+from collections import OrderedDict
+
+import pygame
+
+import assets
+
+background_color = (255, 255, 255)
+letterbox_color = (0, 0, 0)
+max_cache_bytes = 32 * 1024 * 1024  # Pixel data kept for rendered chunks
+split_margin = 100  # Pixels kept between the characters and the edge of the view before it splits
+divider_width = 4  # Game screen pixels between the two halves of a split view
+
+
+class Camera:
+    # The part of the world shown on screen. World positions are drawn at
+    # (world_x - camera.x, world_y - camera.y) from (screen_x, screen_y) on the game
+    # screen; when the world is no bigger than the view the camera stays at (0, 0) and
+    # the two are the same.
+    def __init__(self, view_width, view_height, world_width, world_height, screen_x=0, screen_y=0):
+        self.view_width = view_width
+        self.view_height = view_height
+        self.max_x = max(0, world_width - view_width)
+        self.max_y = max(0, world_height - view_height)
+        self.screen_x = screen_x
+        self.screen_y = screen_y
+        self.x = 0
+        self.y = 0
+
+    def follow(self, x, y):
+        # Centers the view on a world position as far as the world edges allow.
+        # Returns True if the camera moved.
+        new_x = min(max(round(x - self.view_width / 2), 0), self.max_x)
+        new_y = min(max(round(y - self.view_height / 2), 0), self.max_y)
+        moved = new_x != self.x or new_y != self.y
+        self.x = new_x
+        self.y = new_y
+        return moved
+
+    def view_rect(self):
+        return pygame.Rect(self.x, self.y, self.view_width, self.view_height)
+
+    def panes(self):
+        return [self]
+
+    def dividers(self):
+        return []
+
+
+class SplitCamera:
+    # Keeps both characters on screen. While they fit in the view together, with
+    # split_margin to spare, one camera follows the middle of the two. When they are
+    # further apart the screen is split in two halves, side by side or one above the
+    # other along the axis they are furthest apart on, and each half follows one of them
+    # until they fit together again. Mirrored movement keeps Yin and Yang drifting apart,
+    # and in large mazes they start on opposite sides.
+    def __init__(self, view_width, view_height, world_width, world_height, margin=split_margin):
+        self.view_width = view_width
+        self.view_height = view_height
+        self.world_width = world_width
+        self.world_height = world_height
+        self.margin = margin
+        self.whole = Camera(view_width, view_height, world_width, world_height)
+        self.split_axis = None  # "x" for halves side by side, "y" for one above the other
+        self.halves = None
+
+    def panes(self):
+        # The cameras to draw, each in its own part of the screen
+        return [self.whole] if self.halves is None else list(self.halves)
+
+    def follow(self, rects):
+        # Follows the (x, y, width, height) world rects of the characters still playing.
+        # Returns True if any camera moved or the screen was split or joined.
+        left = min(x for x, y, w, h in rects)
+        right = max(x + w for x, y, w, h in rects)
+        top = min(y for x, y, w, h in rects)
+        bottom = max(y + h for x, y, w, h in rects)
+        # Joining again needs more room than splitting, so the view does not flicker
+        # between the two at the edge. Along an axis the whole world fits on, they always fit.
+        margin = self.margin if self.halves is None else 2 * self.margin
+        fits_x = self.world_width <= self.view_width or right - left <= self.view_width - 2 * margin
+        fits_y = self.world_height <= self.view_height or bottom - top <= self.view_height - 2 * margin
+        if len(rects) < 2 or (fits_x and fits_y):
+            changed = self.halves is not None
+            self.split_axis = None
+            self.halves = None
+            return self.whole.follow((left + right) / 2, (top + bottom) / 2) or changed
+
+        axis = "y" if fits_x else "x" if fits_y else (
+            "x" if (right - left) / self.view_width >= (bottom - top) / self.view_height else "y")
+        changed = axis != self.split_axis
+        if changed:
+            self.split_axis = axis
+            if axis == "x":
+                half = self.view_width // 2
+                self.halves = (Camera(half, self.view_height, self.world_width, self.world_height),
+                               Camera(self.view_width - half, self.view_height, self.world_width,
+                                      self.world_height, screen_x=half))
+            else:
+                half = self.view_height // 2
+                self.halves = (Camera(self.view_width, half, self.world_width, self.world_height),
+                               Camera(self.view_width, self.view_height - half, self.world_width,
+                                      self.world_height, screen_y=half))
+        # The first half shows the character closer to the left (or top)
+        index = 0 if axis == "x" else 1
+        ordered = sorted(rects, key=lambda rect: rect[index])
+        for half, (x, y, w, h) in zip(self.halves, (ordered[0], ordered[-1])):
+            changed = half.follow(x + w / 2, y + h / 2) or changed
+        return changed
+
+    def dividers(self):
+        # Game screen rects between the halves, none when the screen is not split
+        if self.halves is None:
+            return []
+        second = self.halves[1]
+        if self.split_axis == "x":
+            return [pygame.Rect(second.screen_x - divider_width // 2, 0, divider_width, self.view_height)]
+        return [pygame.Rect(0, second.screen_y - divider_width // 2, self.view_width, divider_width)]
+
+
+class Viewport:
+    # Where the width x height game screen goes in a window of another size. The screen
+    # is scaled by the largest factor that fits, a whole number with integer=True (unless
+    # the window is smaller than the game), and centered with letterbox bars around it.
+    # Everything is drawn straight at this scale, the frame itself is never rescaled.
+    def __init__(self, window_width, window_height, width, height, integer=False):
+        scale = min(window_width / width, window_height / height)
+        if integer and scale >= 1:
+            scale = int(scale)
+        self.scale = scale
+        self.window_size = (window_width, window_height)
+        self.rect = pygame.Rect(0, 0, round(width * scale), round(height * scale))
+        self.rect.center = (window_width // 2, window_height // 2)
+
+    def length(self, value):
+        return max(1, round(value * self.scale))
+
+    def size(self, width, height):
+        return self.length(width), self.length(height)
+
+    def point(self, x, y):
+        # Window position of a point on the game screen
+        return self.rect.x + round(x * self.scale), self.rect.y + round(y * self.scale)
+
+    def area(self, rect):
+        # Window rect of a rect on the game screen
+        left, top = self.point(rect.x, rect.y)
+        right, bottom = self.point(rect.right, rect.bottom)
+        return pygame.Rect(left, top, right - left, bottom - top)
+
+    def pane(self, camera):
+        # Window rect the camera's view is drawn in
+        left, top = self.point(camera.screen_x, camera.screen_y)
+        right, bottom = self.point(camera.screen_x + camera.view_width, camera.screen_y + camera.view_height)
+        return pygame.Rect(left, top, right - left, bottom - top)
+
+    def world_point(self, x, y, camera):
+        # Window position of a world position, rounded the same way as ChunkedLevel
+        # places its tiles so sprites and walls line up at any scale
+        left, top = self.point(camera.screen_x, camera.screen_y)
+        return (left + round(x * self.scale) - round(camera.x * self.scale),
+                top + round(y * self.scale) - round(camera.y * self.scale))
+
+
+class ChunkedLevel:
+    # The static part of a level (background tiles and walls), rendered in square
+    # chunks of chunk_tiles x chunk_tiles tiles the first time they come into view.
+    # Only the chunks overlapping the view are drawn, and once the rendered chunks hold
+    # more than max_bytes the least recently used are dropped, so the memory used does
+    # not grow with the maze. The walls come from `tiles` (a TileGrid or anything with
+    # the same rows, cols and is_wall()). Chunks are rendered `scale` times their size in
+    # the world, for a Viewport with the same scale.
+    def __init__(self, tiles, tile_size, chunk_tiles=8, max_bytes=max_cache_bytes, scale=1):
+        self.tiles = tiles
+        self.rows = tiles.rows
+        self.cols = tiles.cols
+        self.tile_size = tile_size
+        self.chunk_tiles = chunk_tiles
+        self.chunk_size = chunk_tiles * tile_size
+        self.scale = scale
+        # Scaled up chunks take more memory each, the budget grows with them so the same
+        # number of chunks fit
+        self.max_bytes = max_bytes * max(1, scale * scale)
+        self.chunks = OrderedDict()
+        self.cache_bytes = 0
+        self.renders = 0
+
+    def chunk(self, chunk_col, chunk_row):
+        key = (chunk_col, chunk_row)
+        surface = self.chunks.get(key)
+        if surface is not None:
+            self.chunks.move_to_end(key)
+            return surface
+
+        pixel = self.pixel
+        tile_size = self.tile_size
+        first_row = chunk_row * self.chunk_tiles
+        first_col = chunk_col * self.chunk_tiles
+        last_col = min(first_col + self.chunk_tiles, self.cols)
+        last_row = min(first_row + self.chunk_tiles, self.rows)
+        left = pixel(first_col * tile_size)
+        top = pixel(first_row * tile_size)
+        # Chunks on the edge of the maze stop where it does. They are created in the display
+        # format straight away, convert() would make a second copy.
+        size = (pixel(last_col * tile_size) - left, pixel(last_row * tile_size) - top)
+        display = pygame.display.get_surface()
+        if display is not None:
+            surface = pygame.Surface(size, 0, display)
+        else:
+            surface = pygame.Surface(size).convert()
+        is_wall = self.tiles.is_wall
+        # At fractional scales tiles are a pixel wider or taller here and there, so that
+        # they still add up to the scaled size of the maze without gaps
+        columns = [(col_index, pixel(col_index * tile_size) - left,
+                    pixel((col_index + 1) * tile_size) - pixel(col_index * tile_size))
+                   for col_index in range(first_col, last_col)]
+        images = {}
+        for row_index in range(first_row, last_row):
+            y = pixel(row_index * tile_size) - top
+            tile_height = pixel((row_index + 1) * tile_size) - pixel(row_index * tile_size)
+            for col_index, x, tile_width in columns:
+                size = (tile_width, tile_height)
+                if size not in images:
+                    images[size] = (assets.get("background-tile", size), assets.get("spike-wall", size))
+                background_tile, block_img = images[size]
+                surface.blit(background_tile, (x, y))
+                if is_wall(col_index, row_index):
+                    surface.blit(block_img, (x, y))
+        self.chunks[key] = surface
+        self.cache_bytes += surface.get_width() * surface.get_height() * surface.get_bytesize()
+        self.renders += 1
+        while self.cache_bytes > self.max_bytes and len(self.chunks) > 1:
+            _, old_surface = self.chunks.popitem(last=False)
+            self.cache_bytes -= old_surface.get_width() * old_surface.get_height() * old_surface.get_bytesize()
+        return surface
+
+    def pixel(self, value):
+        return round(value * self.scale)
+
+    def visible_chunks(self, camera):
+        chunk_size = self.chunk_size
+        view = camera.view_rect()
+        last_chunk_col = min(view.right - 1, self.cols * self.tile_size - 1) // chunk_size
+        last_chunk_row = min(view.bottom - 1, self.rows * self.tile_size - 1) // chunk_size
+        for chunk_row in range(view.y // chunk_size, last_chunk_row + 1):
+            for chunk_col in range(view.x // chunk_size, last_chunk_col + 1):
+                yield chunk_col, chunk_row
+
+    def render_visible(self, view, budget):
+        # Renders the chunks under the view's cameras that are not cached yet, until
+        # `budget` seconds have passed. Returns True once all of them are ready.
+        deadline = time.perf_counter() + budget
+        for camera in view.panes():
+            for key in self.visible_chunks(camera):
+                if key in self.chunks:
+                    continue
+                if time.perf_counter() >= deadline:
+                    return False
+                self.chunk(*key)
+        return True
+
+    def placements(self, camera, area, scale):
+        # (chunk surface, rect) for every chunk under the camera, with the view's top left
+        # corner at the top left of `area`. The rects are at `scale`, which is not the
+        # chunks' own scale while a texture renderer is still showing the chunks from
+        # before a resize.
+        chunk_size = self.chunk_size
+        maze_width = self.cols * self.tile_size
+        maze_height = self.rows * self.tile_size
+        camera_x = area.x - round(camera.x * scale)
+        camera_y = area.y - round(camera.y * scale)
+        for chunk_col, chunk_row in self.visible_chunks(camera):
+            left = round(chunk_col * chunk_size * scale)
+            top = round(chunk_row * chunk_size * scale)
+            right = round(min((chunk_col + 1) * chunk_size, maze_width) * scale)
+            bottom = round(min((chunk_row + 1) * chunk_size, maze_height) * scale)
+            rect = pygame.Rect(camera_x + left, camera_y + top, right - left, bottom - top)
+            yield self.chunk(chunk_col, chunk_row), rect
+
+    def draw(self, surface, view, viewport=None):
+        # Draws the world under each of the view's cameras onto `surface`, in its part of
+        # the screen, or of the viewport with bars around it
+        if viewport is None:
+            viewport = Viewport(*surface.get_size(), *surface.get_size())
+        if viewport.rect != surface.get_rect():
+            surface.fill(letterbox_color)
+        clip = surface.get_clip()
+        for camera in view.panes():
+            area = viewport.pane(camera)
+            surface.fill(background_color, area)
+            surface.set_clip(area)
+            for chunk, rect in self.placements(camera, area, self.scale):
+                surface.blit(chunk, rect)
+        surface.set_clip(clip)
+        for divider in view.dividers():
+            surface.fill(letterbox_color, viewport.area(divider))
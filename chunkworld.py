@@ -0,0 +1,150 @@
+from collections import OrderedDict
+
+import numpy as np
+
+import levelgen
+import sim
+
+# An endless maze made of chunk_rows x chunk_cols tile chunks. Every chunk is carved
+# from its own random generator seeded with (world seed, chunk column, chunk row), so
+# any chunk can be thrown away and generated again identically. Each chunk has a wall
+# border with doors in it, and a door's position only depends on the world seed and
+# the edge it is on, so the chunks on both sides of an edge always agree on it.
+#
+# The world is world_chunks chunks across in each direction and play starts in the
+# middle, which at 800 pixels per chunk puts the edges millions of pixels away.
+world_chunks = 1 << 16
+doors_per_edge = 2
+max_cache_bytes = 64 * 1024  # Wall data kept for recently used chunks
+
+# Edge kinds used when seeding door positions
+east_edge = 0
+south_edge = 1
+
+
+class ChunkWorld:
+    # Provides the same rows, cols, is_wall() and collides() as TileGrid, for a maze
+    # that is generated as it is used
+    def __init__(self, seed, chunk_rows=levelgen.grid_rows, chunk_cols=levelgen.grid_cols,
+                 tile_size=sim.tile_size, wall_size=sim.wall_size, max_bytes=max_cache_bytes):
+        self.seed = seed
+        self.chunk_rows = chunk_rows
+        self.chunk_cols = chunk_cols
+        self.rows = chunk_rows * world_chunks
+        self.cols = chunk_cols * world_chunks
+        self.tile_size = tile_size
+        self.wall_size = wall_size
+        self.max_bytes = max_bytes
+        self.chunks = OrderedDict()  # (chunk_col, chunk_row) -> bytearray of walls, one byte per tile
+        self.cache_bytes = 0
+        self.generated = 0
+        self.start_chunk = (world_chunks // 2, world_chunks // 2)
+
+    def door_positions(self, edge, chunk_col, chunk_row, length):
+        # Positions along an edge (away from the corners) where both chunks leave the border open
+        rng = np.random.default_rng([self.seed, edge, chunk_col % world_chunks, chunk_row % world_chunks])
+        return rng.choice(np.arange(1, length - 1), size=min(doors_per_edge, length - 2), replace=False).tolist()
+
+    def generate_chunk(self, chunk_col, chunk_row):
+        rows = self.chunk_rows
+        cols = self.chunk_cols
+        rng = np.random.default_rng([self.seed, chunk_col, chunk_row])
+        maze = np.full((rows, cols), levelgen.wall_cell, dtype=np.uint8)
+        maze[1:-1, 1:-1] = levelgen.carve_prim(rows - 2, cols - 2, rng)
+
+        # Doors: (border cell, step inwards) for every door on the four edges
+        doors = []
+        for row in self.door_positions(east_edge, chunk_col - 1, chunk_row, rows):
+            doors.append((row, 0, 0, 1))
+        for row in self.door_positions(east_edge, chunk_col, chunk_row, rows):
+            doors.append((row, cols - 1, 0, -1))
+        for col in self.door_positions(south_edge, chunk_col, chunk_row - 1, cols):
+            doors.append((0, col, 1, 0))
+        for col in self.door_positions(south_edge, chunk_col, chunk_row, cols):
+            doors.append((rows - 1, col, -1, 0))
+        for row, col, row_step, col_step in doors:
+            # Open the border, then dig inwards until the carved maze is reached
+            maze[row, col] = levelgen.path_cell
+            row += row_step
+            col += col_step
+            while 0 < row < rows - 1 and 0 < col < cols - 1 and maze[row, col] != levelgen.path_cell:
+                maze[row, col] = levelgen.path_cell
+                row += row_step
+                col += col_step
+
+        self.generated += 1
+        return bytearray((maze == levelgen.wall_cell).astype(np.uint8).tobytes())
+
+    def chunk(self, chunk_col, chunk_row):
+        key = (chunk_col, chunk_row)
+        walls = self.chunks.get(key)
+        if walls is not None:
+            self.chunks.move_to_end(key)
+            return walls
+        walls = self.generate_chunk(chunk_col, chunk_row)
+        self.chunks[key] = walls
+        self.cache_bytes += len(walls)
+        # Drop the chunks used longest ago, which are the ones furthest behind the players
+        while self.cache_bytes > self.max_bytes and len(self.chunks) > 1:
+            _, old_walls = self.chunks.popitem(last=False)
+            self.cache_bytes -= len(old_walls)
+        return walls
+
+    def is_wall(self, col, row):
+        if 0 <= col < self.cols and 0 <= row < self.rows:
+            chunk_col, local_col = divmod(col, self.chunk_cols)
+            chunk_row, local_row = divmod(row, self.chunk_rows)
+            return self.chunk(chunk_col, chunk_row)[local_row * self.chunk_cols + local_col] == 1
+        return False
+
+    def collides(self, x, y, w, h):
+        # Same test as TileGrid.collides
+        if w <= 0 or h <= 0:
+            return False
+        tile_size = self.tile_size
+        wall_size = self.wall_size
+        first_col = max(x // tile_size, 0)
+        last_col = min((x + w - 1) // tile_size, self.cols - 1)
+        first_row = max(y // tile_size, 0)
+        last_row = min((y + h - 1) // tile_size, self.rows - 1)
+        for row in range(first_row, last_row + 1):
+            if y >= row * tile_size + wall_size:
+                continue
+            for col in range(first_col, last_col + 1):
+                if x < col * tile_size + wall_size and self.is_wall(col, row):
+                    return True
+        return False
+
+    def start_level(self):
+        # The starting chunk as level strings with Yin and Yang on open tiles near its
+        # bottom corners, and its top left corner in world pixels
+        chunk_col, chunk_row = self.start_chunk
+        walls = self.chunk(chunk_col, chunk_row)
+        level = [[levelgen.wall if walls[row * self.chunk_cols + col] else levelgen.path
+                  for col in range(self.chunk_cols)] for row in range(self.chunk_rows)]
+        open_tiles = [(row, col) for row in range(self.chunk_rows - 2, 0, -1)
+                      for col in range(1, self.chunk_cols - 1) if level[row][col] == levelgen.path]
+        row, col = min(open_tiles, key=lambda tile: (-tile[0], tile[1]))
+        level[row][col] = levelgen.character_a_marker
+        row, col = min(open_tiles, key=lambda tile: (-tile[0], -tile[1]))
+        level[row][col] = levelgen.character_b_marker
+        origin_x = chunk_col * self.chunk_cols * self.tile_size
+        origin_y = chunk_row * self.chunk_rows * self.tile_size
+        return ["".join(row) for row in level], origin_x, origin_y
+
+    def new_game(self, **options):
+        level, origin_x, origin_y = self.start_level()
+        return sim.GameState(level, tiles=self, origin_x=origin_x, origin_y=origin_y, **options)
+
+
+def generate_world(rows=levelgen.grid_rows, cols=levelgen.grid_cols, seed=None):
+    # Same call as levelgen.generate_level, for LevelPool. The chunks around the start
+    # are generated up front.
+    if seed is None:
+        seed = int(np.random.default_rng().integers(2 ** 63))
+    world = ChunkWorld(seed, rows, cols)
+    chunk_col, chunk_row = world.start_chunk
+    for row_offset in (-1, 0, 1):
+        for col_offset in (-1, 0, 1):
+            world.chunk(chunk_col + col_offset, chunk_row + row_offset)
+    return world
@@ -0,0 +1,108 @@
+import time
+from array import array
+
+import pygame
+
+import profiler
+import sim
+
+# Keys and the input bits they hold down
+key_bits = {
+    pygame.K_LEFT: sim.LEFT,
+    pygame.K_RIGHT: sim.RIGHT,
+    pygame.K_UP: sim.UP,
+    pygame.K_DOWN: sim.DOWN,
+    pygame.K_LSHIFT: sim.BOOST,
+    pygame.K_RSHIFT: sim.BOOST,
+    pygame.K_q: sim.REWIND_A,
+    pygame.K_e: sim.REWIND_B,
+}
+horizontal = sim.LEFT | sim.RIGHT
+vertical = sim.UP | sim.DOWN
+
+
+class LatencyRecorder:
+    # Seconds from a key transition being read to the first flip showing a tick that
+    # used it, for the last `capacity` transitions
+    def __init__(self, capacity=1000):
+        self.capacity = capacity
+        self.values = array("d", [0.0]) * capacity
+        self.count = 0
+
+    def record(self, seconds):
+        self.values[self.count % self.capacity] = seconds
+        self.count += 1
+
+    def stats(self):
+        # Percentiles in milliseconds, in the same shape as a FrameProfiler.stats() row
+        if not self.count:
+            return None
+        values = sorted(value * 1000 for value in self.values[:min(self.count, self.capacity)])
+        summary = {f"p{percent}": profiler.percentile(values, percent) for percent in profiler.percentiles}
+        summary["max"] = values[-1]
+        return summary
+
+
+class Controls:
+    # Turns key events into one sim input bitmask per tick. Every transition of a game key
+    # is queued with the time it was read, and the next tick takes all of them, so none
+    # are lost when several arrive between two ticks: a key pressed and released before
+    # the next tick still sets its bit for that one tick. When both directions of an axis
+    # are held, the one pressed last wins.
+    def __init__(self, latency=None):
+        self.transitions = []  # (time read, key, pressed)
+        self.held_keys = set()
+        self.held = 0
+        self.last_horizontal = 0
+        self.last_vertical = 0
+        self.shown = []  # Times of the transitions used by ticks that are not on screen yet
+        self.latency = latency if latency is not None else LatencyRecorder()
+
+    def reset(self):
+        self.transitions.clear()
+        self.held_keys.clear()
+        self.held = 0
+        self.shown.clear()
+
+    def handle(self, event):
+        # Queues the event if it is a game key, and returns whether it was
+        if event.type not in (pygame.KEYDOWN, pygame.KEYUP) or event.key not in key_bits:
+            return False
+        self.transitions.append((time.perf_counter(), event.key, event.type == pygame.KEYDOWN))
+        return True
+
+    def next_tick(self):
+        # Input bits for the next tick
+        pressed_bits = 0
+        for read_time, key, pressed in self.transitions:
+            bit = key_bits[key]
+            if pressed:
+                self.held_keys.add(key)
+                pressed_bits |= bit
+                if bit & horizontal:
+                    self.last_horizontal = bit
+                elif bit & vertical:
+                    self.last_vertical = bit
+            else:
+                self.held_keys.discard(key)
+            self.shown.append(read_time)
+        if self.transitions:
+            self.transitions.clear()
+            self.held = 0
+            for key in self.held_keys:
+                self.held |= key_bits[key]
+
+        inputs = self.held | pressed_bits
+        if inputs & horizontal == horizontal:
+            inputs = inputs & ~horizontal | self.last_horizontal
+        if inputs & vertical == vertical:
+            inputs = inputs & ~vertical | self.last_vertical
+        return inputs
+
+    def presented(self):
+        # Called after every flip: the transitions used by the ticks so far are on screen
+        if self.shown:
+            now = time.perf_counter()
+            for read_time in self.shown:
+                self.latency.record(now - read_time)
+            self.shown.clear()
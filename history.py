@@ -0,0 +1,82 @@
+from array import array
+
+
+class PositionHistory:
+    # Fixed capacity ring buffer of (x, y) positions stored in two typed arrays, 4 bytes
+    # per entry with the default int16 typecode. Once full, appending overwrites the
+    # oldest position, like a deque with maxlen.
+    def __init__(self, capacity, typecode="h"):
+        self.capacity = capacity
+        self.typecode = typecode
+        self.xs = array(typecode, [0]) * capacity
+        self.ys = array(typecode, [0]) * capacity
+        self.start = 0  # Slot of the oldest position
+        self.length = 0
+        # Running totals, so a caller can tell what changed between two points in time
+        self.appends = 0
+        self.pops = 0
+
+    def __len__(self):
+        return self.length
+
+    def __bool__(self):
+        return self.length > 0
+
+    def slot(self, positions_back):
+        # Slot of the position `positions_back` entries from the newest (1 is the newest)
+        return (self.start + self.length - positions_back) % self.capacity
+
+    def append(self, x, y):
+        self.appends += 1
+        if self.length == self.capacity:
+            self.xs[self.start] = x
+            self.ys[self.start] = y
+            self.start = (self.start + 1) % self.capacity
+        else:
+            slot = (self.start + self.length) % self.capacity
+            self.xs[slot] = x
+            self.ys[slot] = y
+            self.length += 1
+
+    def peek(self, positions_back=1):
+        if not 1 <= positions_back <= self.length:
+            raise IndexError("history index out of range")
+        slot = self.slot(positions_back)
+        return self.xs[slot], self.ys[slot]
+
+    def pop(self, count=1):
+        # Removes `count` positions and returns the oldest of them, which is where a
+        # character stepping back `count` entries ends up
+        if not 1 <= count <= self.length:
+            raise IndexError("pop from empty history" if not self.length else "history index out of range")
+        position = self.peek(count)
+        self.length -= count
+        self.pops += count
+        return position
+
+    def __getitem__(self, index):
+        if index < 0:
+            return self.peek(-index)
+        return self.peek(self.length - index)
+
+    def entries(self):
+        # Copies of the stored x and y values, oldest first
+        end = self.start + self.length
+        if end <= self.capacity:
+            return self.xs[self.start:end], self.ys[self.start:end]
+        end -= self.capacity
+        return self.xs[self.start:] + self.xs[:end], self.ys[self.start:] + self.ys[:end]
+
+    def load(self, xs, ys):
+        # Replaces the contents with positions from entries()
+        self.length = len(xs)
+        self.start = 0
+        self.xs[:self.length] = xs
+        self.ys[:self.length] = ys
+
+    def clear(self):
+        self.start = 0
+        self.length = 0
+
+    def nbytes(self):
+        return (len(self.xs) + len(self.ys)) * self.xs.itemsize
@@ -1,5 +1,4 @@
-import random
-import time
+import numpy as np
 
 wall = 'X'
 path = '-'
@@ -10,48 +9,132 @@ tile_size = 50
 grid_cols = 16
 grid_rows = 12
 
+# Cell codes used in the uint8 maze grid
+path_cell = 0
+wall_cell = 1
+exit_cell = 2
+character_a_cell = 3
+character_b_cell = 4
+outside_cell = 5  # Only used for the border padding while carving
 
-def create_prim_maze():
-    random.seed(time.time())
-    maze = [[wall for _ in range(grid_cols)] for _ in range(grid_rows)]
-    walls = []
-    start_row = random.randint(1, grid_rows - 2)
-    start_col = random.randint(1, grid_cols - 2)
-    maze[start_row][start_col] = path
-    walls.extend([(start_row - 1, start_col), (start_row + 1, start_col),
-                  (start_row, start_col - 1), (start_row, start_col + 1)])
-
-    while walls:
-        rand_wall = walls.pop(random.randint(0, len(walls) - 1))
-        row, col = rand_wall
-
-        if maze[row][col] == wall:
-            surrounding_cells = sum(
-                1 for r, c in [(row - 1, col), (row + 1, col), (row, col - 1), (row, col + 1)]
-                if 0 <= r < grid_rows and 0 <= c < grid_cols and maze[r][c] == path)
-
-            if surrounding_cells < 2:
-                maze[row][col] = path
-                new_walls = [(row - 1, col), (row + 1, col), (row, col - 1), (row, col + 1)]
-                for wall_pos in new_walls:
-                    r, c = wall_pos
-                    if 0 <= r < grid_rows and 0 <= c < grid_cols and maze[r][c] == wall:
-                        walls.append(wall_pos)
+cell_chars = np.frombuffer((path + wall + exit_marker + character_a_marker + character_b_marker).encode(), dtype=np.uint8)
+
+# Random numbers are drawn from the generator in blocks of this size
+random_batch = 4096
+# How many mazes generate_level() tries before giving up on finding a solvable one
+max_attempts = 100
+
+
+def make_rng(seed=None):
+    if isinstance(seed, np.random.Generator):
+        return seed
+    return np.random.default_rng(seed)
+
+
+def carve_prim(rows, cols, rng):
+    # The grid is stored flat with a one cell border of outside_cell, so the four
+    # neighbours of a cell are always at -1, +1, -stride and +stride with no bounds checks
+    stride = cols + 2
+    padded = np.full((rows + 2, stride), outside_cell, dtype=np.uint8)
+    padded[1:-1, 1:-1] = wall_cell
+    cells = bytearray(padded.tobytes())
+
+    start_row = int(rng.integers(1, rows - 1))
+    start_col = int(rng.integers(1, cols - 1))
+    start = (start_row + 1) * stride + start_col + 1
+    cells[start] = path_cell
+    frontier = [start - stride, start + stride, start - 1, start + 1]
+
+    randoms = rng.random(random_batch).tolist()
+    random_index = 0
+    while frontier:
+        if random_index == random_batch:
+            randoms = rng.random(random_batch).tolist()
+            random_index = 0
+        # Pick a random frontier cell and remove it in O(1) by moving the last entry into its slot
+        pick = int(randoms[random_index] * len(frontier))
+        random_index += 1
+        cell = frontier[pick]
+        last = frontier.pop()
+        if pick < len(frontier):
+            frontier[pick] = last
+
+        if cells[cell] != wall_cell:
+            continue
+        up = cell - stride
+        down = cell + stride
+        left = cell - 1
+        right = cell + 1
+        if (cells[up] == path_cell) + (cells[down] == path_cell) + (cells[left] == path_cell) + (cells[right] == path_cell) < 2:
+            cells[cell] = path_cell
+            if cells[up] == wall_cell:
+                frontier.append(up)
+            if cells[down] == wall_cell:
+                frontier.append(down)
+            if cells[left] == wall_cell:
+                frontier.append(left)
+            if cells[right] == wall_cell:
+                frontier.append(right)
+
+    return np.frombuffer(cells, dtype=np.uint8).reshape(rows + 2, stride)[1:-1, 1:-1].copy()
+
+
+def create_prim_maze(rows=grid_rows, cols=grid_cols, seed=None):
+    rng = make_rng(seed)
+    maze = carve_prim(rows, cols, rng)
 
     # Set entrance and exit
-    maze[grid_rows - 1][1] = character_a_marker
-    maze[grid_rows - 1][grid_cols - 2] = character_b_marker
+    maze[rows - 1, 1] = character_a_cell
+    maze[rows - 1, cols - 2] = character_b_cell
 
-    exit_row = random.randint(0, 2)
-    exit_col = random.randint(2, grid_cols - 3)
-    maze[exit_row][exit_col] = exit_marker
+    exit_row = int(rng.integers(0, 3))
+    exit_col = int(rng.integers(2, cols - 2))
+    maze[exit_row, exit_col] = exit_cell
 
     return maze
 
 
-def generate_level():
-    maze = create_prim_maze()
-    level = ["".join(row) for row in maze]
+def is_solvable(maze):
+    # Both characters have to be able to walk to the exit. That is also all it takes to
+    # finish together, even though one input moves both of them with Yang's horizontal
+    # input mirrored: holding Yin's rewind key once its history is empty keeps Yin on
+    # its start cell while Yang walks alone to the exit, where it is locked, and after
+    # that Yin walks there alone. Walls do not help, a character that walks into one
+    # loses a life and is put back along its history. tests/test_levelgen.py checks this
+    # against a search of the joint (Yin cell, Yang cell) states.
+    rows, cols = maze.shape
+    stride = cols + 2
+    cells = np.pad(maze, 1, constant_values=outside_cell).ravel().tolist()
+    exit_index = cells.index(exit_cell)
+    starts = {cells.index(character_a_cell), cells.index(character_b_cell)}
+
+    reached = [False] * len(cells)
+    reached[exit_index] = True
+    queue = [exit_index]
+    for cell in queue:
+        for neighbour in (cell - 1, cell + 1, cell - stride, cell + stride):
+            if not reached[neighbour] and cells[neighbour] != wall_cell and cells[neighbour] != outside_cell:
+                reached[neighbour] = True
+                queue.append(neighbour)
+    return all(reached[start] for start in starts)
+
+
+def maze_to_level(maze):
+    chars = cell_chars[maze]
+    return [row.tobytes().decode() for row in chars]
+
+
+def generate_level(rows=grid_rows, cols=grid_cols, seed=None, verify=True):
+    rng = make_rng(seed)
+    maze = create_prim_maze(rows, cols, rng)
+    attempts = 1
+    # Reject mazes the two characters cannot finish together and carve a new one
+    while verify and not is_solvable(maze):
+        if attempts == max_attempts:
+            raise RuntimeError(f"No solvable {cols}x{rows} maze found in {max_attempts} attempts")
+        maze = create_prim_maze(rows, cols, rng)
+        attempts += 1
+    level = maze_to_level(maze)
     return level
 
 
@@ -0,0 +1,181 @@
+import hashlib
+import mmap
+import struct
+import sys
+import time
+import zlib
+
+import numpy as np
+
+import levelgen
+import sim
+import tilegrid
+
+# A level pack is a header followed by fixed size records, so level i starts at
+# header_size + i * record_size. A record holds the levelgen seed (0 if the level was
+# not generated), the (row, col) tiles of Yin, Yang and the exit, a CRC32 of the wall
+# bits, and then the walls at one bit per tile, row by row, most significant bit first.
+magic = b"YYLP"
+version = 1
+header_format = "<4sBxHHII"  # magic, version, rows, cols, level count, record size
+header_size = struct.calcsize(header_format)
+record_format = "<QHHHHHHI"  # seed, a_row, a_col, b_row, b_col, exit_row, exit_col, wall CRC
+record_header_size = struct.calcsize(record_format)
+
+
+def wall_bytes(rows, cols):
+    return (rows * cols + 7) // 8
+
+
+class PackedWalls:
+    # One bit per tile read straight out of the pack, indexable like TileGrid.walls
+    def __init__(self, bits):
+        self.bits = bits
+
+    def __getitem__(self, index):
+        return (self.bits[index >> 3] >> (7 - (index & 7))) & 1
+
+
+def encode_level(level, seed=0):
+    chars = np.frombuffer("".join(level).encode(), np.uint8).reshape(len(level), len(level[0]))
+    bits = np.packbits(chars == ord(levelgen.wall)).tobytes()
+    positions = []
+    for marker in (levelgen.character_a_marker, levelgen.character_b_marker, levelgen.exit_marker):
+        matches = np.argwhere(chars == ord(marker))
+        if not len(matches):
+            raise ValueError(f"Level has no '{marker}' tile")
+        positions.extend(int(value) for value in matches[0])
+    return struct.pack(record_format, seed, *positions, zlib.crc32(bits)) + bits
+
+
+class PackedLevel:
+    # One level of a pack. Decoding is lazy: the walls stay in the pack's memory map.
+    def __init__(self, pack, index):
+        self.pack = pack
+        self.index = index
+        offset = header_size + index * pack.record_size
+        (self.seed, a_row, a_col, b_row, b_col, exit_row, exit_col,
+         self.crc) = struct.unpack_from(record_format, pack.data, offset)
+        self.character_a = (a_row, a_col)
+        self.character_b = (b_row, b_col)
+        self.exit = (exit_row, exit_col)
+        start = offset + record_header_size
+        self.bits = pack.view[start:start + wall_bytes(pack.rows, pack.cols)]
+
+    def tiles(self):
+        return tilegrid.TileGrid.from_walls(PackedWalls(self.bits), self.pack.rows, self.pack.cols,
+                                           sim.tile_size, sim.wall_size)
+
+    def markers(self):
+        # Level strings with only the characters and the exit, which is all GameState
+        # reads from the level when it is given the tiles
+        rows = [[levelgen.path] * self.pack.cols for _ in range(self.pack.rows)]
+        for (row, col), marker in ((self.character_a, levelgen.character_a_marker),
+                                   (self.character_b, levelgen.character_b_marker),
+                                   (self.exit, levelgen.exit_marker)):
+            rows[row][col] = marker
+        return ["".join(row) for row in rows]
+
+    def level(self):
+        # Full level strings, like levelgen.generate_level returns
+        return levelgen.maze_to_level(self.maze())
+
+    def maze(self):
+        # The level as a levelgen cell grid
+        walls = np.unpackbits(np.frombuffer(self.bits, np.uint8), count=self.pack.rows * self.pack.cols)
+        maze = walls.reshape(self.pack.rows, self.pack.cols)  # wall_cell is 1 and path_cell is 0
+        for (row, col), cell in ((self.character_a, levelgen.character_a_cell),
+                                 (self.character_b, levelgen.character_b_cell),
+                                 (self.exit, levelgen.exit_cell)):
+            maze[row, col] = cell
+        return maze
+
+    def new_game(self, **options):
+        return sim.GameState(self.markers(), tiles=self.tiles(), seed=self.seed or None, **options)
+
+    def check(self):
+        return zlib.crc32(self.bits) == self.crc
+
+
+class LevelPack:
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = memoryview(self.data)
+        file_magic, file_version, self.rows, self.cols, self.count, self.record_size = \
+            struct.unpack_from(header_format, self.data)
+        if file_magic != magic or file_version != version:
+            raise ValueError(f"{path} is not a Yin and Yang Reversal level pack")
+        if len(self.data) < header_size + self.count * self.record_size:
+            raise ValueError(f"{path} is truncated")
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        if not 0 <= index < self.count:
+            raise IndexError("level pack index out of range")
+        return PackedLevel(self, index)
+
+    def digest(self):
+        # Identifies the pack by its contents, for players to check they have the same one
+        return hashlib.blake2b(self.data, digest_size=8).digest()
+
+    def generate(self, rows, cols, seed):
+        # Same call as levelgen.generate_level, for LevelPool: picks a level by seed
+        return self[seed % self.count]
+
+    def close(self):
+        self.view.release()
+        self.data.close()
+        self.file.close()
+
+
+def write_pack(path, levels, seeds=None):
+    rows = len(levels[0])
+    cols = len(levels[0][0])
+    record_size = record_header_size + wall_bytes(rows, cols)
+    with open(path, "wb") as pack_file:
+        pack_file.write(struct.pack(header_format, magic, version, rows, cols, len(levels), record_size))
+        for index, level in enumerate(levels):
+            if len(level) != rows or len(level[0]) != cols:
+                raise ValueError(f"Level {index} is not {cols}x{rows}")
+            pack_file.write(encode_level(level, seeds[index] if seeds is not None else 0))
+
+
+def build(path, count, rows=levelgen.grid_rows, cols=levelgen.grid_cols, seed=1):
+    # Generates `count` solvable levels from consecutive seeds and writes them as a pack.
+    # Seeds start at 1, a seed of 0 in a record means the level was not generated.
+    seeds = list(range(seed, seed + count))
+    levels = [levelgen.generate_level(rows, cols, seed=level_seed) for level_seed in seeds]
+    write_pack(path, levels, seeds)
+
+
+def verify(pack):
+    # Checks every level's CRC and solvability, and returns the indices that fail
+    failures = []
+    for index in range(len(pack)):
+        level = pack[index]
+        if not level.check() or not levelgen.is_solvable(level.maze()):
+            failures.append(index)
+    return failures
+
+
+def main(args):
+    if len(args) >= 2 and args[0] == "build":
+        count = int(args[2]) if len(args) > 2 else 1000
+        start = time.perf_counter()
+        build(args[1], count)
+        print(f"Wrote {count} levels to {args[1]} in {time.perf_counter() - start:.2f} s")
+        return 0
+    if len(args) >= 2 and args[0] == "verify":
+        pack = LevelPack(args[1])
+        failures = verify(pack)
+        print(f"{len(pack)} levels, {len(failures)} failed" + (f": {failures}" if failures else ""))
+        return 1 if failures else 0
+    print("usage: python levelpack.py build PACK [COUNT] | verify PACK")
+    return 2
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
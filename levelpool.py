@@ -0,0 +1,62 @@
+import random
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import levelgen
+
+
+class LevelPool:
+    # Keeps `size` upcoming levels ready. Maze layouts are generated on a worker
+    # thread (or process), and `build(layout, seed)` turns a finished layout into
+    # the game's level objects on the main thread, one level per stage() call, so
+    # the work can be spread over idle moments instead of happening when the game
+    # starts. Layouts come from `generate(rows, cols, seed)`. Levels handed out by get()
+    # are only replaced on the next stage() call, so no layout is generated on the worker
+    # while the game that was just started competes with it for the interpreter.
+    def __init__(self, build, size=3, use_processes=False, rows=levelgen.grid_rows, cols=levelgen.grid_cols,
+                 generate=levelgen.generate_level):
+        self.build = build
+        self.generate = generate
+        self.size = size
+        self.rows = rows
+        self.cols = cols
+        if use_processes:
+            self.executor = ProcessPoolExecutor(max_workers=1)
+        else:
+            self.executor = ThreadPoolExecutor(max_workers=1)
+        self.pending = deque()  # (seed, future) pairs for layouts still being generated
+        self.ready = deque()
+        self.fill()
+
+    def fill(self):
+        while len(self.pending) + len(self.ready) < self.size:
+            seed = random.getrandbits(63)
+            self.pending.append((seed, self.executor.submit(self.generate, self.rows, self.cols, seed)))
+
+    def staged(self):
+        return len(self.ready) >= self.size
+
+    def stage(self):
+        # Starts generating layouts for the levels handed out since, and builds the oldest
+        # finished one, if there is one. Returns True if a level was built.
+        self.fill()
+        if not self.pending or not self.pending[0][1].done():
+            return False
+        seed, future = self.pending.popleft()
+        self.ready.append(self.build(future.result(), seed))
+        return True
+
+    def get(self):
+        if self.ready:
+            return self.ready.popleft()
+        if self.pending:
+            # Nothing staged yet, so wait for the next layout and build it right away
+            seed, future = self.pending.popleft()
+            return self.build(future.result(), seed)
+        seed = random.getrandbits(63)
+        return self.build(self.generate(self.rows, self.cols, seed), seed)
+
+    def shutdown(self):
+        for seed, future in self.pending:
+            future.cancel()
+        self.executor.shutdown(wait=False)
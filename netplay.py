@@ -0,0 +1,432 @@
+import heapq
+import random
+import socket
+import struct
+import sys
+import time
+
+import controls
+import levelgen
+import sim
+import snapshot
+
+# Two player co-op over UDP: each player moves one character from their own process.
+# A player's input is applied input_delay ticks after it was read, which hides that much
+# of the network latency. When the other player's input for a tick has not arrived by the
+# time it runs, it is predicted to be the same as their last one; if that turns out to be
+# wrong, the world is restored to that tick from a WorldRecorder and simulated again up to
+# the present with the real inputs.
+#
+# Every packet carries all of the sender's inputs the other player has not acknowledged
+# yet, so a lost packet costs nothing but the wait for the next one. It also says which
+# levels the sender plays, and players that don't play the same ones refuse to start.
+magic = b"YYNP"
+version = 2
+# magic, version, player, match, seed, maze rows, maze cols, endless, pack digest, ack, first tick, input count
+header_format = "<4sBBHQHHB8sIIB"
+header_size = struct.calcsize(header_format)
+max_packet_inputs = 255
+default_port = 7777
+input_delay = 2  # Ticks
+max_rollback = 8  # Ticks a player may run ahead of the other's inputs before waiting for them
+hello_interval = 0.1
+drain_timeout = 1.0
+recorder_seconds = 1
+players = ("Yin", "Yang")
+no_pack = bytes(8)
+# (rows, cols, endless, pack digest) of the levels both players make from the seed
+standard_levels = (levelgen.grid_rows, levelgen.grid_cols, 0, no_pack)
+rewind_bits = (sim.REWIND_A, sim.REWIND_B)
+any_rewind = sim.REWIND_A | sim.REWIND_B
+
+
+def local_inputs(bits, player):
+    # Either rewind key rewinds the player's own character
+    if bits & any_rewind:
+        bits = bits & ~any_rewind | rewind_bits[player]
+    return bits
+
+
+def open_socket(port=0, host=""):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind((host, port))
+    sock.setblocking(False)
+    return sock
+
+
+def level_source(rows, cols, endless=False, pack=None):
+    # What the levels are made from: generated mazes of this size, or the levels of a
+    # levelpack.LevelPack
+    if pack is not None:
+        return pack.rows, pack.cols, 0, pack.digest()
+    return rows, cols, int(endless), no_pack
+
+
+def describe_levels(levels):
+    rows, cols, endless, pack = levels
+    if pack != no_pack:
+        return f"the {cols}x{rows} level pack {pack.hex()}"
+    return f"{'endless' if endless else f'{cols}x{rows}'} mazes"
+
+
+def parse_address(text, port_if_missing=default_port):
+    # "host:port" or ":port", on this machine when the host is left out
+    host, _, port = text.rpartition(":")
+    return socket.gethostbyname(host or "127.0.0.1"), int(port or port_if_missing)
+
+
+class Link:
+    # A UDP socket, sending straight away
+    def __init__(self, sock):
+        self.sock = sock
+
+    def sendto(self, data, address):
+        self.sock.sendto(data, address)
+
+    def receive(self):
+        # (data, address) for every datagram waiting
+        packets = []
+        while True:
+            try:
+                packets.append(self.sock.recvfrom(2048))
+            except (BlockingIOError, InterruptedError):
+                return packets
+            except ConnectionResetError:
+                # Windows reports an earlier send to a closed port this way
+                continue
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.sock.close()
+
+
+class SimulatedLink(Link):
+    # Holds every packet back for `latency` seconds plus up to `jitter` more, which can
+    # reorder them, and drops a `loss` fraction of them, to try netplay over loopback.
+    # `clock` can be replaced to run faster than real time.
+    def __init__(self, sock, latency=0.0, jitter=0.0, loss=0.0, seed=None, clock=time.perf_counter):
+        super().__init__(sock)
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.rng = random.Random(seed)
+        self.clock = clock
+        self.queue = []  # Heap of (due time, order sent, data, address)
+        self.sent = 0
+        self.dropped = 0
+
+    def sendto(self, data, address):
+        self.sent += 1
+        if self.rng.random() < self.loss:
+            self.dropped += 1
+            return
+        due = self.clock() + self.latency + self.rng.random() * self.jitter
+        heapq.heappush(self.queue, (due, self.sent, data, address))
+        self.flush()
+
+    def flush(self):
+        now = self.clock()
+        while self.queue and self.queue[0][0] <= now:
+            due, order, data, address = heapq.heappop(self.queue)
+            self.sock.sendto(data, address)
+
+
+class Session:
+    # One player's end of a co-op game. Player 0 hosts and plays Yin: it picks the seed
+    # every level is made from and learns the other player's address from their first
+    # packet. Player 1 plays Yang and is given the host's address. Both have to make
+    # their levels the same way, `levels` is a level_source().
+    #
+    # Each game is a match, numbered the same on both sides. Once a match has started,
+    # call update() every frame, then can_advance() and advance() for every tick.
+    def __init__(self, link, player, remote=None, seed=None, levels=standard_levels, delay=input_delay,
+                 rollback_limit=max_rollback):
+        self.link = link
+        self.player = player
+        self.remote = remote
+        self.levels = levels
+        self.other_levels = None  # The other player's, when they differ
+        if seed is None and player == 0:
+            seed = random.getrandbits(63)
+        self.seed = seed  # Player 1 gets it from the host
+        self.delay = delay
+        self.rollback_limit = rollback_limit
+        self.heard = False
+        self.match = 0
+        self.state = None
+        self.recorder = None
+        self.local = bytearray()  # This player's input for every tick, delay included
+        self.confirmed = bytearray()  # The other player's, as far as it has arrived
+        self.predicted = bytearray()  # The other player's input each simulated tick ran with
+        self.acked = 0  # How many of this player's inputs the other player has
+        # Time taken by each frame that rolled back, kept like input latency
+        self.rollback_cost = controls.LatencyRecorder()
+        self.frames = 0
+        self.rollbacks = 0
+        self.resimulated = 0
+        self.max_resimulated = 0
+        self.stalls = 0
+        self.packets_sent = 0
+        self.packets_received = 0
+
+    def connect(self, waiting=None, timeout=None):
+        # Blocks until the players have heard from each other, calling `waiting` now and
+        # then. Only player 1 says hello, the host answers once it knows where to.
+        start = time.perf_counter()
+        last_hello = None
+        while not self.heard:
+            now = time.perf_counter()
+            if timeout is not None and now - start > timeout:
+                raise TimeoutError("No answer from the other player")
+            if self.remote is not None and (last_hello is None or now - last_hello >= hello_interval):
+                self.send()
+                last_hello = now
+            self.receive()
+            if self.other_levels is not None:
+                # Tell the other player too, then give up
+                self.send()
+                raise ValueError(f"The other player plays {describe_levels(self.other_levels)}, "
+                                 f"this game plays {describe_levels(self.levels)}")
+            if waiting is not None:
+                waiting()
+            time.sleep(0.01)
+        self.send()
+
+    def next_seed(self):
+        # Level seed of the next match, the same for both players
+        return (self.seed + (self.match + 1) * 0x9E3779B97F4A7C15) % (1 << 63)
+
+    def start_match(self, state):
+        # `state` is a new game on the level made from next_seed()
+        self.drain()
+        self.match += 1
+        self.state = state
+        self.recorder = snapshot.WorldRecorder(state, recorder_seconds)
+        self.local = bytearray(self.delay)  # Nobody has any input for the first `delay` ticks
+        self.confirmed = bytearray()
+        self.predicted = bytearray()
+        self.acked = 0
+        self.send()
+
+    def drain(self):
+        # The other player may not have the last inputs of the previous match yet, and
+        # stops listening for them as soon as the next one starts
+        start = time.perf_counter()
+        while self.state is not None and self.acked < self.state.tick and time.perf_counter() - start < drain_timeout:
+            self.service()
+            time.sleep(0.01)
+
+    def service(self):
+        # Between matches: keeps answering the other player
+        self.receive()
+        self.send()
+
+    def update(self):
+        # Takes in the other player's inputs and rolls back to the first tick that ran
+        # with a wrong prediction. Returns whether it rolled back.
+        self.frames += 1
+        mispredicted = self.receive()
+        if mispredicted is None:
+            return False
+        self.rollback(mispredicted)
+        return True
+
+    def can_advance(self):
+        # False when the next tick would get too far ahead of the other player's inputs
+        if self.state.tick - len(self.confirmed) < self.rollback_limit:
+            return True
+        self.stalls += 1
+        self.send()
+        return False
+
+    def advance(self, bits):
+        # Runs the next tick with this player's input from `delay` ticks ago, and sends this one
+        self.local.append(local_inputs(bits, self.player))
+        self.simulate(self.state.tick)
+        self.send()
+
+    def settled(self):
+        # Whether every tick so far ran with the other player's real inputs, so nothing
+        # can change any more, how the game ended included
+        return len(self.confirmed) >= self.state.tick
+
+    def simulate(self, tick):
+        if tick < len(self.confirmed):
+            remote = self.confirmed[tick]
+        else:
+            remote = self.confirmed[-1] if self.confirmed else 0
+        if tick < len(self.predicted):
+            self.predicted[tick] = remote
+        else:
+            self.predicted.append(remote)
+        if self.player == 0:
+            sim.step(self.state, self.local[tick], remote)
+        else:
+            sim.step(self.state, remote, self.local[tick])
+        self.recorder.record(self.state)
+
+    def rollback(self, tick):
+        start = time.perf_counter()
+        current = self.state.tick
+        self.recorder.restore(self.state, tick)
+        # A game that ended on a wrong prediction can carry on, one that ends earlier now stops there
+        while self.state.tick < current and self.state.status == "playing":
+            self.simulate(self.state.tick)
+        del self.predicted[self.state.tick:]
+        self.rollback_cost.record(time.perf_counter() - start)
+        self.rollbacks += 1
+        self.resimulated += current - tick
+        self.max_resimulated = max(self.max_resimulated, current - tick)
+
+    def send(self):
+        if self.remote is None:
+            return
+        first = min(self.acked, len(self.local))
+        inputs = self.local[first:first + max_packet_inputs]
+        header = struct.pack(header_format, magic, version, self.player, self.match, self.seed or 0,
+                             *self.levels, len(self.confirmed), first, len(inputs))
+        self.link.sendto(header + inputs, self.remote)
+        self.packets_sent += 1
+
+    def receive(self):
+        # Reads every packet waiting, and returns the first tick that ran with a
+        # prediction the other player's real input does not match, if any
+        self.link.flush()
+        mispredicted = None
+        for data, address in self.link.receive():
+            if len(data) < header_size:
+                continue
+            packet_magic, packet_version, player, match, seed, rows, cols, endless, pack, ack, first, count = \
+                struct.unpack_from(header_format, data)
+            if packet_magic != magic or packet_version != version or player == self.player:
+                continue
+            if self.remote is None:
+                self.remote = address
+            elif address != self.remote:
+                continue
+            if (rows, cols, endless, pack) != self.levels:
+                self.other_levels = (rows, cols, endless, pack)
+                continue
+            self.heard = True
+            self.packets_received += 1
+            if player == 0 and self.seed is None:
+                self.seed = seed
+            if match != self.match or self.state is None:
+                continue
+            self.acked = max(self.acked, ack)
+            inputs = data[header_size:header_size + count]
+            # Inputs the packet repeats are skipped, a packet starting past a gap can't be used yet
+            for tick in range(len(self.confirmed), first + len(inputs)):
+                if tick < first:
+                    break
+                bits = inputs[tick - first]
+                self.confirmed.append(bits)
+                if mispredicted is None and tick < len(self.predicted) and self.predicted[tick] != bits:
+                    mispredicted = tick
+        return mispredicted
+
+    def stats(self):
+        cost = self.rollback_cost.stats() or {}
+        return {
+            "frames": self.frames,
+            "rollbacks": self.rollbacks,
+            "resimulated_per_rollback": self.resimulated / self.rollbacks if self.rollbacks else 0.0,
+            "max_resimulated": self.max_resimulated,
+            "rollback_ms": cost,
+            "stalls": self.stalls,
+            "packets_sent": self.packets_sent,
+            "packets_received": self.packets_received,
+        }
+
+    def close(self):
+        self.link.close()
+
+
+def open_session(host_port=None, join=None, levels=standard_levels):
+    # `host_port` to host on that port, or `join` ("host:port") to play with a host
+    if join is not None:
+        return Session(Link(open_socket()), 1, remote=parse_address(join), levels=levels)
+    return Session(Link(open_socket(int(host_port or default_port))), 0, levels=levels)
+
+
+def format_stats(stats):
+    cost = stats["rollback_ms"]
+    costs = " ".join(f"{name} {value:.3f}" for name, value in cost.items()) if cost else "none"
+    return (f"{stats['rollbacks']} rollbacks in {stats['frames']} frames, "
+            f"{stats['resimulated_per_rollback']:.1f} ticks simulated again on average "
+            f"(max {stats['max_resimulated']}), rollback ms: {costs}, "
+            f"{stats['stalls']} stalls, {stats['packets_sent']} packets sent, "
+            f"{stats['packets_received']} received")
+
+
+def loopback_test(ticks=1200, latency=0.05, jitter=0.02, loss=0.1, seed=1):
+    # Two sessions over loopback sockets through SimulatedLinks, running in one process
+    # on a clock that moves one tick per frame. Checks both end in the same state as a
+    # plain run of the same inputs.
+    now = [0.0]
+    clock = lambda: now[0]
+    sockets = [open_socket(host="127.0.0.1") for _ in players]
+    links = [SimulatedLink(sock, latency, jitter, loss, seed + index, clock) for index, sock in enumerate(sockets)]
+    sessions = [Session(links[0], 0, seed=seed), Session(links[1], 1, remote=sockets[0].getsockname())]
+    sessions[1].send()
+    while not all(session.heard for session in sessions):
+        now[0] += 1.0 / sim.tick_rate
+        for session in sessions:
+            session.service()
+
+    rng = random.Random(seed)
+    scripts = [sim.random_inputs(rng, ticks) for _ in players]
+    level = levelgen.generate_level(seed=sessions[1].next_seed())
+    for session in sessions:
+        # Lives to spare keep the game going for the whole script
+        session.start_match(sim.with_spare_lives(sim.GameState(level)))
+    used = [0, 0]
+    frames = 0
+    done = lambda index: used[index] == ticks or sessions[index].state.status != "playing"
+    while not all(done(index) and session.settled() for index, session in enumerate(sessions)):
+        now[0] += 1.0 / sim.tick_rate
+        frames += 1
+        for index, session in enumerate(sessions):
+            session.update()
+            if not done(index) and session.can_advance():
+                session.advance(scripts[index][used[index]])
+                used[index] += 1
+            elif done(index):
+                session.service()
+
+    expected = sim.with_spare_lives(sim.GameState(level))
+    inputs = [bytearray(input_delay) + bytearray(local_inputs(bits, index) for bits in script)
+              for index, script in enumerate(scripts)]
+    for tick in range(ticks):
+        sim.step(expected, inputs[0][tick], inputs[1][tick])
+    results = [(snapshot.capture_scalars(state), [c.history.entries() for c in (state.character_a, state.character_b)])
+               for state in (sessions[0].state, sessions[1].state)]
+    reference = (snapshot.capture_scalars(expected),
+                 [c.history.entries() for c in (expected.character_a, expected.character_b)])
+    for sock in sockets:
+        sock.close()
+    return all(result == reference for result in results), frames, sessions, links
+
+
+def main(args):
+    if args and args[0] == "test":
+        options = dict(arg[2:].split("=", 1) for arg in args[1:] if arg.startswith("--") and "=" in arg)
+        latency = float(options.get("latency", 50)) / 1000
+        jitter = float(options.get("jitter", 20)) / 1000
+        loss = float(options.get("loss", 0.1))
+        ticks = int(options.get("ticks", 1200))
+        ok, frames, sessions, links = loopback_test(ticks, latency, jitter, loss)
+        print(f"{ticks} ticks in {frames} frames, {latency * 1000:.0f} ms latency, "
+              f"{jitter * 1000:.0f} ms jitter, {loss:.0%} loss: {'same state' if ok else 'DESYNC'}")
+        for index, session in enumerate(sessions):
+            print(f"{players[index]} ({links[index].dropped} dropped): {format_stats(session.stats())}")
+        return 0 if ok else 1
+    print("usage: python netplay.py test [--latency=MS] [--jitter=MS] [--loss=FRACTION] [--ticks=N]")
+    print("play with: python yyr.py --host[=PORT] and python yyr.py --join=HOST[:PORT]")
+    return 2
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,152 @@
+import csv
+import json
+import os
+import time
+from array import array
+
+import pygame
+
+import textcache
+
+# Phases of a gameplay frame, in the order they happen
+phases = ("events", "sim", "sprites", "level", "draw", "ui", "flash", "overlay", "display", "wait")
+percentiles = (50, 95, 99)
+overlay_interval = 30  # Frames between overlay refreshes, sorting the buffers every frame would show up in them
+overlay_font_size = 18
+overlay_background = (0, 0, 0)
+overlay_color = (255, 255, 255)
+
+
+def percentile(sorted_values, percent):
+    # Nearest-rank percentile
+    if not sorted_values:
+        return 0.0
+    rank = max(1, -(-len(sorted_values) * percent // 100))
+    return sorted_values[rank - 1]
+
+
+class FrameProfiler:
+    # Times each phase of the last `capacity` frames into ring buffers. mark(phase)
+    # charges the time since the previous mark to `phase`, so timing a phase costs a
+    # single perf_counter() call. `latency` (a controls.LatencyRecorder) adds the input
+    # to display latency to the stats as an "input" row.
+    def __init__(self, capacity=600, latency=None):
+        self.capacity = capacity
+        self.latency = latency
+        self.times = {phase: array("d", [0.0]) * capacity for phase in phases}
+        self.frame_times = array("d", [0.0]) * capacity
+        self.frames = 0
+        self.slot = 0
+        self.frame_start = 0.0
+        self.last_mark = 0.0
+        self.overlay_visible = False
+        self.overlay_surface = None
+        self.overlay_frame = 0
+
+    def begin_frame(self):
+        self.slot = self.frames % self.capacity
+        for times in self.times.values():
+            times[self.slot] = 0.0
+        self.frame_start = self.last_mark = time.perf_counter()
+
+    def mark(self, phase):
+        now = time.perf_counter()
+        self.times[phase][self.slot] += now - self.last_mark
+        self.last_mark = now
+
+    def end_frame(self):
+        self.frame_times[self.slot] = self.last_mark - self.frame_start
+        self.frames += 1
+
+    def recorded(self):
+        # Slots of the recorded frames, oldest first
+        count = min(self.frames, self.capacity)
+        first = self.frames - count
+        return [(first + index) % self.capacity for index in range(count)]
+
+    def stats(self):
+        # Percentiles in milliseconds for every phase and the whole frame
+        slots = self.recorded()
+        columns = dict(self.times)
+        columns["frame"] = self.frame_times
+        summary = {}
+        for name, times in columns.items():
+            values = sorted(times[slot] * 1000 for slot in slots)
+            summary[name] = {f"p{percent}": percentile(values, percent) for percent in percentiles}
+            summary[name]["max"] = values[-1] if values else 0.0
+        latency = self.latency.stats() if self.latency is not None else None
+        if latency is not None:
+            summary["input"] = latency
+        return summary
+
+    def toggle_overlay(self):
+        self.overlay_visible = not self.overlay_visible
+        self.overlay_surface = None
+
+    def draw_overlay(self, screen):
+        # Blits the percentile table in the top left corner and returns its rect
+        if self.overlay_surface is None or self.frames - self.overlay_frame >= overlay_interval:
+            self.overlay_surface = self.render_overlay()
+            self.overlay_frame = self.frames
+        return screen.blit(self.overlay_surface, (0, 0))
+
+    def render_overlay(self):
+        summary = self.stats()
+        rows = [("ms", *(f"p{percent}" for percent in percentiles))]
+        for name, values in summary.items():
+            rows.append((name, *(f"{values[f'p{percent}']:.2f}" for percent in percentiles)))
+        line_height = textcache.get_font(overlay_font_size).get_height()
+        name_width = 70
+        column_width = 50
+        surface = pygame.Surface((name_width + column_width * len(percentiles) + 8, line_height * len(rows) + 8))
+        surface.fill(overlay_background)
+        for row_index, row in enumerate(rows):
+            y = 4 + row_index * line_height
+            surface.blit(textcache.render(row[0], overlay_font_size, overlay_color), (4, y))
+            for column, text in enumerate(row[1:]):
+                text_surface = textcache.render(text, overlay_font_size, overlay_color)
+                # Right aligned, so the decimal points line up
+                x = 4 + name_width + (column + 1) * column_width - text_surface.get_width()
+                surface.blit(text_surface, (x, y))
+        return surface
+
+    def dump(self, directory="profiles"):
+        # Writes every recorded frame to a CSV file and the percentile summary to a JSON
+        # file, and returns both paths
+        if not self.frames:
+            return None
+        os.makedirs(directory, exist_ok=True)
+        base = os.path.join(directory, f"frames-{time.strftime('%Y%m%d-%H%M%S')}")
+        with open(base + ".csv", "w", newline="") as csv_file:
+            writer = csv.writer(csv_file)
+            writer.writerow(["frame", *(f"{phase}_ms" for phase in phases), "frame_ms"])
+            first = self.frames - min(self.frames, self.capacity)
+            for index, slot in enumerate(self.recorded()):
+                writer.writerow([first + index, *(f"{self.times[phase][slot] * 1000:.4f}" for phase in phases),
+                                 f"{self.frame_times[slot] * 1000:.4f}"])
+        with open(base + ".json", "w") as json_file:
+            json.dump({"frames": self.frames, "recorded": min(self.frames, self.capacity), "ms": self.stats()},
+                      json_file, indent=2)
+        return base + ".csv", base + ".json"
+
+
+class DisabledProfiler:
+    # Stands in for FrameProfiler when profiling is off, so the game loop can call it
+    # unconditionally for the cost of an empty method call
+    overlay_visible = False
+    frames = 0
+
+    def begin_frame(self):
+        pass
+
+    def mark(self, phase):
+        pass
+
+    def end_frame(self):
+        pass
+
+    def dump(self, directory="profiles"):
+        return None
+
+
+disabled = DisabledProfiler()
@@ -0,0 +1,125 @@
+import struct
+import sys
+import time
+import zlib
+
+import levelgen
+import sim
+import snapshot
+
+# File layout: a fixed header followed by the zlib compressed input stream, one byte of
+# sim input bits per tick. The header holds everything needed to rebuild the level and
+# the rules it was played with, plus the result the recording claims.
+magic = b"YYRR"
+version = 1
+header_format = "<4sBHHQIBBIII"
+header_size = struct.calcsize(header_format)
+
+
+def state_digest(state):
+    # CRC of the full scalar world state, used to check a re-simulated run ends the same way
+    values = snapshot.capture_scalars(state)
+    return zlib.crc32(struct.pack(f"<{len(values)}q", *values))
+
+
+class Replay:
+    def __init__(self, seed, rows=levelgen.grid_rows, cols=levelgen.grid_cols,
+                 history_length=sim.max_history_length, rewind_speed=sim.rewind_speed, inputs=None):
+        self.seed = seed
+        self.rows = rows
+        self.cols = cols
+        self.history_length = history_length
+        self.rewind_speed = rewind_speed
+        self.inputs = bytearray(inputs or b"")
+        self.final_status = "playing"
+        self.final_tick = 0
+        self.final_digest = 0
+
+    def record(self, inputs):
+        self.inputs.append(inputs)
+
+    def finish(self, state):
+        self.final_status = state.status
+        self.final_tick = state.tick
+        self.final_digest = state_digest(state)
+
+    def completion_time(self):
+        return self.final_tick / sim.tick_rate
+
+    def to_bytes(self):
+        header = struct.pack(header_format, magic, version, self.rows, self.cols, self.seed,
+                             self.history_length, self.rewind_speed, snapshot.status_codes[self.final_status],
+                             self.final_tick, self.final_digest, len(self.inputs))
+        return header + zlib.compress(bytes(self.inputs), 9)
+
+    @classmethod
+    def from_bytes(cls, data):
+        (file_magic, file_version, rows, cols, seed, history_length, rewind_speed, status,
+         final_tick, final_digest, tick_count) = struct.unpack_from(header_format, data)
+        if file_magic != magic or file_version != version:
+            raise ValueError("Not a Yin and Yang Reversal replay")
+        inputs = zlib.decompress(data[header_size:])
+        if len(inputs) != tick_count:
+            raise ValueError("Replay input stream is truncated")
+        replay = cls(seed, rows, cols, history_length, rewind_speed, inputs)
+        replay.final_status = snapshot.status_names[status]
+        replay.final_tick = final_tick
+        replay.final_digest = final_digest
+        return replay
+
+    def save(self, path):
+        with open(path, "wb") as replay_file:
+            replay_file.write(self.to_bytes())
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as replay_file:
+            return cls.from_bytes(replay_file.read())
+
+
+def new_game(replay):
+    level = levelgen.generate_level(replay.rows, replay.cols, seed=replay.seed)
+    return sim.GameState(level, history_length=replay.history_length, rewind_speed=replay.rewind_speed,
+                         seed=replay.seed)
+
+
+def run(replay):
+    state = new_game(replay)
+    step = sim.step
+    for inputs in replay.inputs:
+        step(state, inputs)
+        if state.status != "playing":
+            break
+    return state
+
+
+def verify(replay):
+    # Re-simulates the recording and checks it ends with the claimed result, at the
+    # claimed tick, in exactly the claimed state
+    state = run(replay)
+    ok = (state.status == replay.final_status and state.tick == replay.final_tick
+          and state_digest(state) == replay.final_digest)
+    return ok, state
+
+
+def main(paths):
+    failures = 0
+    total_ticks = 0
+    start = time.perf_counter()
+    for path in paths:
+        replay = Replay.load(path)
+        ok, state = verify(replay)
+        total_ticks += state.tick
+        if not ok:
+            failures += 1
+        result = "ok" if ok else "MISMATCH"
+        print(f"{path}: {result} {state.status} in {state.tick / sim.tick_rate:.2f} s "
+              f"(claimed {replay.final_status} in {replay.completion_time():.2f} s)")
+    elapsed = time.perf_counter() - start
+    if elapsed > 0:
+        print(f"{len(paths)} replays, {total_ticks} ticks in {elapsed:.2f} s ({total_ticks / elapsed:.0f} ticks/s)")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
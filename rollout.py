@@ -0,0 +1,210 @@
+import multiprocessing
+import os
+import sys
+import time
+import traceback
+from multiprocessing import shared_memory
+
+import numpy as np
+
+import batchenv
+import levelgen
+import sim
+
+# Shared buffers, one row per game: (dtype, columns or None for one value per game).
+# Workers write their slice of games in place, so nothing but a short command crosses
+# the pipes.
+buffer_specs = {
+    "actions": (np.int32, None),
+    "observations": (np.int32, len(batchenv.observation_fields)),
+    "rewards": (np.float32, None),
+    "dones": (np.bool_, None),
+    "status": (np.int8, None),  # How each game finished (batchenv.win or game_over) on the tick it was done
+    "ticks": (np.int32, None),  # Length of each game, on the tick it was done
+}
+
+
+def attach_buffers(names, count):
+    memories = {}
+    arrays = {}
+    for name, (dtype, columns) in buffer_specs.items():
+        memory = shared_memory.SharedMemory(name=names[name])
+        shape = (count,) if columns is None else (count, columns)
+        memories[name] = memory
+        arrays[name] = np.ndarray(shape, dtype, buffer=memory.buf)
+    return memories, arrays
+
+
+def worker(names, count, start, stop, rows, cols, seed, max_ticks, connection):
+    memories, arrays = attach_buffers(names, count)
+    views = {name: array[start:stop] for name, array in arrays.items()}
+    try:
+        env = batchenv.BatchEnv(stop - start, rows, cols, seed=seed, max_ticks=max_ticks)
+        views["observations"][:] = env.observe()
+        connection.send(None)
+        while True:
+            command = connection.recv()
+            if command == "step":
+                observations, rewards, dones, info = env.step(views["actions"])
+                views["status"][:] = info["status"]
+                views["ticks"][:] = env.tick
+                if dones.any():
+                    # Finished games start again straight away on a fresh level
+                    observations = env.reset(np.flatnonzero(dones))
+                views["observations"][:] = observations
+                views["rewards"][:] = rewards
+                views["dones"][:] = dones
+            elif command == "reset":
+                views["observations"][:] = env.reset()
+                views["rewards"][:] = 0
+                views["dones"][:] = False
+            elif command == "close":
+                break
+            connection.send(None)
+    except KeyboardInterrupt:
+        pass
+    except Exception:
+        connection.send(traceback.format_exc())
+    finally:
+        del views, arrays
+        for memory in memories.values():
+            memory.close()
+
+
+class RolloutPool:
+    # Runs games_per_worker headless games in each of `workers` processes (one per core
+    # by default). step() hands every game its action and returns (observations,
+    # rewards, dones, info) for all of them; games that finish are reset on a fresh
+    # level before their observation is written. The returned arrays are views of the
+    # shared buffers and are overwritten by the next step, so copy anything you keep.
+    #
+    # step_async() / step_wait() split a step in two, so the caller can work on
+    # something else (like choosing the next actions) while the workers run.
+    def __init__(self, workers=None, games_per_worker=256, rows=levelgen.grid_rows, cols=levelgen.grid_cols,
+                 seed=None, max_ticks=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.count = self.workers * games_per_worker
+        self.memories = {}
+        self.arrays = {}
+        for name, (dtype, columns) in buffer_specs.items():
+            shape = (self.count,) if columns is None else (self.count, columns)
+            size = max(1, int(np.prod(shape)) * np.dtype(dtype).itemsize)
+            memory = shared_memory.SharedMemory(create=True, size=size)
+            self.memories[name] = memory
+            self.arrays[name] = np.ndarray(shape, dtype, buffer=memory.buf)
+            self.arrays[name].fill(0)
+        names = {name: memory.name for name, memory in self.memories.items()}
+
+        seeds = np.random.SeedSequence(seed).spawn(self.workers)
+        context = multiprocessing.get_context("spawn")
+        self.processes = []
+        self.connections = []
+        self.waiting = False
+        for index in range(self.workers):
+            parent_end, child_end = context.Pipe()
+            start = index * games_per_worker
+            worker_seed = int(seeds[index].generate_state(1)[0])
+            process = context.Process(target=worker, daemon=True,
+                                      args=(names, self.count, start, start + games_per_worker,
+                                            rows, cols, worker_seed, max_ticks, child_end))
+            process.start()
+            child_end.close()
+            self.processes.append(process)
+            self.connections.append(parent_end)
+        self.wait()
+
+    def wait(self):
+        for connection in self.connections:
+            try:
+                error = connection.recv()
+            except EOFError:
+                error = "worker process exited"
+            if error is not None:
+                self.close()
+                raise RuntimeError(f"Rollout worker failed:\n{error}")
+
+    def send(self, command):
+        for connection in self.connections:
+            connection.send(command)
+
+    def reset(self):
+        if self.waiting:
+            self.step_wait()
+        self.send("reset")
+        self.wait()
+        return self.arrays["observations"]
+
+    def step_async(self, actions):
+        if self.waiting:
+            raise RuntimeError("step_async() called again before step_wait()")
+        self.arrays["actions"][:] = actions
+        self.send("step")
+        self.waiting = True
+
+    def step_wait(self):
+        self.wait()
+        self.waiting = False
+        arrays = self.arrays
+        info = {"status": arrays["status"], "ticks": arrays["ticks"]}
+        return arrays["observations"], arrays["rewards"], arrays["dones"], info
+
+    def step(self, actions):
+        self.step_async(actions)
+        return self.step_wait()
+
+    def close(self):
+        for connection, process in zip(self.connections, self.processes):
+            if process.is_alive():
+                try:
+                    connection.send("close")
+                except (BrokenPipeError, OSError):
+                    pass
+        for process in self.processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        self.processes = []
+        for connection in self.connections:
+            connection.close()
+        self.connections = []
+        self.arrays = {}
+        for memory in self.memories.values():
+            memory.close()
+            memory.unlink()
+        self.memories = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def main(ticks=300, games_per_worker=1024):
+    # Steps the pool with random inputs for 1, 2, 4... workers up to one per core, to
+    # show how throughput scales
+    choices = np.array([sim.LEFT, sim.RIGHT, sim.UP, sim.DOWN, sim.LEFT | sim.BOOST, sim.REWIND_A, sim.REWIND_B, 0])
+    rng = np.random.default_rng(1)
+    worker_counts = []
+    workers = 1
+    while workers < (os.cpu_count() or 1):
+        worker_counts.append(workers)
+        workers *= 2
+    worker_counts.append(os.cpu_count() or 1)
+    for workers in worker_counts:
+        with RolloutPool(workers, games_per_worker, seed=1) as pool:
+            actions = rng.choice(choices, pool.count)
+            finished = 0
+            start = time.perf_counter()
+            for tick in range(ticks):
+                pool.step_async(actions)
+                actions = rng.choice(choices, pool.count)
+                observations, rewards, dones, info = pool.step_wait()
+                finished += int(dones.sum())
+            elapsed = time.perf_counter() - start
+            print(f"{workers:>3} workers: {pool.count * ticks / elapsed / 1e6:.2f} M game ticks/s, "
+                  f"{finished} games finished")
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
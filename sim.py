@@ -0,0 +1,237 @@
+import history
+import tilegrid
+
+# Game rules. Nothing in here touches the display, fonts or images, so the game can be
+# stepped headless and much faster than real time.
+tile_size = 50
+tick_rate = 60  # Ticks per second; speeds and timers below are counted in ticks
+ui_bar_height = 40
+width, height = 800, 600 + ui_bar_height  # Area the characters are kept inside on the standard maze
+wall_size = 48
+rewind_seconds = 1  # How far back a character can be rewound
+max_history_length = rewind_seconds * tick_rate
+rewind_speed = 1  # History entries stepped back per tick while rewinding
+initial_lives = 2
+invincibility_duration = 2
+flash_ticks = 5
+hit_rewind_positions = 10  # How far back a character is put when it hits a wall
+character_width = 26
+character_height = 35
+
+# Input bits for one tick
+LEFT = 1
+RIGHT = 2
+UP = 4
+DOWN = 8
+BOOST = 16
+REWIND_A = 32
+REWIND_B = 64
+
+# Which characters are standing on the exit
+EXIT_EMPTY = 0
+EXIT_YIN = 1
+EXIT_YANG = 2
+EXIT_COMPLETE = 3
+
+# What random_inputs picks from: every direction, some boosted, and both rewinds
+random_choices = (0, LEFT, RIGHT, UP, DOWN, LEFT | BOOST, UP | BOOST, DOWN | BOOST, RIGHT | UP,
+                  REWIND_A, REWIND_B, REWIND_A | LEFT)
+spare_lives = 10 ** 6  # Enough that random inputs never run a game out of lives
+
+
+def world_size(rows, cols):
+    # Area the characters are kept inside for a maze of this size: the maze plus the
+    # strip under the UI bar, which is the whole window for the standard 16x12 maze
+    return cols * tile_size, rows * tile_size + ui_bar_height
+
+
+def rects_overlap(x, y, w, h, other_x, other_y, other_w, other_h):
+    return x < other_x + other_w and other_x < x + w and y < other_y + other_h and other_y < y + h
+
+
+class CharacterState:
+    def __init__(self, x, y, direction, history_length=max_history_length, rewind_speed=rewind_speed,
+                 history_typecode="h"):
+        self.width = character_width
+        self.height = character_height
+        # Center the character in its tile
+        self.x = x + (tile_size - character_width) // 2
+        self.y = y + (tile_size - character_height) // 2
+        self.direction = direction
+        self.history = history.PositionHistory(history_length, history_typecode)
+        self.rewind_speed = rewind_speed
+        self.speed = 2
+        self.alive = True
+        self.lives = initial_lives
+        self.invincible = False
+        self.invincibility_timer = 0
+        self.flash_red = False
+        self.at_exit = False
+        self.record_position()
+
+    def update(self, inputs, manual_rewind, tiles, bounds_width, bounds_height):
+        if self.invincible:
+            self.invincibility_timer -= 1
+            if self.invincibility_timer <= 0:
+                self.invincible = False
+
+        # If character is at exit, do not allow further movement
+        if self.at_exit:
+            return
+
+        self.speed = 5 if inputs & BOOST else 3
+
+        if manual_rewind:
+            self.reverse_position(self.rewind_speed)
+        else:
+            self.record_position()
+            if inputs & LEFT:
+                self.x -= self.speed * self.direction
+            elif inputs & RIGHT:
+                self.x += self.speed * self.direction
+            elif inputs & UP:
+                self.y -= self.speed
+            elif inputs & DOWN:
+                self.y += self.speed
+
+            if not self.invincible and tiles.collides(self.x, self.y, self.width, self.height):
+                self.alive = False
+                if self.lives > 0:
+                    self.lives -= 1
+                    self.rewind_position_by(hit_rewind_positions)
+                    self.invincible = True
+                    self.invincibility_timer = invincibility_duration
+                    self.flash_red = True
+
+        # Prevent the character from going out of bounds
+        if self.x < 0:
+            self.x = 0
+        elif self.x + self.width > bounds_width:
+            self.x = bounds_width - self.width
+        if self.y < 0:
+            self.y = 0
+        elif self.y + self.height > bounds_height:
+            self.y = bounds_height - self.height
+
+    def lock_position(self):
+        self.at_exit = True
+
+    def record_position(self):
+        if not self.history or self.history.peek() != (self.x, self.y):
+            self.history.append(self.x, self.y)
+
+    def reverse_position(self, steps=1):
+        if self.history:
+            self.x, self.y = self.history.pop(min(steps, len(self.history)))
+            self.alive = True
+
+    def rewind_position_by(self, positions):
+        if len(self.history) >= positions:
+            self.x, self.y = self.history.peek(positions)
+            self.alive = True
+
+
+class GameState:
+    def __init__(self, level, bounds_width=None, bounds_height=None,
+                 history_length=max_history_length, rewind_speed=rewind_speed, seed=None,
+                 tiles=None, origin_x=0, origin_y=0):
+        # `tiles` is anything with TileGrid's rows, cols, is_wall() and collides(), by default
+        # a TileGrid of `level`. `level` is then only read for the characters and exits,
+        # and is placed with its top left tile at (origin_x, origin_y) in the world.
+        self.seed = seed  # levelgen seed the level came from, if known
+        self.tiles = tilegrid.TileGrid(level, tile_size, wall_size) if tiles is None else tiles
+        level_width, level_height = world_size(self.tiles.rows, self.tiles.cols)
+        self.bounds_width = level_width if bounds_width is None else bounds_width
+        self.bounds_height = level_height if bounds_height is None else bounds_height
+        # Positions only fit the compact int16 history on worlds up to 32767 pixels across
+        history_typecode = "h" if max(self.bounds_width, self.bounds_height) <= 32767 else "i"
+        self.exits = []
+        self.character_a = None
+        self.character_b = None
+        for row_index, row in enumerate(level):
+            for col_index, col in enumerate(row):
+                x = origin_x + col_index * tile_size
+                y = origin_y + row_index * tile_size
+                if col == "A":
+                    self.character_a = CharacterState(x, y, 1, history_length, rewind_speed, history_typecode)
+                elif col == "B":
+                    self.character_b = CharacterState(x, y, -1, history_length, rewind_speed, history_typecode)
+                elif col == "E":
+                    self.exits.append((x, y, tile_size, tile_size))
+        self.tick = 0
+        self.status = "playing"  # "playing", "win" or "game_over"
+        self.exit_state = EXIT_EMPTY
+        self.flash_time = 0
+        self.flashing = False  # Whether this tick should be shown with the red hit flash
+
+    def touches_exit(self, character):
+        return any(rects_overlap(character.x, character.y, character.width, character.height, *exit_rect)
+                   for exit_rect in self.exits)
+
+
+def step(state, inputs, inputs_b=None):
+    # `inputs` drives both characters, unless Yang has its own in `inputs_b` (co-op, where
+    # each player moves one character and rewinds it with its own REWIND_ bit)
+    if inputs_b is None:
+        inputs_b = inputs
+    if state.status != "playing":
+        return state
+    character_a = state.character_a
+    character_b = state.character_b
+
+    # Detect if both characters are at the exit
+    character_a_at_exit = state.touches_exit(character_a)
+    character_b_at_exit = state.touches_exit(character_b)
+    if character_a_at_exit and character_b_at_exit:
+        state.exit_state = EXIT_COMPLETE
+    elif character_a_at_exit:
+        state.exit_state = EXIT_YIN
+    elif character_b_at_exit:
+        state.exit_state = EXIT_YANG
+    else:
+        state.exit_state = EXIT_EMPTY
+
+    # Lock character into position if they are at the exit
+    if character_a_at_exit:
+        character_a.lock_position()
+    if character_b_at_exit:
+        character_b.lock_position()
+
+    character_a.update(inputs, inputs & REWIND_A, state.tiles, state.bounds_width, state.bounds_height)
+    character_b.update(inputs_b, inputs_b & REWIND_B, state.tiles, state.bounds_width, state.bounds_height)
+
+    # Determine game over conditions
+    if (not character_a.alive and character_a.lives == 0) or (not character_b.alive and character_b.lives == 0):
+        state.status = "game_over"
+    elif character_a_at_exit and character_b_at_exit:
+        state.status = "win"
+
+    # The red flash stays up for a few ticks after a hit
+    state.flashing = character_a.flash_red or character_b.flash_red
+    if state.flashing:
+        state.flash_time += 1
+        if state.flash_time > flash_ticks:
+            character_a.flash_red = False
+            character_b.flash_red = False
+            state.flash_time = 0
+
+    state.tick += 1
+    return state
+
+
+def random_inputs(rng, ticks, choices=random_choices, change=0.1):
+    # Inputs for `ticks` ticks of headless play from a random.Random: each one is held
+    # for a while, with a `change` chance every tick of switching to another
+    inputs = bytearray()
+    bits = 0
+    for _ in range(ticks):
+        if rng.random() < change:
+            bits = rng.choice(choices)
+        inputs.append(bits)
+    return inputs
+
+
+def with_spare_lives(state, lives=spare_lives):
+    # Keeps a game with random inputs going until it is won instead of ending on lives
+    state.character_a.lives = state.character_b.lives = lives
+    return state
@@ -0,0 +1,207 @@
+import sys
+import time
+from array import array
+from collections import deque
+
+import sim
+
+# Everything about the world that changes while playing. The level layout is fixed for
+# the life of a GameState, so it is not part of a snapshot.
+status_codes = {"playing": 0, "win": 1, "game_over": 2}
+status_names = {code: name for name, code in status_codes.items()}
+character_fields = ("x", "y", "speed", "alive", "lives", "invincible", "invincibility_timer", "flash_red", "at_exit")
+
+
+def capture_scalars(state):
+    values = [state.tick, status_codes[state.status], state.exit_state, state.flash_time, int(state.flashing)]
+    for character in (state.character_a, state.character_b):
+        values.extend(int(getattr(character, field)) for field in character_fields)
+    return values
+
+
+def restore_scalars(state, values):
+    state.tick = values[0]
+    state.status = status_names[values[1]]
+    state.exit_state = values[2]
+    state.flash_time = values[3]
+    state.flashing = bool(values[4])
+    index = 5
+    for character in (state.character_a, state.character_b):
+        for field in character_fields:
+            value = values[index]
+            if field in ("alive", "invincible", "flash_red", "at_exit"):
+                value = bool(value)
+            setattr(character, field, value)
+            index += 1
+
+
+class Keyframe:
+    def __init__(self, state):
+        self.tick = state.tick
+        self.scalars = capture_scalars(state)
+        self.histories = [character.history.entries() for character in (state.character_a, state.character_b)]
+
+    def nbytes(self):
+        total = len(self.scalars) * 8
+        for xs, ys in self.histories:
+            total += (len(xs) + len(ys)) * xs.itemsize
+        return total
+
+
+class WorldRecorder:
+    # Records the whole world every tick: a full Keyframe every keyframe_interval ticks
+    # and a small delta for every tick in between, covering the last `seconds` of play.
+    # Any recorded tick can be restored by loading the keyframe before it and applying
+    # at most keyframe_interval - 1 deltas.
+    #
+    # A delta is an int32 array: the number of changed scalars, then (index, value)
+    # pairs, then for each character the number of history entries popped and
+    # appended, followed by the appended (x, y) if there was one.
+    def __init__(self, state, seconds=10, keyframe_interval=60):
+        self.keyframe_interval = keyframe_interval
+        self.max_segments = max(1, -(-seconds * sim.tick_rate // keyframe_interval)) + 1
+        self.segments = deque()  # [Keyframe, [delta, ...]] for consecutive ticks
+        self.record_time = 0.0
+        self.records = 0
+        self.start(state)
+
+    def start(self, state):
+        self.previous = capture_scalars(state)
+        self.history_counts = [(character.history.appends, character.history.pops)
+                               for character in (state.character_a, state.character_b)]
+        self.segments.append([Keyframe(state), []])
+        while len(self.segments) > self.max_segments:
+            self.segments.popleft()
+
+    def encode_delta(self, state, scalars):
+        delta = array("i", [0])
+        for index, value in enumerate(scalars):
+            if value != self.previous[index]:
+                delta.append(index)
+                delta.append(value)
+        delta[0] = (len(delta) - 1) // 2
+
+        for index, character in enumerate((state.character_a, state.character_b)):
+            history = character.history
+            appends, pops = self.history_counts[index]
+            appended = history.appends - appends
+            popped = history.pops - pops
+            self.history_counts[index] = (history.appends, history.pops)
+            # The simulation either appends one position or pops some in a tick. Anything
+            # else can't be described by a delta, so it gets a keyframe instead.
+            if appended > 1 or (appended and popped):
+                return None
+            delta.append(popped)
+            delta.append(appended)
+            if appended:
+                delta.extend(history.peek())
+        return delta
+
+    def record(self, state):
+        start = time.perf_counter()
+        scalars = capture_scalars(state)
+        keyframe, deltas = self.segments[-1]
+        delta = None
+        if len(deltas) + 1 < self.keyframe_interval and state.tick == keyframe.tick + len(deltas) + 1:
+            delta = self.encode_delta(state, scalars)
+        if delta is None:
+            self.start(state)
+        else:
+            deltas.append(delta)
+            self.previous = scalars
+        self.record_time += time.perf_counter() - start
+        self.records += 1
+
+    def oldest_tick(self):
+        return self.segments[0][0].tick
+
+    def newest_tick(self):
+        keyframe, deltas = self.segments[-1]
+        return keyframe.tick + len(deltas)
+
+    def restore(self, state, tick):
+        # Puts `state` back to how it was at `tick` and forgets everything recorded after it
+        tick = max(self.oldest_tick(), min(tick, self.newest_tick()))
+        while self.segments[-1][0].tick > tick:
+            self.segments.pop()
+        keyframe, deltas = self.segments[-1]
+        del deltas[tick - keyframe.tick:]
+
+        scalars = list(keyframe.scalars)
+        characters = (state.character_a, state.character_b)
+        for character, (xs, ys) in zip(characters, keyframe.histories):
+            character.history.load(xs, ys)
+        for delta in deltas:
+            count = delta[0]
+            for index in range(1, 2 * count + 1, 2):
+                scalars[delta[index]] = delta[index + 1]
+            index = 2 * count + 1
+            for character in characters:
+                popped = delta[index]
+                appended = delta[index + 1]
+                index += 2
+                if popped:
+                    character.history.pop(popped)
+                if appended:
+                    character.history.append(delta[index], delta[index + 1])
+                    index += 2
+        restore_scalars(state, scalars)
+
+        self.previous = scalars
+        self.history_counts = [(character.history.appends, character.history.pops) for character in characters]
+        return state
+
+    def rewind(self, state, seconds):
+        return self.restore(state, state.tick - round(seconds * sim.tick_rate))
+
+    def stats(self):
+        keyframes = len(self.segments)
+        deltas = sum(len(segment[1]) for segment in self.segments)
+        keyframe_bytes = sum(segment[0].nbytes() for segment in self.segments)
+        delta_bytes = sum(delta.buffer_info()[1] * delta.itemsize for segment in self.segments for delta in segment[1])
+        return {
+            "ticks": self.newest_tick() - self.oldest_tick() + 1,
+            "keyframes": keyframes,
+            "deltas": deltas,
+            "keyframe_bytes": keyframe_bytes,
+            "delta_bytes": delta_bytes,
+            "bytes_per_delta": delta_bytes / deltas if deltas else 0.0,
+            "record_us": self.record_time / self.records * 1e6 if self.records else 0.0,
+        }
+
+
+def main():
+    # Records a headless run with random inputs, checks that every recorded tick
+    # restores exactly, and prints the memory and CPU cost
+    import random
+    import levelgen
+
+    rng = random.Random(1)
+    level = levelgen.generate_level(seed=1)
+    # Lives to spare keep the run going long enough to fill the buffer
+    state = sim.with_spare_lives(sim.GameState(level))
+    recorder = WorldRecorder(state, seconds=10)
+    expected = {}
+    for inputs in sim.random_inputs(rng, 3 * 60 * sim.tick_rate):
+        sim.step(state, inputs)
+        recorder.record(state)
+        expected[state.tick] = (capture_scalars(state), [c.history.entries() for c in (state.character_a, state.character_b)])
+
+    stats = recorder.stats()
+    for name, value in stats.items():
+        print(f"{name:>16}: {value:.2f}" if isinstance(value, float) else f"{name:>16}: {value}")
+
+    start = time.perf_counter()
+    restores = 0
+    for tick in range(recorder.newest_tick(), recorder.oldest_tick() - 1, -7):
+        recorder.restore(state, tick)
+        actual = (capture_scalars(state), [c.history.entries() for c in (state.character_a, state.character_b)])
+        if actual != expected[tick]:
+            print(f"restore mismatch at tick {tick}")
+            sys.exit(1)
+        restores += 1
+    print(f"{'restore_us':>16}: {(time.perf_counter() - start) / restores * 1e6:.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,521 @@
+import asyncio
+import json
+import random
+import socket
+import struct
+import subprocess
+import sys
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+import chunkworld
+import levelgen
+import levelpack
+import netplay
+import profiler
+import sim
+import snapshot
+import tilegrid
+
+# Spectators connect over TCP and get a stream of messages, each a message_header
+# (message type, payload length) followed by the payload:
+#   level_message     how to rebuild the level, sent once per game: the world seed of an
+#                     endless maze, or the walls at one bit per tile like a level pack;
+#                     then the world bounds and the exits
+#   keyframe_message  every field of entry_format, sent after a level and to spectators
+#                     that join in the middle of a game
+#   ticks_message     the first tick and how many follow, then for each tick a byte of
+#                     change bits and only the fields they name, in the order of the bits
+#
+# The game thread only appends a tuple of values it read from the state to a deque every
+# tick. A thread running an asyncio server takes them every broadcast_interval, encodes
+# them once and writes the same bytes to every spectator.
+message_header = "<BI"
+message_header_size = struct.calcsize(message_header)
+level_message = 1
+keyframe_message = 2
+ticks_message = 3
+walls_level = 0
+world_level = 1
+level_format = "<BIIHHQIIH"  # kind, rows, cols, tile size, wall size, world seed, bounds width, bounds height, exits
+level_size = struct.calcsize(level_format)
+exit_format = "<iiHH"
+exit_size = struct.calcsize(exit_format)
+# tick, Yin x, y, flags, lives, Yang x, y, flags, lives, game byte (exit state | status << 2 | flashing << 4)
+entry_format = "<IiiBBiiBBB"
+ticks_format = "<IH"
+ticks_size = struct.calcsize(ticks_format)
+# Change bits, two for each character's position: a step fits step_format, a jump (a
+# rewind after a hit, a new game) is sent whole
+a_step, a_jump, a_status, b_step, b_jump, b_status, game_changed = 1, 2, 4, 8, 16, 32, 64
+step_format = "<bb"
+jump_format = "<ii"
+status_format = "<BB"  # flags, lives
+# Character flags
+alive_flag, invincible_flag, at_exit_flag, flash_flag = 1, 2, 4, 8
+default_port = 7778
+broadcast_interval = 1.0 / 30
+max_buffered = 256 * 1024  # Bytes waiting for a spectator before it is dropped as too slow
+
+
+def message(kind, payload):
+    return struct.pack(message_header, kind, len(payload)) + payload
+
+
+def capture(state):
+    # Runs on the game thread every tick, so it only reads values
+    a = state.character_a
+    b = state.character_b
+    return (state.tick, a.x, a.y, a.alive, a.invincible, a.at_exit, a.flash_red, a.lives,
+            b.x, b.y, b.alive, b.invincible, b.at_exit, b.flash_red, b.lives,
+            state.exit_state, state.status, state.flashing)
+
+
+def to_entry(values):
+    (tick, a_x, a_y, a_alive, a_invincible, a_at_exit, a_flash, a_lives,
+     b_x, b_y, b_alive, b_invincible, b_at_exit, b_flash, b_lives, exit_state, status, flashing) = values
+    a_flags = a_alive | a_invincible << 1 | a_at_exit << 2 | a_flash << 3
+    b_flags = b_alive | b_invincible << 1 | b_at_exit << 2 | b_flash << 3
+    game = exit_state | snapshot.status_codes[status] << 2 | flashing << 4
+    return (tick, a_x, a_y, a_flags, min(a_lives, 255), b_x, b_y, b_flags, min(b_lives, 255), game)
+
+
+def apply_entry(state, entry):
+    state.tick = entry[0]
+    for character, index in ((state.character_a, 1), (state.character_b, 5)):
+        character.x = entry[index]
+        character.y = entry[index + 1]
+        flags = entry[index + 2]
+        character.alive = bool(flags & alive_flag)
+        character.invincible = bool(flags & invincible_flag)
+        character.at_exit = bool(flags & at_exit_flag)
+        character.flash_red = bool(flags & flash_flag)
+        character.lives = entry[index + 3]
+    game = entry[9]
+    state.exit_state = game & 3
+    state.status = snapshot.status_names[game >> 2 & 3]
+    state.flashing = bool(game & 16)
+
+
+def encode_level(state):
+    tiles = state.tiles
+    if isinstance(tiles, chunkworld.ChunkWorld):
+        # Any chunk can be generated again from the seed
+        kind, rows, cols, seed, walls = world_level, tiles.chunk_rows, tiles.chunk_cols, tiles.seed, b""
+    elif isinstance(tiles.walls, levelpack.PackedWalls):
+        kind, rows, cols, seed, walls = walls_level, tiles.rows, tiles.cols, 0, bytes(tiles.walls.bits)
+    else:
+        walls = np.packbits(np.frombuffer(tiles.walls, np.uint8)).tobytes()
+        kind, rows, cols, seed = walls_level, tiles.rows, tiles.cols, 0
+    parts = [struct.pack(level_format, kind, rows, cols, tiles.tile_size, tiles.wall_size, seed,
+                         state.bounds_width, state.bounds_height, len(state.exits))]
+    parts.extend(struct.pack(exit_format, *exit_rect) for exit_rect in state.exits)
+    parts.append(walls)
+    return b"".join(parts)
+
+
+def decode_level(payload):
+    # A GameState with the level's tiles, bounds and exits. The characters are placed by
+    # the keyframe that follows.
+    kind, rows, cols, tile_size, wall_size, seed, bounds_width, bounds_height, exit_count = \
+        struct.unpack_from(level_format, payload)
+    exits = [struct.unpack_from(exit_format, payload, level_size + index * exit_size) for index in range(exit_count)]
+    if kind == world_level:
+        tiles = chunkworld.ChunkWorld(seed, rows, cols, tile_size, wall_size)
+    else:
+        start = level_size + exit_count * exit_size
+        walls = levelpack.PackedWalls(payload[start:start + levelpack.wall_bytes(rows, cols)])
+        tiles = tilegrid.TileGrid.from_walls(walls, rows, cols, tile_size, wall_size)
+    state = sim.GameState([levelgen.character_a_marker + levelgen.character_b_marker], bounds_width, bounds_height,
+                          tiles=tiles)
+    state.exits = exits
+    return state
+
+
+def encode_ticks(previous, entries):
+    # `entries` are consecutive ticks, `previous` is the one before the first
+    parts = [struct.pack(ticks_format, entries[0][0], len(entries))]
+    for entry in entries:
+        changes = 0
+        fields = []
+        for index, step_bit, jump_bit, status_bit in ((1, a_step, a_jump, a_status), (5, b_step, b_jump, b_status)):
+            x, y, flags, lives = entry[index:index + 4]
+            dx = x - previous[index]
+            dy = y - previous[index + 1]
+            if dx or dy:
+                if -128 <= dx <= 127 and -128 <= dy <= 127:
+                    changes |= step_bit
+                    fields.append(struct.pack(step_format, dx, dy))
+                else:
+                    changes |= jump_bit
+                    fields.append(struct.pack(jump_format, x, y))
+            if flags != previous[index + 2] or lives != previous[index + 3]:
+                changes |= status_bit
+                fields.append(struct.pack(status_format, flags, lives))
+        if entry[9] != previous[9]:
+            changes |= game_changed
+            fields.append(bytes((entry[9],)))
+        parts.append(bytes((changes,)))
+        parts.extend(fields)
+        previous = entry
+    return b"".join(parts)
+
+
+def decode_ticks(previous, payload):
+    first, count = struct.unpack_from(ticks_format, payload)
+    offset = ticks_size
+    entries = []
+    for tick in range(first, first + count):
+        entry = list(previous)
+        entry[0] = tick
+        changes = payload[offset]
+        offset += 1
+        for index, step_bit, jump_bit, status_bit in ((1, a_step, a_jump, a_status), (5, b_step, b_jump, b_status)):
+            if changes & step_bit:
+                dx, dy = struct.unpack_from(step_format, payload, offset)
+                entry[index] += dx
+                entry[index + 1] += dy
+                offset += 2
+            elif changes & jump_bit:
+                entry[index], entry[index + 1] = struct.unpack_from(jump_format, payload, offset)
+                offset += 8
+            if changes & status_bit:
+                entry[index + 2], entry[index + 3] = struct.unpack_from(status_format, payload, offset)
+                offset += 2
+        if changes & game_changed:
+            entry[9] = payload[offset]
+            offset += 1
+        previous = tuple(entry)
+        entries.append(previous)
+    return entries
+
+
+class MessageReader:
+    # Splits a byte stream into (message type, payload)
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def feed(self, data):
+        self.buffer += data
+        messages = []
+        offset = 0
+        while len(self.buffer) - offset >= message_header_size:
+            kind, length = struct.unpack_from(message_header, self.buffer, offset)
+            end = offset + message_header_size + length
+            if end > len(self.buffer):
+                break
+            messages.append((kind, bytes(self.buffer[offset + message_header_size:end])))
+            offset = end
+        del self.buffer[:offset]
+        return messages
+
+
+class SpectatorServer:
+    # Call new_game() when a game starts and publish() after every tick, from the game
+    # thread. Spectators that can't keep up are dropped instead of queueing without end.
+    def __init__(self, host="", port=default_port, interval=broadcast_interval):
+        self.host = host
+        self.port = port
+        self.interval = interval
+        self.pending = deque()  # (state for a new game or None, capture()), from the game thread
+        self.clients = set()  # StreamWriters, only touched on the server thread
+        self.handlers = set()  # Their handle_client tasks
+        self.level = None  # level_message of the current game
+        self.latest = None  # Last entry encoded
+        self.running = False
+        self.error = None
+        self.ready = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="spectators", daemon=True)
+        self.batches = 0
+        self.ticks = 0
+        self.bytes_encoded = 0
+        self.bytes_sent = 0
+        self.dropped_clients = 0
+        self.busy_time = 0.0
+
+    def start(self):
+        self.running = True
+        self.thread.start()
+        self.ready.wait()
+        if self.error is not None:
+            raise self.error
+        return self
+
+    def stop(self):
+        self.running = False
+        self.thread.join(1.0)
+
+    def new_game(self, state):
+        self.pending.append((state, capture(state)))
+
+    def publish(self, state):
+        self.pending.append((None, capture(state)))
+
+    def run(self):
+        asyncio.run(self.serve())
+
+    async def serve(self):
+        try:
+            server = await asyncio.start_server(self.handle_client, self.host or None, self.port)
+        except OSError as error:
+            self.error = error
+            self.ready.set()
+            return
+        self.port = server.sockets[0].getsockname()[1]
+        self.ready.set()
+        async with server:
+            while self.running:
+                await asyncio.sleep(self.interval)
+                self.broadcast()
+            for writer in self.clients:
+                writer.close()
+            # Closing a connection ends its handler
+            await asyncio.gather(*self.handlers, return_exceptions=True)
+
+    async def handle_client(self, reader, writer):
+        writer.get_extra_info("socket").setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if self.level is not None:
+            writer.write(self.level + message(keyframe_message, struct.pack(entry_format, *self.latest)))
+        self.clients.add(writer)
+        self.handlers.add(asyncio.current_task())
+        try:
+            # Spectators never send anything, this only waits for them to hang up
+            while await reader.read(4096):
+                pass
+        except ConnectionError:
+            pass
+        finally:
+            self.clients.discard(writer)
+            self.handlers.discard(asyncio.current_task())
+            writer.close()
+
+    def broadcast(self):
+        if not self.pending:
+            return
+        start = time.perf_counter()
+        parts = []
+        entries = []
+        base = None
+        while self.pending:
+            state, values = self.pending.popleft()
+            entry = to_entry(values)
+            if state is not None or self.latest is None or entry[0] != self.latest[0] + 1:
+                # A new game, or a tick that does not follow the last one
+                if entries:
+                    parts.append(message(ticks_message, encode_ticks(base, entries)))
+                    entries = []
+                if state is not None:
+                    self.level = message(level_message, encode_level(state))
+                    parts.append(self.level)
+                if self.level is not None:
+                    parts.append(message(keyframe_message, struct.pack(entry_format, *entry)))
+            else:
+                if not entries:
+                    base = self.latest
+                entries.append(entry)
+                self.ticks += 1
+            self.latest = entry
+        if entries:
+            parts.append(message(ticks_message, encode_ticks(base, entries)))
+        data = b"".join(parts)
+
+        for writer in list(self.clients):
+            if writer.transport.get_write_buffer_size() > max_buffered:
+                self.clients.discard(writer)
+                writer.close()
+                self.dropped_clients += 1
+            else:
+                writer.write(data)
+                self.bytes_sent += len(data)
+        self.bytes_encoded += len(data)
+        self.batches += 1
+        self.busy_time += time.perf_counter() - start
+
+    def stats(self):
+        return {
+            "clients": len(self.clients),
+            "batches": self.batches,
+            "ticks": self.ticks,
+            "bytes_per_tick": self.bytes_encoded / self.ticks if self.ticks else 0.0,
+            "bytes_sent": self.bytes_sent,
+            "dropped_clients": self.dropped_clients,
+            "batch_ms": self.busy_time / self.batches * 1000 if self.batches else 0.0,
+        }
+
+
+def watch(address):
+    # Draws the games a SpectatorServer is streaming, with the game's own sprites and UI
+    import pygame
+    import yyr  # yyr imports this module for the server
+
+    sock = socket.create_connection(netplay.parse_address(address, default_port))
+    sock.setblocking(False)
+    yyr.init_display()
+    pygame.display.set_caption("Yin and Yang Reversal (spectating)")
+    reader = MessageReader()
+    game = None
+    level = None  # Decoded level waiting for its keyframe
+    entry = None
+    while True:
+        for event in pygame.event.get():
+            if yyr.is_quit(event):
+                pygame.quit()
+                return 0
+            if yyr.handle_display_event(event) and game is not None:
+                level_surface, level_view = yyr.fit_level(game, all_sprites, view)
+
+        data = b""
+        try:
+            while True:
+                received = sock.recv(65536)
+                if not received:
+                    print("The game was closed")
+                    pygame.quit()
+                    return 0
+                data += received
+        except BlockingIOError:
+            pass
+
+        for kind, payload in reader.feed(data):
+            if kind == level_message:
+                level = decode_level(payload)
+            elif kind == keyframe_message:
+                entry = struct.unpack(entry_format, payload)
+                if level is not None:
+                    apply_entry(level, entry)
+                    game, all_sprites, characters, exits, level_surface, level_view, view = yyr.build_level(level)
+                    level = None
+                elif game is not None:
+                    apply_entry(game, entry)
+            elif kind == ticks_message and game is not None:
+                for entry in decode_ticks(entry, payload):
+                    for character in characters:
+                        character.remember_position()
+                    apply_entry(game, entry)
+
+        if game is None:
+            yyr.draw_waiting(yyr.window, f"Waiting for a game on {address}")
+        else:
+            rects = yyr.character_rects(characters)
+            if rects and view.follow(rects):
+                level_view.draw(level_surface, view, yyr.viewport)
+            all_sprites.update(1.0, view.panes()[0])
+            for exit_sprite in exits:
+                exit_sprite.update_image(yyr.exit_images[game.exit_state])
+            yyr.window.blit(level_surface, (0, 0))
+            yyr.draw_sprites(yyr.window, all_sprites, view, 1.0)
+            yyr.draw_ui(yyr.window, game.character_a.lives, game.character_b.lives, game.tick / sim.tick_rate)
+            if game.flashing:
+                yyr.window.fill(yyr.red, special_flags=pygame.BLEND_RGBA_MULT)
+        yyr.show_screen()
+        yyr.clock.tick(yyr.fps)
+
+
+async def swarm_client(address, results):
+    reader, writer = await asyncio.open_connection(*address)
+    stream = MessageReader()
+    entry = None
+    received = 0
+    while True:
+        data = await reader.read(65536)
+        if not data:
+            break
+        received += len(data)
+        for kind, payload in stream.feed(data):
+            if kind == keyframe_message:
+                entry = struct.unpack(entry_format, payload)
+            elif kind == ticks_message:
+                entry = decode_ticks(entry, payload)[-1]
+    writer.close()
+    results.append((entry, received))
+
+
+async def swarm(address, count):
+    results = []
+    await asyncio.gather(*(swarm_client(address, results) for _ in range(count)))
+    return results
+
+
+def run_swarm(address, count):
+    # Connects `count` spectators that decode everything they get, and prints the last
+    # entry each one ended with once the server hangs up
+    results = asyncio.run(swarm(netplay.parse_address(address, default_port), count))
+    print(json.dumps({"entries": [entry for entry, received in results],
+                      "bytes": sum(received for entry, received in results)}))
+    return 0
+
+
+def play_headless(seconds, server=None, seed=1):
+    # A game with random inputs at the real tick rate. Returns the time each tick took on
+    # this thread, publishing included, and the final state.
+    rng = random.Random(seed)
+    state = sim.with_spare_lives(sim.GameState(levelgen.generate_level(seed=seed)))
+    if server is not None:
+        server.new_game(state)
+    tick_times = []
+    tick_duration = 1.0 / sim.tick_rate
+    next_tick = time.perf_counter()
+    for inputs in sim.random_inputs(rng, round(seconds * sim.tick_rate)):
+        start = time.perf_counter()
+        sim.step(state, inputs)
+        if server is not None:
+            server.publish(state)
+        tick_times.append((time.perf_counter() - start) * 1000)
+        next_tick += tick_duration
+        time.sleep(max(0.0, next_tick - time.perf_counter()))
+    return tick_times, state
+
+
+def tick_summary(tick_times):
+    values = sorted(tick_times)
+    return " ".join(f"p{percent} {profiler.percentile(values, percent):.3f}" for percent in profiler.percentiles) + \
+        f" max {values[-1]:.3f}"
+
+
+def bench(clients=300, seconds=5.0):
+    # Plays a headless game alone, then again with `clients` spectators in another process,
+    # and compares the time each tick takes on the game thread
+    alone, _ = play_headless(seconds)
+    server = SpectatorServer("127.0.0.1", 0).start()
+    spectators = subprocess.Popen([sys.executable, __file__, "swarm", f"127.0.0.1:{server.port}", str(clients)],
+                                  stdout=subprocess.PIPE)
+    deadline = time.perf_counter() + 30
+    while len(server.clients) < clients and time.perf_counter() < deadline:
+        time.sleep(0.05)
+    watched, state = play_headless(seconds, server)
+    time.sleep(server.interval * 3)
+    stats = server.stats()
+    server.stop()
+    # The last line, after anything pygame prints when it is imported
+    results = json.loads(spectators.communicate(timeout=60)[0].splitlines()[-1])
+    expected = list(to_entry(capture(state)))
+    agree = sum(entry == expected for entry in results["entries"])
+
+    print(f"tick ms alone:         {tick_summary(alone)}")
+    print(f"tick ms with {clients:>4} spectators: {tick_summary(watched)}")
+    print(f"{stats['batches']} batches of {stats['ticks'] / max(stats['batches'], 1):.1f} ticks, "
+          f"{stats['bytes_per_tick']:.1f} bytes per tick, {stats['batch_ms']:.3f} ms per batch on the server thread, "
+          f"{stats['dropped_clients']} spectators dropped")
+    print(f"{agree} of {clients} spectators ended on the final state, {results['bytes']} bytes received")
+    return 0 if agree == clients else 1
+
+
+def main(args):
+    if len(args) >= 2 and args[0] == "watch":
+        return watch(args[1])
+    if len(args) >= 3 and args[0] == "swarm":
+        return run_swarm(args[1], int(args[2]))
+    if args and args[0] == "bench":
+        clients = int(args[1]) if len(args) > 1 else 300
+        seconds = float(args[2]) if len(args) > 2 else 5.0
+        return bench(clients, seconds)
+    print("usage: python spectate.py watch HOST[:PORT] | bench [CLIENTS] [SECONDS]")
+    print("serve with: python yyr.py --spectators[=PORT]")
+    return 2
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
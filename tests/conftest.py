@@ -0,0 +1,26 @@
+import os
+import sys
+
+# The game modules are imported from the repository root and load their images relative
+# to it, and the tests never open a real window
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+os.chdir(root)
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+# Only importable once the repository root is on the path
+import levelgen
+import sim
+
+# Inputs the tests play games with: sim.random_choices plus both rewinds at once
+choices = sim.random_choices + (sim.REWIND_A | sim.REWIND_B | sim.DOWN,)
+
+
+def random_inputs(rng, ticks, change=0.1):
+    return sim.random_inputs(rng, ticks, choices, change)
+
+
+def endless_game(seed):
+    # A generated level whose characters have lives to spare
+    return sim.with_spare_lives(sim.GameState(levelgen.generate_level(seed=seed)))
@@ -0,0 +1,45 @@
+import random
+
+import numpy as np
+
+import batchenv
+import levelgen
+import sim
+import snapshot
+from conftest import random_inputs
+
+
+def batch_game(env, index):
+    return (env.x[index].tolist(), env.y[index].tolist(), env.lives[index].tolist(), env.alive[index].tolist(),
+            env.invincible[index].tolist(), env.invincibility_timer[index].tolist(),
+            env.flash_red[index].tolist(), env.at_exit[index].tolist(), env.history_count[index].tolist(),
+            int(env.tick[index]), int(env.status[index]), int(env.exit_state[index]),
+            int(env.flash_time[index]), bool(env.flashing[index]))
+
+
+def sim_game(game):
+    a, b = game.character_a, game.character_b
+    return ([a.x, b.x], [a.y, b.y], [a.lives, b.lives], [a.alive, b.alive], [a.invincible, b.invincible],
+            [a.invincibility_timer, b.invincibility_timer], [a.flash_red, b.flash_red],
+            [a.at_exit, b.at_exit], [len(a.history), len(b.history)],
+            game.tick, snapshot.status_codes[game.status], game.exit_state, game.flash_time, game.flashing)
+
+
+def test_matches_sim_step():
+    count = 40
+    env = batchenv.BatchEnv(count, seed=5)
+    games = [sim.GameState(levelgen.generate_level(seed=int(seed))) for seed in env.seeds]
+    # Half of the games can't run out of lives, so they are still moving at the end
+    for index in range(0, count, 2):
+        env.lives[index] = 1000
+        games[index].character_a.lives = games[index].character_b.lives = 1000
+    rng = random.Random(2)
+    scripts = [random_inputs(rng, 800, change=0.15) for _ in range(count)]
+    for tick in range(800):
+        actions = [script[tick] for script in scripts]
+        env.step(np.array(actions))
+        for index, game in enumerate(games):
+            sim.step(game, actions[index])
+            assert batch_game(env, index) == sim_game(game), (tick, index)
+    statuses = set(env.status.tolist())
+    assert snapshot.status_codes["playing"] in statuses and snapshot.status_codes["game_over"] in statuses
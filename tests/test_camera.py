@@ -0,0 +1,42 @@
+import pytest
+
+import yyr
+
+
+@pytest.fixture(scope="module")
+def display():
+    yyr.init_display()
+    yyr.fit_viewport()
+
+
+@pytest.mark.parametrize("size", sorted(yyr.maze_sizes))
+def test_both_characters_on_screen(display, monkeypatch, size):
+    monkeypatch.setattr(yyr, "maze_size", size)
+    monkeypatch.setattr(yyr, "maze_rows", yyr.maze_sizes[size][0])
+    monkeypatch.setattr(yyr, "maze_cols", yyr.maze_sizes[size][1])
+    for seed in (1, 7, 42):
+        game, all_sprites, characters, exits, level_surface, level_view, view = yyr.create_level(seed=seed)
+        window_rect = yyr.window.get_rect()
+        for character in characters:
+            # Each character is inside the part of the screen one of the cameras draws
+            panes = []
+            for pane in view.panes():
+                character.update(1.0, pane)
+                if character.rect.colliderect(yyr.viewport.pane(pane)):
+                    assert character.rect.colliderect(window_rect)
+                    panes.append(pane)
+            assert panes, (size, seed, character.image_name)
+
+
+def test_split_joins_again():
+    view = yyr.camera.SplitCamera(800, 600, 4000, 4000)
+    assert view.follow([(0, 0, 30, 40), (3000, 100, 30, 40)])
+    assert view.split_axis == "x" and len(view.panes()) == 2 and view.dividers()
+    view.follow([(1000, 1000, 30, 40), (1100, 1000, 30, 40)])
+    assert view.split_axis is None and view.panes() == [view.whole] and not view.dividers()
+
+
+def test_no_split_when_world_fits():
+    view = yyr.camera.SplitCamera(800, 640, 800, 600)
+    view.follow([(0, 0, 30, 40), (770, 560, 30, 40)])
+    assert view.panes() == [view.whole]
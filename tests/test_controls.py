@@ -0,0 +1,87 @@
+import pygame
+
+import sim
+from controls import Controls
+
+
+def down(controls, key):
+    return controls.handle(pygame.event.Event(pygame.KEYDOWN, key=key, mod=0, unicode="", scancode=0))
+
+
+def up(controls, key):
+    return controls.handle(pygame.event.Event(pygame.KEYUP, key=key, mod=0, unicode="", scancode=0))
+
+
+def test_held_keys():
+    controls = Controls()
+    assert controls.next_tick() == 0
+    assert down(controls, pygame.K_RIGHT)
+    assert down(controls, pygame.K_LSHIFT)
+    assert controls.next_tick() == sim.RIGHT | sim.BOOST
+    assert controls.next_tick() == sim.RIGHT | sim.BOOST
+    up(controls, pygame.K_LSHIFT)
+    assert controls.next_tick() == sim.RIGHT
+    up(controls, pygame.K_RIGHT)
+    assert controls.next_tick() == 0
+
+
+def test_other_events_ignored():
+    controls = Controls()
+    assert not down(controls, pygame.K_a)
+    assert not controls.handle(pygame.event.Event(pygame.MOUSEBUTTONDOWN, button=1, pos=(0, 0)))
+    assert controls.next_tick() == 0
+
+
+def test_tap_between_ticks():
+    # A key pressed and released before the next tick is still seen for that one tick
+    controls = Controls()
+    down(controls, pygame.K_q)
+    up(controls, pygame.K_q)
+    assert controls.next_tick() == sim.REWIND_A
+    assert controls.next_tick() == 0
+
+    # Also while another key stays held
+    down(controls, pygame.K_UP)
+    down(controls, pygame.K_e)
+    up(controls, pygame.K_e)
+    assert controls.next_tick() == sim.UP | sim.REWIND_B
+    assert controls.next_tick() == sim.UP
+
+
+def test_last_pressed_direction_wins():
+    for first, second, first_bit, second_bit in (
+        (pygame.K_LEFT, pygame.K_RIGHT, sim.LEFT, sim.RIGHT),
+        (pygame.K_RIGHT, pygame.K_LEFT, sim.RIGHT, sim.LEFT),
+        (pygame.K_UP, pygame.K_DOWN, sim.UP, sim.DOWN),
+        (pygame.K_DOWN, pygame.K_UP, sim.DOWN, sim.UP),
+    ):
+        controls = Controls()
+        down(controls, first)
+        assert controls.next_tick() == first_bit
+        down(controls, second)
+        assert controls.next_tick() == second_bit
+        assert controls.next_tick() == second_bit
+
+        # Letting go of the later key goes back to the one still held
+        up(controls, second)
+        assert controls.next_tick() == first_bit
+
+
+def test_both_axes_at_once():
+    controls = Controls()
+    down(controls, pygame.K_RIGHT)
+    down(controls, pygame.K_DOWN)
+    down(controls, pygame.K_LEFT)
+    down(controls, pygame.K_UP)
+    assert controls.next_tick() == sim.LEFT | sim.UP
+    up(controls, pygame.K_LEFT)
+    assert controls.next_tick() == sim.RIGHT | sim.UP
+
+
+def test_reset_releases_everything():
+    controls = Controls()
+    down(controls, pygame.K_LEFT)
+    assert controls.next_tick() == sim.LEFT
+    down(controls, pygame.K_UP)
+    controls.reset()
+    assert controls.next_tick() == 0
@@ -0,0 +1,52 @@
+import random
+from collections import deque
+
+import pytest
+
+import history
+
+
+@pytest.mark.parametrize("capacity", [1, 2, 7, 64])
+def test_matches_deque(capacity):
+    rng = random.Random(capacity)
+    ring = history.PositionHistory(capacity)
+    expected = deque(maxlen=capacity)
+    for _ in range(5000):
+        roll = rng.random()
+        if roll < 0.6 or not expected:
+            position = (rng.randrange(-32768, 32768), rng.randrange(-32768, 32768))
+            ring.append(*position)
+            expected.append(position)
+        elif roll < 0.8:
+            count = rng.randint(1, len(expected))
+            assert ring.pop(count) == expected[-count]
+            for _ in range(count):
+                expected.pop()
+        else:
+            back = rng.randint(1, len(expected))
+            assert ring.peek(back) == expected[-back]
+            index = rng.randrange(len(expected))
+            assert ring[index] == expected[index]
+        assert len(ring) == len(expected)
+        xs, ys = ring.entries()
+        assert list(zip(xs, ys)) == list(expected)
+
+
+def test_load_entries():
+    ring = history.PositionHistory(5)
+    for value in range(8):
+        ring.append(value, -value)
+    copy = history.PositionHistory(5)
+    copy.load(*ring.entries())
+    assert list(zip(*copy.entries())) == [(value, -value) for value in range(3, 8)]
+    copy.append(8, -8)
+    assert copy.peek() == (8, -8) and copy.peek(5) == (4, -4)
+
+
+def test_out_of_range():
+    ring = history.PositionHistory(3)
+    with pytest.raises(IndexError):
+        ring.pop()
+    ring.append(1, 1)
+    with pytest.raises(IndexError):
+        ring.peek(2)
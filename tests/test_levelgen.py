@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+
+import levelgen
+
+# Yin's and Yang's cell moves for each direction input, Yang's horizontal one mirrored
+moves = ((0, -1, 0, 1), (0, 1, 0, -1), (-1, 0, -1, 0), (1, 0, 1, 0))
+
+
+def solvable_by_search(maze):
+    # Breadth first search of (Yin cell, Yang cell) under the game's inputs: every input
+    # moves both characters that are not locked on the exit yet, and an input that walks
+    # either of them into a wall is never used. The only other input is one character's
+    # rewind key, which holds it on its start cell once it has rewound all the way back
+    # there, while the other one moves.
+    rows, cols = maze.shape
+
+    def open_cell(row, col):
+        return 0 <= row < rows and 0 <= col < cols and maze[row, col] != levelgen.wall_cell
+
+    def move(cell, row_step, col_step):
+        row, col = cell[0] + row_step, cell[1] + col_step
+        return (row, col) if open_cell(row, col) else None
+
+    def find(value):
+        row, col = np.argwhere(maze == value)[0]
+        return int(row), int(col)
+
+    exit_cell = find(levelgen.exit_cell)
+    start_a = find(levelgen.character_a_cell)
+    start_b = find(levelgen.character_b_cell)
+
+    start = (start_a, start_b)
+    seen = {start}
+    queue = [start]
+    for a, b in queue:
+        if a == exit_cell and b == exit_cell:
+            return True
+        following = []
+        for a_row, a_col, b_row, b_col in moves:
+            next_a = a if a == exit_cell else move(a, a_row, a_col)
+            next_b = b if b == exit_cell else move(b, b_row, b_col)
+            if next_a and next_b:
+                following.append((next_a, next_b))
+            if a == start_a and next_b:
+                following.append((a, next_b))
+            if b == start_b and next_a:
+                following.append((next_a, b))
+        for state in following:
+            if state not in seen:
+                seen.add(state)
+                queue.append(state)
+    return False
+
+
+@pytest.mark.parametrize("rows, cols", [(6, 8), (8, 10), (12, 16)])
+def test_is_solvable_matches_search(rows, cols):
+    seeds = 300
+    rejected = 0
+    for seed in range(seeds):
+        maze = levelgen.create_prim_maze(rows, cols, seed=seed)
+        solvable = levelgen.is_solvable(maze)
+        assert solvable == solvable_by_search(maze), (rows, cols, seed)
+        rejected += not solvable
+    # Both answers actually come up
+    assert 0 < rejected < seeds
@@ -0,0 +1,57 @@
+import pytest
+
+import levelgen
+import levelpack
+import sim
+import tilegrid
+
+
+def check_level(packed, level, seed):
+    rows, cols = len(level), len(level[0])
+    assert packed.level() == level
+    assert packed.seed == seed
+    tiles = packed.tiles()
+    expected = tilegrid.TileGrid(level, sim.tile_size, sim.wall_size)
+    assert [[tiles.is_wall(col, row) for col in range(cols)] for row in range(rows)] == \
+        [[expected.is_wall(col, row) for col in range(cols)] for row in range(rows)]
+    game = packed.new_game()
+    original = sim.GameState(level, seed=seed)
+    for character, expected_character in ((game.character_a, original.character_a),
+                                          (game.character_b, original.character_b)):
+        assert (character.x, character.y) == (expected_character.x, expected_character.y)
+    assert game.exits == original.exits
+
+
+@pytest.mark.parametrize("rows, cols", [(levelgen.grid_rows, levelgen.grid_cols), (7, 9), (30, 41)])
+def test_encode_decode(tmp_path, rows, cols):
+    seeds = list(range(1, 11))
+    levels = [levelgen.generate_level(rows, cols, seed=seed) for seed in seeds]
+    path = tmp_path / "levels.yyp"
+    levelpack.write_pack(path, levels, seeds)
+    pack = levelpack.LevelPack(path)
+    assert (len(pack), pack.rows, pack.cols) == (len(levels), rows, cols)
+    assert levelpack.verify(pack) == []
+    for index, level in enumerate(levels):
+        # Levels read out of the pack keep the memory map open until they are dropped
+        check_level(pack[index], level, seeds[index])
+    pack.close()
+
+
+def test_corrupt_record(tmp_path):
+    level = levelgen.generate_level(seed=1)
+    path = tmp_path / "levels.yyp"
+    levelpack.write_pack(path, [level, level])
+    data = bytearray(path.read_bytes())
+    data[-1] ^= 0x80  # A wall bit of the last level
+    path.write_bytes(data)
+    pack = levelpack.LevelPack(path)
+    assert pack[0].check() and not pack[1].check()
+    assert levelpack.verify(pack) == [1]
+    pack.close()
+
+
+def test_rejects_other_files(tmp_path):
+    path = tmp_path / "levels.yyp"
+    path.write_bytes(b"not a level pack at all")
+    with pytest.raises(ValueError):
+        levelpack.LevelPack(path)
@@ -0,0 +1,28 @@
+import pytest
+
+import netplay
+
+
+@pytest.mark.parametrize("latency, jitter, loss", [(0.05, 0.02, 0.1), (0.12, 0.03, 0.3)])
+def test_loopback_stays_in_sync(latency, jitter, loss):
+    ok, frames, sessions, links = netplay.loopback_test(300, latency, jitter, loss)
+    assert ok
+    # The links really did lose packets and the sessions rolled back to recover
+    assert all(link.dropped for link in links)
+    assert any(session.rollbacks for session in sessions)
+
+
+def test_refuses_other_levels():
+    host = netplay.Session(netplay.Link(netplay.open_socket(host="127.0.0.1")), 0)
+    levels = netplay.level_source(60, 80)
+    guest = netplay.Session(netplay.Link(netplay.open_socket(host="127.0.0.1")), 1,
+                            remote=host.link.sock.getsockname(), levels=levels)
+    try:
+        guest.send()
+        with pytest.raises(ValueError):
+            host.connect(timeout=2)
+        with pytest.raises(ValueError):
+            guest.connect(timeout=2)
+    finally:
+        host.close()
+        guest.close()
@@ -0,0 +1,49 @@
+import random
+
+import sim
+import snapshot
+from conftest import endless_game, random_inputs
+
+
+def world(state):
+    return snapshot.capture_scalars(state), [character.history.entries()
+                                             for character in (state.character_a, state.character_b)]
+
+
+def play(state, recorder, inputs, expected):
+    for bits in inputs:
+        sim.step(state, bits)
+        recorder.record(state)
+        expected[state.tick] = world(state)
+
+
+def test_restore_round_trip():
+    rng = random.Random(3)
+    state = endless_game(3)
+    recorder = snapshot.WorldRecorder(state, seconds=5, keyframe_interval=30)
+    expected = {0: world(state)}
+    play(state, recorder, random_inputs(rng, 20 * sim.tick_rate), expected)
+    # Only the last `seconds` are kept
+    assert recorder.newest_tick() == state.tick
+    assert recorder.oldest_tick() > 0
+
+    for tick in range(recorder.newest_tick(), recorder.oldest_tick() - 1, -13):
+        recorder.restore(state, tick)
+        assert world(state) == expected[tick], tick
+
+
+def test_play_on_after_restore():
+    # A restored world plays on exactly like the original did, and is recorded again
+    rng = random.Random(4)
+    state = endless_game(4)
+    recorder = snapshot.WorldRecorder(state, seconds=5)
+    inputs = random_inputs(rng, 600)
+    expected = {}
+    play(state, recorder, inputs, expected)
+
+    recorder.restore(state, 450)
+    replayed = {}
+    play(state, recorder, inputs[450:], replayed)
+    assert replayed == {tick: expected[tick] for tick in range(451, 601)}
+    recorder.restore(state, 500)
+    assert world(state) == expected[500]
@@ -0,0 +1,75 @@
+import random
+import struct
+
+import levelgen
+import sim
+import spectate
+from conftest import endless_game, random_inputs
+
+
+def played_entries(seed, ticks):
+    # Entries of a game with random inputs, rewinds included
+    state = endless_game(seed)
+    entries = [spectate.to_entry(spectate.capture(state))]
+    for bits in random_inputs(random.Random(seed), ticks):
+        sim.step(state, bits)
+        entries.append(spectate.to_entry(spectate.capture(state)))
+    return entries
+
+
+def round_trip(entries, batch):
+    decoded = []
+    previous = entries[0]
+    for start in range(1, len(entries), batch):
+        payload = spectate.encode_ticks(previous, entries[start:start + batch])
+        decoded.extend(spectate.decode_ticks(previous, payload))
+        previous = decoded[-1]
+    return decoded
+
+
+def test_ticks_round_trip():
+    for seed in (1, 2, 3):
+        entries = played_entries(seed, 1500)
+        for batch in (1, 2, 60):
+            assert round_trip(entries, batch) == entries[1:]
+
+
+def test_ticks_steps_and_jumps():
+    # Moves at the edges of a one byte step, and ones that need the full position
+    first = (0, 100, 100, 1, 3, 5000, 5000, 1, 3, 0)
+    entries = [first]
+    for tick, (dx, dy) in enumerate([(127, -128), (-128, 127), (128, 0), (0, -129), (-40000, 70000), (0, 0)], 1):
+        x, y = entries[-1][1:3]
+        entries.append((tick, x + dx, y + dy, 5, 2, 5000 - tick, 5000, 1, 3, tick % 2 | 1 << 2))
+    assert round_trip(entries, len(entries)) == entries[1:]
+
+
+def test_entry_keyframe_round_trip():
+    state = sim.GameState(levelgen.generate_level(seed=4))
+    entry = spectate.to_entry(spectate.capture(state))
+    decoded = struct.unpack(spectate.entry_format, struct.pack(spectate.entry_format, *entry))
+    copy = sim.GameState(levelgen.generate_level(seed=4))
+    copy.tick = 99
+    spectate.apply_entry(copy, decoded)
+    assert spectate.capture(copy) == spectate.capture(state)
+
+
+def test_level_round_trip():
+    state = sim.GameState(levelgen.generate_level(seed=5))
+    copy = spectate.decode_level(spectate.encode_level(state))
+    tiles = state.tiles
+    assert [[copy.tiles.is_wall(col, row) for col in range(tiles.cols)] for row in range(tiles.rows)] == \
+        [[tiles.is_wall(col, row) for col in range(tiles.cols)] for row in range(tiles.rows)]
+    assert copy.exits == state.exits
+    assert (copy.bounds_width, copy.bounds_height) == (state.bounds_width, state.bounds_height)
+
+
+def test_message_reader_split_stream():
+    messages = [(spectate.ticks_message, bytes(range(200))), (spectate.keyframe_message, b"x" * 30),
+                (spectate.level_message, b"")]
+    stream = b"".join(spectate.message(kind, payload) for kind, payload in messages)
+    reader = spectate.MessageReader()
+    received = []
+    for start in range(0, len(stream), 7):
+        received.extend(reader.feed(stream[start:start + 7]))
+    assert received == messages
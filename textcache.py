@@ -0,0 +1,58 @@
+import pygame
+from collections import OrderedDict
+
+# Rendered text is kept until the cache holds this many bytes of pixel data
+max_cache_bytes = 4 * 1024 * 1024
+
+fonts = {}
+surfaces = OrderedDict()
+cache_bytes = 0
+
+
+def get_font(size):
+    font = fonts.get(size)
+    if font is None:
+        font = pygame.font.Font(None, size)
+        fonts[size] = font
+    return font
+
+
+def render(text, size, color, antialias=True):
+    global cache_bytes
+    key = (text, size, tuple(color), antialias)
+    surface = surfaces.get(key)
+    if surface is not None:
+        surfaces.move_to_end(key)
+        return surface
+
+    surface = get_font(size).render(text, antialias, color)
+    surfaces[key] = surface
+    cache_bytes += surface.get_width() * surface.get_height() * surface.get_bytesize()
+    # Drop the least recently used surfaces once the cache is over budget
+    while cache_bytes > max_cache_bytes and len(surfaces) > 1:
+        _, old_surface = surfaces.popitem(last=False)
+        cache_bytes -= old_surface.get_width() * old_surface.get_height() * old_surface.get_bytesize()
+    return surface
+
+
+def draw_glyphs(screen, text, size, color, center, antialias=True):
+    # For strings that change every frame, like the timer, blit one cached surface per character
+    # instead of rasterizing the whole string again
+    glyphs = [render(char, size, color, antialias) for char in text]
+    text_width = sum(glyph.get_width() for glyph in glyphs)
+    text_height = get_font(size).get_height()
+    text_rect = pygame.Rect(0, 0, text_width, text_height)
+    text_rect.center = center
+    x = text_rect.x
+    for glyph in glyphs:
+        screen.blit(glyph, (x, text_rect.y))
+        x += glyph.get_width()
+    return text_rect
+
+
+def clear():
+    global cache_bytes
+    # Fonts are dropped too, they are no longer valid once pygame.font has been shut down
+    fonts.clear()
+    surfaces.clear()
+    cache_bytes = 0
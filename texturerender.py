@@ -0,0 +1,113 @@
+import weakref
+
+import pygame
+from pygame._sdl2 import video
+
+white = (255, 255, 255)
+letterbox_color = (0, 0, 0, 255)
+
+
+class TextureRenderer:
+    # Draws the game through an SDL Renderer instead of blitting onto the display surface.
+    # Images that never change (level chunks, the sprite atlas, scaled sprites) are uploaded
+    # to a texture the first time they are drawn and copied from there, by the GPU when the
+    # renderer is accelerated. Sprites cut from the atlas all come from one texture, so SDL
+    # batches their copies. The red flash is a color modulation of the textures instead of
+    # a multiply over every pixel of the frame.
+    #
+    # What changes every frame (the UI bar, the profiler overlay) and the static screens are
+    # still drawn in software onto a surface, and only the area that was drawn is uploaded.
+    # SDL picks the first renderer that works, SDL_RENDER_DRIVER=software forces the
+    # software one, which also works headless.
+    def __init__(self, title, size, fullscreen=False, vsync=False):
+        self.window = video.Window(title, size, resizable=True, fullscreen_desktop=fullscreen, allow_highdpi=True)
+        self.renderer = video.Renderer(self.window, accelerated=-1, vsync=vsync)
+        self.textures = weakref.WeakKeyDictionary()  # image -> Texture, dropped along with the image
+        self.uploads = {}  # name -> streaming Texture for areas drawn in software
+        self.tint = white
+        self.offset = (0, 0)  # Top left of the area set by clip()
+
+    def size(self):
+        # In pixels, which is more than the window size on HiDPI displays
+        return self.renderer.get_viewport().size
+
+    def set_fullscreen(self, fullscreen):
+        if fullscreen:
+            self.window.set_fullscreen(desktop=True)
+        else:
+            self.window.set_windowed()
+
+    def texture(self, image):
+        texture = self.textures.get(image)
+        if texture is None:
+            texture = video.Texture.from_surface(self.renderer, image)
+            self.textures[image] = texture
+        return texture
+
+    def begin_frame(self, tint=None):
+        self.set_tint(tint)
+        self.renderer.draw_color = letterbox_color
+        self.renderer.clear()
+
+    def set_tint(self, tint):
+        # Color everything drawn from here on is multiplied with, None for none
+        self.tint = white if tint is None else tint
+
+    def clip(self, area):
+        # Draws only inside `area` (None for the whole window) until it is called again.
+        # Rects stay in window coordinates.
+        self.renderer.set_viewport(area)
+        self.offset = (0, 0) if area is None else area.topleft
+
+    def draw(self, texture, rect, area=None):
+        texture.color = self.tint
+        if self.offset != (0, 0):
+            rect = rect.move(-self.offset[0], -self.offset[1])
+        texture.draw(area, rect)
+
+    def blit(self, image, rect):
+        # For images that never change. Subsurfaces (the sprites in the atlas) are drawn
+        # from a texture of the whole parent surface, stretched to `rect` if it is a
+        # different size.
+        parent = image.get_parent()
+        if parent is not None:
+            self.draw(self.texture(parent), rect, pygame.Rect(image.get_abs_offset(), image.get_size()))
+        else:
+            self.draw(self.texture(image), rect)
+
+    def letterbox(self, area):
+        # Covers whatever was drawn outside `area`
+        width, height = self.size()
+        self.renderer.draw_color = letterbox_color
+        for rect in (pygame.Rect(0, 0, width, area.top), pygame.Rect(0, area.bottom, width, height - area.bottom),
+                     pygame.Rect(0, area.top, area.left, area.height),
+                     pygame.Rect(area.right, area.top, width - area.right, area.height)):
+            if rect.width > 0 and rect.height > 0:
+                self.renderer.fill_rect(rect)
+
+    def fill(self, rect):
+        # Fills `rect` with the letterbox color, for the bar between the halves of a split screen
+        self.renderer.draw_color = letterbox_color
+        self.renderer.fill_rect(rect)
+
+    def upload(self, name, surface, rect):
+        # Copies `rect` of a surface that was drawn in software into a texture kept under
+        # `name`, and draws it at the same place
+        rect = rect.clip(surface.get_rect())
+        texture = self.uploads.get(name)
+        if texture is None or (texture.width, texture.height) != rect.size:
+            texture = video.Texture(self.renderer, rect.size, streaming=True)
+            # The surface has no alpha channel, its pixels are copied as they are
+            texture.blend_mode = 0
+            self.uploads[name] = texture
+        texture.update(surface.subsurface(rect))
+        self.draw(texture, rect)
+
+    def show(self, surface):
+        # Puts a screen drawn in software on the window as it is
+        self.begin_frame()
+        self.upload("screen", surface, surface.get_rect())
+        self.present()
+
+    def present(self):
+        self.renderer.present()
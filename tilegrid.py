@@ -0,0 +1,50 @@
+wall = 'X'
+
+
+class TileGrid:
+    # Wall occupancy for a level, one byte per tile. Walls only cover the top-left
+    # wall_size x wall_size pixels of their tile, matching the old 48x48 Block rects.
+    def __init__(self, level, tile_size, wall_size=48):
+        self.rows = len(level)
+        self.cols = len(level[0]) if level else 0
+        self.tile_size = tile_size
+        self.wall_size = wall_size
+        self.walls = bytearray(self.rows * self.cols)
+        for row_index, row in enumerate(level):
+            for col_index, col in enumerate(row):
+                if col == wall:
+                    self.walls[row_index * self.cols + col_index] = 1
+
+    @classmethod
+    def from_walls(cls, walls, rows, cols, tile_size, wall_size=48):
+        # Uses `walls` as is: anything indexable by row * cols + col that gives 1 for a wall
+        grid = cls([], tile_size, wall_size)
+        grid.rows = rows
+        grid.cols = cols
+        grid.walls = walls
+        return grid
+
+    def is_wall(self, col, row):
+        if 0 <= col < self.cols and 0 <= row < self.rows:
+            return self.walls[row * self.cols + col] == 1
+        return False
+
+    def collides(self, x, y, w, h):
+        if w <= 0 or h <= 0:
+            return False
+        tile_size = self.tile_size
+        wall_size = self.wall_size
+        # Only the (at most four, for rects smaller than a tile) cells under the rect can hit it
+        first_col = max(x // tile_size, 0)
+        last_col = min((x + w - 1) // tile_size, self.cols - 1)
+        first_row = max(y // tile_size, 0)
+        last_row = min((y + h - 1) // tile_size, self.rows - 1)
+        for row in range(first_row, last_row + 1):
+            wall_y = row * tile_size
+            if y >= wall_y + wall_size:
+                continue
+            offset = row * self.cols
+            for col in range(first_col, last_col + 1):
+                if self.walls[offset + col] and x < col * tile_size + wall_size:
+                    return True
+        return False
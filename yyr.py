@@ -1,10 +1,23 @@
+import time
+
+startup_start = time.perf_counter()
+
 import pygame
+import os
+import random
 import sys
+import assets
+import camera
+import chunkworld
+import controls
 import levelgen
-from collections import deque
-
-# Initialize Pygame
-pygame.init()
+import levelpack
+import levelpool
+import profiler
+import replay
+import sim
+import textcache
+import texturerender
 
 # Game variables
 black = (0, 0, 0)
@@ -15,423 +28,805 @@ ui_bar_height = 40  # Height of the UI bar at the top
 width, height = 800, 600 + ui_bar_height
 tile_size = 50
 fps = 60
-max_history_length = 60
-initial_lives = 2
-character_size = (23, 35)
-invincibility_duration = 2
-
-# Display
-window = pygame.display.set_mode((width, height))
-pygame.display.set_caption("Yin and Yang Reversal")
-clock = pygame.time.Clock()
-
-# Load images and scale them to the new size
-character_a_img = pygame.image.load("img/yin.png").convert_alpha()
-character_a_img = pygame.transform.scale(character_a_img, character_size)
-character_b_img = pygame.image.load("img/yang.png").convert_alpha()
-character_b_img = pygame.transform.scale(character_b_img, character_size)
-block_img = pygame.image.load("img/spike-wall.png").convert_alpha()
-background_tile_img = pygame.image.load("img/background-tile.png").convert()
-background_tile_img = pygame.transform.scale(background_tile_img, (tile_size, tile_size))
-exit_img = pygame.image.load("img/exit.png").convert_alpha()
-exit_yin_img = pygame.image.load("img/exit-yin.png").convert_alpha()
-exit_yang_img = pygame.image.load("img/exit-yang.png").convert_alpha()
-exit_complete_img = pygame.image.load("img/exit-complete.png").convert_alpha()
-exit_img = pygame.transform.scale(exit_img, (tile_size, tile_size))
-exit_yin_img = pygame.transform.scale(exit_yin_img, (tile_size, tile_size))
-exit_yang_img = pygame.transform.scale(exit_yang_img, (tile_size, tile_size))
-exit_complete_img = pygame.transform.scale(exit_complete_img, (tile_size, tile_size))
-menu_background = pygame.image.load("img/background.png").convert()  # Load the menu background image
-ui_bar_img = pygame.image.load("img/ui-bar.png").convert()  # Ensure it's the right path
-
-font = pygame.font.Font(None, 74)
-small_font = pygame.font.Font(None, 36)
-lives_font = pygame.font.Font(None, 24)
+# How often the gameplay loop renders: "vsync" (display refresh rate), "cap" (fps) or "powersave" (powersave_fps).
+# The game itself always advances at sim.tick_rate, whatever the render rate.
+frame_budget = "cap"
+powersave_fps = 30
+max_render_fps = 300  # Upper bound for vsync, in case the display does not block on present
+# At most this many ticks are simulated per frame; a slower machine plays slower instead of falling further behind
+max_catchup_ticks = 5
+# Moves longer than this (rewinds after a hit) are drawn as a jump instead of sliding through walls
+max_interpolated_distance = 10
+# Milliseconds the static screens block waiting for input before waking up
+idle_timeout = 1000
+# Number of levels generated and built ahead of time, and how often the idle screens wake up to build them
+level_pool_size = 2
+staging_timeout = 20
+# Maze size as (rows, cols), picked with --maze=large or --maze=huge. Mazes bigger than the
+# window scroll with the characters. --maze=endless plays in a maze with no exit that is
+# generated in chunks of this size as the characters explore it.
+maze_sizes = {
+    "standard": (levelgen.grid_rows, levelgen.grid_cols),
+    "large": (60, 80),
+    "huge": (200, 200),
+    "endless": (levelgen.grid_rows, levelgen.grid_cols),
+}
+maze_size = next((arg.split("=", 1)[1] for arg in sys.argv if arg.startswith("--maze=")), "standard")
+maze_rows, maze_cols = maze_sizes[maze_size]
+# Levels are picked at random from this pack (see levelpack.py) instead of being generated, with --pack=FILE
+level_pack_path = next((arg.split("=", 1)[1] for arg in sys.argv if arg.startswith("--pack=")), None)
+level_pack = None
+# Every finished game is saved here as a replay (level seed plus one input byte per tick)
+save_replays = True
+replay_dir = "replays"
+# Per-phase frame timing. F3 turns it on and toggles the overlay, --profile turns it on from the start.
+# The last profile_capacity frames are written to profile_dir when the game is closed.
+profile_frames = "--profile" in sys.argv
+profile_dir = "profiles"
+profile_capacity = 600
+# The window can be resized, and --fullscreen (or F11) fills the screen. The game is drawn
+# at the largest scale that fits, a whole number with --integer-scale, centered with
+# letterbox bars. Assets, text and the level are rendered at that scale once and cached.
+fullscreen = "--fullscreen" in sys.argv
+integer_scale = "--integer-scale" in sys.argv
+# Seconds per frame spent rendering the level at a new scale after a resize, until then
+# the old level layer is shown stretched
+level_rebuild_budget = 0.004
+menu_sprite_size = (30, 40)
+win_image_size = (50, 50)
+# "surface" blits everything in software onto the display surface, --renderer=texture draws
+# through an SDL renderer (see texturerender.py) and falls back to "surface" if that fails
+render_backend = next((arg.split("=", 1)[1] for arg in sys.argv if arg.startswith("--renderer=")), "surface")
+# Two player co-op over UDP (see netplay.py), each player moving one character with the
+# same keys: --host[=PORT] plays Yin and waits for --join=HOST[:PORT], which plays Yang
+host_port = next((arg.split("=", 1)[1] for arg in sys.argv if arg.startswith("--host=")), None)
+join_address = next((arg.split("=", 1)[1] for arg in sys.argv if arg.startswith("--join=")), None)
+# Streams every game to spectators (see spectate.py) with --spectators[=PORT]
+spectator_port = next((arg.split("=", 1)[1] for arg in sys.argv if arg.startswith("--spectators=")), None)
+# Both are only imported when their flags are given, they add to the startup time otherwise
+if host_port is not None or join_address is not None or "--host" in sys.argv:
+    import netplay
+    if host_port is None and "--host" in sys.argv:
+        host_port = netplay.default_port
+if spectator_port is not None or "--spectators" in sys.argv:
+    import spectate
+    if spectator_port is None:
+        spectator_port = spectate.default_port
+
+# Created by init_display(); images are loaded through assets the first time they are drawn
+window = None
+viewport = None
+backend = None  # The TextureRenderer, when the game is drawn through one
+clock = None
+vsync_enabled = False
+session = None  # The netplay.Session, when playing co-op
+spectators = None  # The spectate.SpectatorServer, when streaming
+
+# (phase, seconds) pairs measured until the first menu frame, printed with --startup-report
+startup_timings = []
+
+
+def mark_startup(phase, phase_start):
+    now = time.perf_counter()
+    startup_timings.append((phase, now - phase_start))
+    return now
+
+
+def print_startup_report():
+    total = sum(seconds for phase, seconds in startup_timings)
+    print(f"Startup to first menu frame: {total * 1000:.1f} ms")
+    for phase, seconds in startup_timings:
+        print(f"  {phase:<32} {seconds * 1000:8.1f} ms")
+    print("Asset loading (included above):")
+    for phase, seconds in assets.load_timings:
+        print(f"  {phase:<32} {seconds * 1000:8.1f} ms")
+
+
+def init_display():
+    global clock
+    # Without this Windows stretches the whole window on HiDPI displays, instead of letting
+    # the game draw at the real resolution
+    os.environ.setdefault("SDL_WINDOWS_DPI_AWARENESS", "permonitorv2")
+    # Only the subsystems the game uses, pygame.init() would also start audio, joysticks and more
+    pygame.display.init()
+    pygame.font.init()
+    set_display_mode()
+    pygame.display.set_caption("Yin and Yang Reversal")
+    clock = pygame.time.Clock()
+    return window
+
+
+def set_display_mode():
+    global window, backend, vsync_enabled
+    if render_backend == "texture":
+        try:
+            if backend is None:
+                # Never shown, but convert() needs a display mode to take the pixel format from
+                pygame.display.set_mode((1, 1), pygame.HIDDEN)
+                backend = texturerender.TextureRenderer("Yin and Yang Reversal", (width, height), fullscreen,
+                                                        vsync=frame_budget == "vsync")
+                vsync_enabled = frame_budget == "vsync"
+            else:
+                backend.set_fullscreen(fullscreen)
+            fit_viewport()
+            return
+        except pygame.error as error:
+            print(f"Texture renderer unavailable ({error}), drawing with surfaces")
+            backend = None
+    flags = pygame.FULLSCREEN if fullscreen else pygame.RESIZABLE
+    # Fullscreen uses the desktop resolution
+    size = (0, 0) if fullscreen else (width, height)
+    vsync_enabled = False
+    if frame_budget == "vsync":
+        # vsync needs SCALED, where SDL stretches the width x height frame itself
+        try:
+            window = pygame.display.set_mode((width, height), pygame.SCALED | flags, vsync=1)
+            vsync_enabled = True
+        except pygame.error:
+            window = pygame.display.set_mode(size, flags)
+    else:
+        window = pygame.display.set_mode(size, flags)
+    fit_viewport()
+
+
+def fit_viewport():
+    global window, viewport
+    if backend is not None:
+        # Everything that is still drawn in software goes onto a surface the size of the window
+        if window is None or window.get_size() != backend.size():
+            window = pygame.Surface(backend.size()).convert()
+    else:
+        window = pygame.display.get_surface()
+    viewport = camera.Viewport(window.get_width(), window.get_height(), width, height, integer_scale)
+
+
+def display_size():
+    return backend.size() if backend is not None else pygame.display.get_surface().get_size()
+
+
+def show_screen():
+    # Puts a static screen drawn onto window on the display
+    if backend is not None:
+        backend.show(window)
+    else:
+        pygame.display.flip()
+
+
+def handle_display_event(event):
+    # Resizes and F11. Returns True if the game has to be drawn at a new size.
+    global fullscreen
+    if event.type == pygame.KEYDOWN and event.key == pygame.K_F11:
+        fullscreen = not fullscreen
+        set_display_mode()
+        return True
+    if event.type in (pygame.VIDEORESIZE, pygame.WINDOWSIZECHANGED, pygame.WINDOWRESIZED):
+        if display_size() != viewport.window_size:
+            fit_viewport()
+            return True
+    return False
+
+
+def render_frame_rate():
+    if frame_budget == "powersave":
+        return powersave_fps
+    if frame_budget == "vsync" and vsync_enabled:
+        return max_render_fps
+    return fps
 
 def show_text(screen, text, size, color, center):
-    font = pygame.font.Font(None, size)
-    lives_font = pygame.font.Font(None, 24)
-    text_surface = font.render(text, True, color)
-    text_rect = text_surface.get_rect(center=center)
+    # Size and center are on the width x height game screen, the text is rendered at the viewport scale
+    text_surface = textcache.render(text, viewport.length(size), color)
+    text_rect = text_surface.get_rect(center=viewport.point(*center))
     screen.blit(text_surface, text_rect)
+    return text_rect
+
+# Exit image for each sim.EXIT_* state
+exit_images = {
+    sim.EXIT_EMPTY: "exit",
+    sim.EXIT_YIN: "exit-yin",
+    sim.EXIT_YANG: "exit-yang",
+    sim.EXIT_COMPLETE: "exit-complete",
+}
 
 class Exit(pygame.sprite.Sprite):
     def __init__(self, x, y):
         super().__init__()
-        self.image = exit_img
-        self.rect = self.image.get_rect()
-        self.rect.x = x
-        self.rect.y = y
+        self.image_name = "exit"
+        self.world_x = x
+        self.world_y = y
+        self.rect = pygame.Rect(x, y, 0, 0)
+        self.rescale()
 
-    def update_image(self, new_image):
-        self.image = new_image
+    def rescale(self):
+        # Picks up the image at the current viewport scale
+        self.image = assets.get(self.image_name, viewport.size(tile_size, tile_size))
+        self.rect.size = self.image.get_size()
 
+    def update(self, alpha=1.0, view=None):
+        if view is not None:
+            self.rect.topleft = viewport.world_point(self.world_x, self.world_y, view)
 
-class Character(pygame.sprite.Sprite):
-    def __init__(self, image, x, y, direction, rewindable=False):
-        super().__init__()
-        self.image = image
-        # Set the character dimensions
-        character_width = 26
-        character_height = 35
-        self.image = pygame.transform.scale(self.image, (character_width, character_height))
-        self.rect = self.image.get_rect()
-        # Calculate center position
-        center_x = x + (tile_size - character_width) // 2
-        center_y = y + (tile_size - character_height) // 2
-
-        # Set the center position
-        self.rect.x = center_x
-        self.rect.y = center_y
-        # Shrink the hitbox
-        # self.rect.inflate_ip(-10, -10)
-        self.direction = direction
-        self.history = deque(maxlen=max_history_length)
-        self.speed = 2
-        self.alive = True
-        self.rewindable = rewindable
-        self.lives = initial_lives
-        self.invincible = False
-        self.invincibility_timer = 0
-        self.flash_red = False
-        self.at_exit = False
-        self.record_position()
-
-    def update(self, move_direction, vertical_direction, blocks, rewind_life=False, manual_rewind=False, boosted=False):
-        if self.invincible:
-            self.invincibility_timer -= 1
-            if self.invincibility_timer <= 0:
-                self.invincible = False
-
-        # If character is at exit, do not allow further movement
-        if self.at_exit:
-            return
+    def update_image(self, image_name):
+        if image_name != self.image_name:
+            self.image_name = image_name
+            self.image = assets.get(image_name, viewport.size(tile_size, tile_size))
 
-        self.speed = 5 if boosted else 3
 
-        if rewind_life:
-            self.rewind_position_by(5)
-        elif manual_rewind:
-            self.reverse_position()
-        else:
-            self.record_position()
-            if move_direction == "left":
-                self.rect.x -= self.speed * self.direction
-            elif move_direction == "right":
-                self.rect.x += self.speed * self.direction
-            elif vertical_direction == "up":
-                self.rect.y -= self.speed
-            elif vertical_direction == "down":
-                self.rect.y += self.speed
-
-            if not self.invincible and pygame.sprite.spritecollide(self, blocks, False):
-                self.alive = False
-                if self.lives > 0:
-                    self.lives -= 1
-                    self.rewind_position_by(10)
-                    self.invincible = True
-                    self.invincibility_timer = invincibility_duration
-                    self.flash_red = True
-
-        # Prevent the character from going out of bounds
-        if self.rect.x < 0:
-            self.rect.x = 0
-        elif self.rect.x + self.rect.width > width:
-            self.rect.x = width - self.rect.width
-        if self.rect.y < 0:
-            self.rect.y = 0
-        elif self.rect.y + self.rect.height > height:
-            self.rect.y = height - self.rect.height
-
-    def lock_position(self):
-        self.at_exit = True
-        self.kill()
-        # print(f"Character at exit: {self.rect.x}, {self.rect.y}")
-
-    def record_position(self):
-        current_position = (self.rect.x, self.rect.y)
-        if not self.history or self.history[-1] != current_position:
-            # print(f"Recording position: {self.rect.x}, {self.rect.y}")
-            self.history.append(current_position)
-
-    def reverse_position(self):
-        if self.history:
-            x, y = self.history.pop()
-            # print(f"Reversing position to: {x}, {y}")
-            self.rect.x = x
-            self.rect.y = y
-            self.alive = True
-        else:
-            print("No position in history to reverse to")
-
-    def rewind_position_by(self, positions):
-        if len(self.history) >= positions:
-            x, y = self.history[-positions]
-            # print(f"Rewinding position by {positions} steps to: {x}, {y}")
-            self.rect.x = x
-            self.rect.y = y
-            self.alive = True
+class Character(pygame.sprite.Sprite):
+    # Draws one character of the simulation; the game rules live in sim.CharacterState
+    def __init__(self, image_name, state):
+        super().__init__()
+        self.state = state
+        self.image_name = image_name
+        self.rect = pygame.Rect(state.x, state.y, 0, 0)
+        self.rescale()
+        self.previous_x = state.x
+        self.previous_y = state.y
+
+    def rescale(self):
+        self.image = assets.get(self.image_name, viewport.size(self.state.width, self.state.height))
+        self.rect.size = self.image.get_size()
+
+    def remember_position(self):
+        # Called before each tick so frames between ticks can be drawn in between the two positions
+        self.previous_x = self.state.x
+        self.previous_y = self.state.y
+
+    def world_position(self, alpha=1.0):
+        x = self.state.x
+        y = self.state.y
+        if abs(x - self.previous_x) + abs(y - self.previous_y) <= max_interpolated_distance:
+            x = round(self.previous_x + (x - self.previous_x) * alpha)
+            y = round(self.previous_y + (y - self.previous_y) * alpha)
+        return x, y
+
+    def update(self, alpha=1.0, view=None):
+        x, y = self.world_position(alpha)
+        if view is not None:
+            self.rect.topleft = viewport.world_point(x, y, view)
         else:
-            print("Not enough positions in history to rewind")
+            self.rect.topleft = (x, y)
+        # Characters that made it to the exit are no longer drawn
+        if self.state.at_exit:
+            self.kill()
+
+
+def create_level(level=None, seed=None):
+    if level is None:
+        if seed is None:
+            seed = random.getrandbits(63)
+        level = generate_layout(maze_rows, maze_cols, seed)
+    if maze_size == "endless" or level_pack is not None:
+        # Endless games cannot be replayed from a levelgen seed, so they are not given one.
+        # Packed levels carry the seed they were generated from, if any.
+        game = level.new_game()
+    else:
+        game = sim.GameState(level, seed=seed)
+    return build_level(game)
+
+
+def build_level(game):
+    # Sprites, camera and level layer for a new game. Only the sprites that can change are
+    # redrawn each frame, everything else is baked into level_surface.
+    all_sprites = pygame.sprite.RenderUpdates()
+    exits = pygame.sprite.Group()
 
+    # The maze never changes after this point, so tiles and walls are drawn once, in chunks
+    # that are rendered as the camera reaches them. level_surface holds the part under the
+    # camera and is only redrawn when the camera moves, which it never does when the whole
+    # maze fits in the window. The exit swaps images as characters reach it, so it stays a
+    # redrawn sprite. The screen splits in two when the characters are too far apart.
+    view = camera.SplitCamera(width, height, game.bounds_width, game.bounds_height)
+    view.follow([(state.x, state.y, state.width, state.height) for state in (game.character_a, game.character_b)])
+
+    for x, y, exit_width, exit_height in game.exits:
+        exit_sprite = Exit(x, y)
+        exits.add(exit_sprite)
+        all_sprites.add(exit_sprite)
+    characters = pygame.sprite.Group(Character("yin", game.character_a), Character("yang", game.character_b))
+    all_sprites.add(characters)
+    level_surface, level_view = fit_level(game, all_sprites, view)
+
+    return game, all_sprites, characters, exits, level_surface, level_view, view
+
+
+def fit_level(game, all_sprites, view):
+    # The level layer and sprite images at the current viewport scale. Levels built ahead
+    # of time go through this again if the window was resized since.
+    level_view = camera.ChunkedLevel(game.tiles, tile_size, scale=viewport.scale)
+    level_surface = pygame.Surface(window.get_size()).convert()
+    level_view.draw(level_surface, view, viewport)
+    for sprite in all_sprites:
+        sprite.rescale()
+    all_sprites.update(1.0, view.panes()[0])
+    return level_surface, level_view
+
+
+def stretch_level(level_surface, old_viewport):
+    # Stand-in for the level layer while it is rendered again at a new scale: the old one
+    # stretched to the new viewport, once
+    stretched = pygame.Surface(window.get_size()).convert()
+    stretched.fill(camera.letterbox_color)
+    old_area = level_surface.subsurface(old_viewport.rect.clip(level_surface.get_rect()))
+    stretched.blit(pygame.transform.smoothscale(old_area, viewport.rect.size), viewport.rect)
+    return stretched
+
+
+def generate_layout(rows, cols, seed):
+    if level_pack is not None:
+        return level_pack.generate(rows, cols, seed)
+    if maze_size == "endless":
+        return chunkworld.generate_world(rows, cols, seed)
+    return levelgen.generate_level(rows, cols, seed=seed)
+
+
+def character_rects(characters, alpha=1.0):
+    # World rects of the characters still playing, for the camera to follow
+    return [(*character.world_position(alpha), character.state.width, character.state.height)
+            for character in characters]
+
+
+def draw_sprites(window, all_sprites, view, alpha):
+    # Draws the sprites in each part of a split screen, clipped to it. With one camera they
+    # are already in place and the dirty rects are returned.
+    panes = view.panes()
+    if len(panes) == 1:
+        return all_sprites.draw(window)
+    clip = window.get_clip()
+    for pane in panes:
+        all_sprites.update(alpha, pane)
+        window.set_clip(viewport.pane(pane))
+        all_sprites.draw(window)
+    window.set_clip(clip)
+    return None
+
+def draw_textures(game, all_sprites, level_view, view, alpha, elapsed_time, frame_profile):
+    # One gameplay frame through the texture renderer: the same phases as the surface
+    # path in main(), but the whole frame is drawn every time since copying textures is
+    # cheap, and the flash tints the textures as they are drawn
+    backend.begin_frame(red if game.flashing else None)
+    panes = view.panes()
+    for pane in panes:
+        area = viewport.pane(pane)
+        backend.clip(area)
+        for chunk, rect in level_view.placements(pane, area, viewport.scale):
+            backend.blit(chunk, rect)
+    backend.clip(None)
+    backend.letterbox(viewport.rect)
+    for divider in view.dividers():
+        backend.fill(viewport.area(divider))
+    frame_profile.mark("level")
+    for pane in panes:
+        if len(panes) > 1:
+            all_sprites.update(alpha, pane)
+        backend.clip(viewport.pane(pane))
+        for sprite in all_sprites:
+            backend.blit(sprite.image, sprite.rect)
+    backend.clip(None)
+    frame_profile.mark("draw")
+    ui_rect = draw_ui(window, game.character_a.lives, game.character_b.lives, elapsed_time)
+    backend.upload("ui", window, ui_rect)
+    frame_profile.mark("ui")
+    backend.set_tint(None)
+    frame_profile.mark("flash")
+    if frame_profile.overlay_visible:
+        backend.upload("overlay", window, frame_profile.draw_overlay(window))
+        frame_profile.mark("overlay")
+    backend.present()
+    frame_profile.mark("display")
 
-class Block(pygame.sprite.Sprite):
-    def __init__(self, x, y):
-        super().__init__()
-        self.image = block_img
-        self.rect = self.image.get_rect()
-        self.rect.x = x
-        self.rect.y = y
-        self.rect.width = 48
-        self.rect.height = 48
-
-
-def create_level():
-    level = levelgen.generate_level()
-    blocks = pygame.sprite.Group()
-    all_sprites = pygame.sprite.Group()
-    exits = pygame.sprite.Group()
-    character_a = None
-    character_b = None
-
-    for row_index, row in enumerate(level):
-        for col_index, col in enumerate(row):
-            x = col_index * tile_size
-            y = row_index * tile_size
-            if col == "X":
-                block = Block(x, y)
-                blocks.add(block)
-                all_sprites.add(block)
-            elif col == "A":
-                character_a = Character(character_a_img, x, y, 1, rewindable=True)
-                all_sprites.add(character_a)
-            elif col == "B":
-                character_b = Character(character_b_img, x, y, -1, rewindable=True)
-                all_sprites.add(character_b)
-            elif col == "E":
-                exit_sprite = Exit(x, y)
-                exits.add(exit_sprite)
-                all_sprites.add(exit_sprite)
-
-    return blocks, all_sprites, exits, character_a, character_b
-
-
-def draw_grid(screen, rows, cols, tile_size):
-    for row in range(rows):
-        for col in range(cols):
-            screen.blit(background_tile_img, (col * tile_size, row * tile_size))
 
 def draw_ui(window, lives_a, lives_b, elapsed_time):
     # Draw the UI bar at the bottom
-    pygame.draw.rect(window, grey, (0, height - ui_bar_height, width, ui_bar_height))
-    window.blit(ui_bar_img, (0, height - ui_bar_height))
+    ui_rect = pygame.Rect(viewport.point(0, height - ui_bar_height), viewport.size(width, ui_bar_height))
+    pygame.draw.rect(window, grey, ui_rect)
+    window.blit(assets.get("ui-bar", ui_rect.size), ui_rect)
     lives_text_a = f"Yin Lives: {lives_a + 1}"
     lives_text_b = f"Yang Lives: {lives_b + 1}"
     timer_text = f"Time: {elapsed_time:.2f} s"
     show_text(window, lives_text_a, 24, black, (70, height - ui_bar_height // 2))
     show_text(window, lives_text_b, 24, black, (width - 140, height - ui_bar_height // 2))
-    show_text(window, timer_text, 24, black, (width // 2, height - ui_bar_height // 2))
+    # The timer changes every frame, so it is assembled from cached glyphs
+    textcache.draw_glyphs(window, timer_text, viewport.length(24), black,
+                          viewport.point(width // 2, height - ui_bar_height // 2))
+    return ui_rect
+
+
+def draw_background(window):
+    if viewport.rect != window.get_rect():
+        window.fill(camera.letterbox_color)
+    window.blit(assets.get("background", viewport.rect.size), viewport.rect)
+
+
+def draw_menu(window):
+    draw_background(window)
+    # Display the game title
+    show_text(window, "Yin and Yang Reversal", 74, black, (width / 2, height / 2 - 150))
+    # Display start game instructions
+    start_text = "Press ENTER to Start"
+    if session is not None:
+        start_text += f" as {netplay.players[session.player]}"
+    show_text(window, start_text, 36, black, (width / 2, height / 2 - 100))
+    show_text(window, "Get Yin and Yang to the exit", 36, black, (width / 2, height / 2 - 50))
+    show_text(window, "Yin moves standardly left and right, Yang is reversed. ", 36, black, (width / 2, height / 2 - 25))
+    show_text(window, "Rewind time for each character to get out of tight sports", 36, black, (width / 2, height / 2 - 0))
+
+    # Display controls
+    show_text(window, "Controls", 36, black, (width / 2, height / 2 + 50))
+    control_text = "Move: Arrow Keys | Boost: Shift | Rewind Time: Q (Yin), E (Yang)"
+    show_text(window, control_text, 28, black, (width / 2, height / 2 + 100))
+    # Display Yin and Yang sprites and labels
+    yin_sprite = assets.get("yin", viewport.size(*menu_sprite_size))
+    yang_sprite = assets.get("yang", viewport.size(*menu_sprite_size))
+    window.blit(yin_sprite, yin_sprite.get_rect(center=viewport.point(width / 4, height / 2 + 200)))
+    show_text(window, "Yin", 36, black, (width / 4, height / 2 + 160))
+    window.blit(yang_sprite, yang_sprite.get_rect(center=viewport.point(3 * width / 4, height / 2 + 200)))
+    show_text(window, "Yang", 36, black, (3 * width / 4, height / 2 + 160))
+
+
+def draw_win(window, final_time):
+    draw_background(window)
+    win_image = assets.get("exit-complete", viewport.size(*win_image_size))
+    win_image_rect = win_image.get_rect(center=viewport.point(width // 2, height // 2 - 100))
+    window.blit(win_image, win_image_rect)
+    show_text(window, "You Win!", 74, black, (width / 2, height / 2 - 50))
+    show_text(window, f"Time taken: {final_time:.2f} seconds", 36, black, (width / 2, height / 2 + 5))
+    show_text(window, "Press ENTER to Restart", 36, black, (width / 2, height / 2 + 35))
+
+
+def draw_waiting(window, text):
+    draw_background(window)
+    show_text(window, text, 36, black, (width / 2, height / 2))
+
+
+def draw_game_over(window):
+    draw_background(window)
+    show_text(window, "Game Over", 74, black, (width / 2, height / 2 - 50))
+    show_text(window, "Press ENTER to Restart", 36, black, (width / 2, height / 2 + 50))
+
+
+def wait_for_events(timeout):
+    # Sleep until an event arrives (or the timeout passes), then drain the rest of the queue
+    event = pygame.event.wait(timeout)
+    if event.type == pygame.NOEVENT:
+        return []
+    return [event] + pygame.event.get()
+
+
+def is_quit(event):
+    # With the texture renderer the hidden display window is still open, so closing the
+    # game window does not send QUIT on its own
+    return event.type == pygame.QUIT or event.type == pygame.WINDOWCLOSE
+
+
+def needs_repaint(event):
+    return event.type in (pygame.VIDEOEXPOSE, pygame.WINDOWEXPOSED, pygame.WINDOWRESTORED,
+                          pygame.WINDOWSIZECHANGED, pygame.WINDOWFOCUSGAINED)
+
+
+def static_screen_timeout(level_pool):
+    # How long a static screen can sleep waiting for input
+    if session is not None:
+        # Co-op levels come from the host's seed, not the pool. The other player may
+        # still need this player's last inputs, so they are sent again on every wakeup.
+        session.service()
+        return staging_timeout
+    level_pool.stage()
+    return idle_timeout if level_pool.staged() else staging_timeout
+
+
+def start_netplay(level_pool, frame_profile):
+    global session
+    levels = netplay.level_source(maze_rows, maze_cols, maze_size == "endless", level_pack)
+    session = netplay.open_session(host_port, join_address, levels)
+    if session.player == 0:
+        text = f"Waiting for Yang to join on port {host_port}"
+    else:
+        text = f"Joining {join_address}"
+    draw_waiting(window, text)
+    show_screen()
+
+    def waiting():
+        for event in pygame.event.get():
+            if is_quit(event):
+                quit_game(level_pool, frame_profile)
+            if handle_display_event(event) or needs_repaint(event):
+                draw_waiting(window, text)
+                show_screen()
+
+    try:
+        session.connect(waiting)
+    except ValueError as error:
+        # Started with a different --maze or --pack from the other player
+        print(error)
+        session.close()
+        session = None
+        quit_game(level_pool, frame_profile)
+
+
+def save_replay(recording, game):
+    recording.finish(game)
+    if not save_replays or recording.seed is None:
+        return None
+    os.makedirs(replay_dir, exist_ok=True)
+    path = os.path.join(replay_dir, f"{time.strftime('%Y%m%d-%H%M%S')}-{game.status}-{recording.seed:016x}.yyr")
+    recording.save(path)
+    return path
+
+
+def quit_game(level_pool, frame_profile):
+    level_pool.shutdown()
+    paths = frame_profile.dump(profile_dir)
+    if paths is not None:
+        print(f"Frame profile written to {paths[0]} and {paths[1]}")
+    if session is not None:
+        print(f"Netplay: {netplay.format_stats(session.stats())}")
+    if spectators is not None:
+        spectators.stop()
+        print(f"Spectators: {spectators.stats()}")
+    pygame.quit()
+    sys.exit()
 
 
 def main():
+    global level_pack, spectators
     running = True
-    start_time = 0
     elapsed_time = 0
+    tick_duration = 1.0 / sim.tick_rate
     game_state = "menu"
-    move_direction_a = None
-    vertical_direction_a = None
-    reverse_a = False
-    move_direction_b = None
-    vertical_direction_b = None
-    reverse_b = False
-    boosted = False
-    flash_time = 0
-    character_a = None
-    character_b = None
-    win_image = pygame.image.load("img/exit-complete.png").convert_alpha()  # Make sure the image is loaded
-    win_image = pygame.transform.scale(win_image, (50, 50)) 
-    yin_sprite = pygame.image.load("img/yin.png").convert_alpha()
-    yin_sprite = pygame.transform.scale(yin_sprite, (30, 40))  # Adjust size as needed
-    yang_sprite = pygame.image.load("img/yang.png").convert_alpha()
-    yang_sprite = pygame.transform.scale(yang_sprite, (30, 40))  # Adjust size as needed
-
-    yin_rect = yin_sprite.get_rect(center=(width / 4, height / 2 + 200))
-    yang_rect = yang_sprite.get_rect(center=(3 * width / 4, height / 2 + 200))
+    game = None
+    phase_start = mark_startup("import modules", startup_start)
+    init_display()
+    phase_start = mark_startup("init display and fonts", phase_start)
+
+    # The menu sprites are fetched again at the new size whenever the window is resized
+    assets.get("exit-complete", viewport.size(*win_image_size))
+    assets.get("yin", viewport.size(*menu_sprite_size))
+    assets.get("yang", viewport.size(*menu_sprite_size))
+    phase_start = mark_startup("menu sprites", phase_start)
+
+    frame_rate = render_frame_rate()
+    # The menu, win and game over screens are static and only repainted when this is set
+    redraw = True
+    # Upcoming levels are prepared while the static screens are waiting for input
+    if level_pack_path is not None:
+        level_pack = levelpack.LevelPack(level_pack_path)
+    level_pool = levelpool.LevelPool(create_level, level_pool_size, rows=maze_rows, cols=maze_cols,
+                                     generate=generate_layout)
+    player_input = controls.Controls()
+    frame_profile = profiler.FrameProfiler(profile_capacity, player_input.latency) if profile_frames else profiler.disabled
+    if host_port is not None or join_address is not None:
+        start_netplay(level_pool, frame_profile)
+    if spectator_port is not None:
+        spectators = spectate.SpectatorServer(port=int(spectator_port)).start()
 
     while running:
-        current_time = pygame.time.get_ticks()
+        current_time = time.perf_counter()
         if game_state == "menu":
-            window.blit(menu_background, (0, 0))
-            # Display the game title
-            show_text(window, "Yin and Yang Reversal", 74, black, (width / 2, height / 2 - 150))
-            # Display start game instructions
-            show_text(window, "Press ENTER to Start", 36, black, (width / 2, height / 2 - 100))
-            show_text(window, "Get Yin and Yang to the exit", 36, black, (width / 2, height / 2 - 50))
-            show_text(window, "Yin moves standardly left and right, Yang is reversed. ", 36, black, (width / 2, height / 2 - 25))
-            show_text(window, "Rewind time for each character to get out of tight sports", 36, black, (width / 2, height / 2 - 0))
-
-            # Display controls
-            show_text(window, "Controls", 36, black, (width / 2, height / 2 + 50))
-            control_text = "Move: Arrow Keys | Boost: Shift | Rewind Time: Q (Yin), E (Yang)"
-            show_text(window, control_text, 28, black, (width / 2, height / 2 + 100))
-            # Display Yin and Yang sprites and labels
-            window.blit(yin_sprite, yin_rect)
-            show_text(window, "Yin", 36, black, (width / 4, height / 2 + 160))
-            window.blit(yang_sprite, yang_rect)
-            show_text(window, "Yang", 36, black, (3 * width / 4, height / 2 + 160))
-
-            pygame.display.flip()
-
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT:
-                    pygame.quit()
-                    sys.exit()
+            if redraw:
+                draw_menu(window)
+                show_screen()
+                redraw = False
+                if phase_start is not None:
+                    mark_startup("first menu frame", phase_start)
+                    phase_start = None
+                    if "--startup-report" in sys.argv:
+                        print_startup_report()
+
+            timeout = static_screen_timeout(level_pool)
+            for event in wait_for_events(timeout):
+                if is_quit(event):
+                    quit_game(level_pool, frame_profile)
+                if handle_display_event(event) or needs_repaint(event):
+                    redraw = True
                 if event.type == pygame.KEYDOWN and event.key == pygame.K_RETURN:
                     game_state = "playing"
-                    start_time = pygame.time.get_ticks()
-                    blocks, all_sprites, exits, character_a, character_b = create_level()
-                    move_direction_a = None
-                    vertical_direction_a = None
-                    reverse_a = False
-                    move_direction_b = None
-                    vertical_direction_b = None
-                    reverse_b = False
-                    boosted = False
-                    character_a_at_exit = False
-                    character_b_at_exit = False
-                    flash_time = 0
-                    exit_image_to_use = exit_img
+                    if session is not None:
+                        game, all_sprites, characters, exits, level_surface, level_view, view = \
+                            create_level(seed=session.next_seed())
+                        session.start_match(game)
+                        # Kept to put back characters whose reaching the exit is taken back by a rollback
+                        character_sprites = characters.sprites()
+                        # A replay holds one input stream, co-op games have two
+                        recording = None
+                    else:
+                        game, all_sprites, characters, exits, level_surface, level_view, view = level_pool.get()
+                        if level_view.scale != viewport.scale or level_surface.get_size() != window.get_size():
+                            level_surface, level_view = fit_level(game, all_sprites, view)
+                        recording = replay.Replay(game.seed, game.tiles.rows, game.tiles.cols)
+                    if spectators is not None:
+                        spectators.new_game(game)
+                    rebuilding_level = None
+                    previous_time = time.perf_counter()
+                    accumulator = 0.0
+                    player_input.reset()
+                    full_redraw = True
 
         elif game_state == "playing":
-            elapsed_time = (current_time - start_time) / 1000.0
+            frame_profile.begin_frame()
             for event in pygame.event.get():
-                if event.type == pygame.QUIT:
-                    pygame.quit()
-                    sys.exit()
-                if event.type == pygame.KEYDOWN:
-                    if event.key == pygame.K_LEFT:
-                        move_direction_a = "left"
-                        move_direction_b = "left"
-                    elif event.key == pygame.K_RIGHT:
-                        move_direction_a = "right"
-                        move_direction_b = "right"
-                    elif event.key == pygame.K_UP:
-                        vertical_direction_a = "up"
-                        vertical_direction_b = "up"
-                    elif event.key == pygame.K_DOWN:
-                        vertical_direction_a = "down"
-                        vertical_direction_b = "down"
-                    elif event.key == pygame.K_LSHIFT or event.key == pygame.K_RSHIFT:
-                        boosted = True
-                    elif event.key == pygame.K_q:
-                        reverse_a = True
-                    elif event.key == pygame.K_e:
-                        reverse_b = True
-                if event.type == pygame.KEYUP:
-                    if event.key == pygame.K_LEFT or event.key == pygame.K_RIGHT:
-                        move_direction_a = None
-                        move_direction_b = None
-                    if event.key == pygame.K_UP or event.key == pygame.K_DOWN:
-                        vertical_direction_a = None
-                        vertical_direction_b = None
-                    if event.key == pygame.K_LSHIFT or event.key == pygame.K_RSHIFT:
-                        boosted = False
-                    if event.key == pygame.K_q:
-                        reverse_a = False
-                    if event.key == pygame.K_e:
-                        reverse_b = False
-
-                        
-            # Detect if both characters are at the exit
-            character_a_at_exit = any(pygame.sprite.collide_rect(character_a, exit) for exit in exits)
-            character_b_at_exit = any(pygame.sprite.collide_rect(character_b, exit) for exit in exits)
-            if character_a_at_exit and character_b_at_exit:
-                exit_image_to_use = exit_complete_img
-                
-                result = "complete"
-            elif character_a_at_exit:
-                exit_image_to_use = exit_yin_img
-                result = "partial"
-            elif character_b_at_exit:
-                exit_image_to_use = exit_yang_img
-                result = "partial"
-            else:
-                exit_image_to_use = exit_img
-
-            # Update the image for all exit sprites
-            for exit_sprite in exits:
-                exit_sprite.update_image(exit_image_to_use)      
-
-                        # Lock character into position if they are at the exit
-            if character_a_at_exit:
-                character_a.lock_position()
-            if character_b_at_exit:
-                character_b.lock_position()          
-
-
-            # Update character A
-            character_a.update(move_direction_a, vertical_direction_a, blocks, rewind_life=False, manual_rewind=reverse_a, boosted=boosted)
-
-            # Update character B
-            character_b.update(move_direction_b, vertical_direction_b, blocks, rewind_life=False, manual_rewind=reverse_b, boosted=boosted)
-            # all_sprites.update()
-
-            # Determine game over conditions
-            if (not character_a.alive and character_a.lives == 0) or (not character_b.alive and character_b.lives == 0):
+                if is_quit(event):
+                    quit_game(level_pool, frame_profile)
+                # Game keys are queued and turned into inputs tick by tick below
+                if player_input.handle(event):
+                    continue
+                if event.type == pygame.KEYDOWN and event.key == pygame.K_F3:
+                    if frame_profile is profiler.disabled:
+                        frame_profile = profiler.FrameProfiler(profile_capacity, player_input.latency)
+                        frame_profile.begin_frame()
+                    frame_profile.toggle_overlay()
+                    full_redraw = True
+                old_viewport = viewport
+                if handle_display_event(event):
+                    # Shown stretched until the level is rendered at the new scale, a few
+                    # chunks per frame below. The texture renderer stretches the old chunks itself.
+                    if backend is None:
+                        level_surface = stretch_level(level_surface, old_viewport)
+                    rebuilding_level = camera.ChunkedLevel(game.tiles, tile_size, scale=viewport.scale)
+                    for sprite in all_sprites:
+                        sprite.rescale()
+                    full_redraw = True
+
+            frame_profile.mark("events")
+            # Run as many fixed length ticks as the time since the last frame covers
+            accumulator += current_time - previous_time
+            previous_time = current_time
+            if session is not None and session.update():
+                # The other player's real inputs changed the last few ticks, which can take
+                # back a character reaching the exit
+                for character in character_sprites:
+                    if not character.alive() and not character.state.at_exit:
+                        characters.add(character)
+                        all_sprites.add(character)
+                if spectators is not None:
+                    spectators.publish(game)
+            ticks = 0
+            while accumulator >= tick_duration and game.status == "playing":
+                if ticks == max_catchup_ticks:
+                    accumulator = 0.0
+                    break
+                if session is not None and not session.can_advance():
+                    # Too far ahead of the other player's inputs, wait for them
+                    accumulator = min(accumulator, tick_duration)
+                    break
+                for character in characters:
+                    character.remember_position()
+                inputs = player_input.next_tick()
+                if session is not None:
+                    session.advance(inputs)
+                else:
+                    recording.record(inputs)
+                    sim.step(game, inputs)
+                if spectators is not None:
+                    spectators.publish(game)
+                accumulator -= tick_duration
+                ticks += 1
+            frame_profile.mark("sim")
+            # How far the next tick has progressed, used to place the sprites between ticks
+            alpha = accumulator / tick_duration
+            elapsed_time = game.tick / sim.tick_rate
+
+            # In co-op the game only ends once the other player's inputs up to the end have
+            # arrived, until then a rollback can still take it back
+            if session is not None and game.status != "playing" and not session.settled():
+                # No ticks run once the game has ended here, so nothing else sends. Keep
+                # sending the last inputs until both players have all of each other's.
+                session.service()
+            finished = game.status != "playing" and (session is None or session.settled())
+            if finished and recording is not None:
+                save_replay(recording, game)
+            if finished and game.status == "game_over":
                 game_state = "game_over"
-                result = "Game Over"
-            elif character_a_at_exit and character_b_at_exit:
+                redraw = True
+            elif finished and game.status == "win":
                 game_state = "win"
                 final_time = elapsed_time
-                result = "You Win!"
-
-            window.fill(white)
-            draw_grid(window, height // tile_size, width // tile_size, tile_size)
-            all_sprites.draw(window)
-            draw_ui(window, character_a.lives, character_b.lives, elapsed_time)
-
-            # Apply red flash if needed
-            if character_a.flash_red or character_b.flash_red:
-                window.fill(red, special_flags=pygame.BLEND_RGBA_MULT)
-                flash_time += 1
-                if flash_time > 5:
-                    character_a.flash_red = False
-                    character_b.flash_red = False
-                    flash_time = 0
-
-            pygame.display.flip()  # Update the full display Surface to the screen
-            clock.tick(fps)
+                redraw = True
+
+            # Follow the characters still playing, and repaint everything whenever the view scrolls
+            rects = character_rects(characters, alpha)
+            if rects:
+                if view.follow(rects) and backend is None:
+                    if rebuilding_level is not None:
+                        # The stand-in cannot scroll, finish rendering the new level now
+                        level_view = rebuilding_level
+                        rebuilding_level = None
+                    level_view.draw(level_surface, view, viewport)
+                    full_redraw = True
+
+            if len(view.panes()) > 1:
+                # The sprites are drawn once for each half, the dirty rects can't track that
+                full_redraw = True
+            # Move the sprites to where the simulation put the characters
+            all_sprites.update(alpha, view.panes()[0])
+            for exit_sprite in exits:
+                exit_sprite.update_image(exit_images[game.exit_state])
+            frame_profile.mark("sprites")
+
+            if rebuilding_level is not None and rebuilding_level.render_visible(view, level_rebuild_budget):
+                level_view = rebuilding_level
+                rebuilding_level = None
+                if backend is None:
+                    level_view.draw(level_surface, view, viewport)
+                full_redraw = True
+
+            if backend is not None:
+                draw_textures(game, all_sprites, level_view, view, alpha, elapsed_time, frame_profile)
+            else:
+                if full_redraw:
+                    window.blit(level_surface, (0, 0))
+                    frame_profile.mark("level")
+                    draw_sprites(window, all_sprites, view, alpha)
+                    frame_profile.mark("draw")
+                    draw_ui(window, game.character_a.lives, game.character_b.lives, elapsed_time)
+                    dirty_rects = None
+                else:
+                    # Restore the level under the moving sprites and redraw only those areas
+                    all_sprites.clear(window, level_surface)
+                    frame_profile.mark("level")
+                    dirty_rects = all_sprites.draw(window)
+                    frame_profile.mark("draw")
+                    dirty_rects.append(draw_ui(window, game.character_a.lives, game.character_b.lives, elapsed_time))
+                frame_profile.mark("ui")
+                full_redraw = False
+
+                # Apply red flash if needed
+                if game.flashing:
+                    window.fill(red, special_flags=pygame.BLEND_RGBA_MULT)
+                    # The whole screen is tinted, so the next frame has to repaint all of it
+                    full_redraw = True
+                    dirty_rects = None
+                frame_profile.mark("flash")
+
+                if frame_profile.overlay_visible:
+                    # Drawn over everything, and covers whatever the sprites left underneath it
+                    overlay_rect = frame_profile.draw_overlay(window)
+                    if dirty_rects is not None:
+                        dirty_rects.append(overlay_rect)
+                    frame_profile.mark("overlay")
+
+                if dirty_rects is None:
+                    pygame.display.flip()  # Update the full display Surface to the screen
+                else:
+                    pygame.display.update(dirty_rects)
+                frame_profile.mark("display")
+            player_input.presented()
+            clock.tick(frame_rate)
+            frame_profile.mark("wait")
+            frame_profile.end_frame()
             
 
         elif game_state == "win":
-            window.blit(menu_background, (0, 0))  # Blit the background image
-            win_image_rect = win_image.get_rect(center=(width // 2, height // 2 - 100))
-            window.blit(win_image, win_image_rect)
-            show_text(window, "You Win!", 74, black, (width / 2, height / 2 - 50))
-            show_text(window, f"Time taken: {final_time:.2f} seconds", 36, black, (width / 2, height / 2 + 5))
-            show_text(window, "Press ENTER to Restart", 36, black, (width / 2, height / 2 + 35))
-            
-            pygame.display.flip()
-
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT:
-                    pygame.quit()
-                    sys.exit()
+            if redraw:
+                draw_win(window, final_time)
+                show_screen()
+                redraw = False
+
+            timeout = static_screen_timeout(level_pool)
+            for event in wait_for_events(timeout):
+                if is_quit(event):
+                    quit_game(level_pool, frame_profile)
+                if handle_display_event(event) or needs_repaint(event):
+                    redraw = True
                 if event.type == pygame.KEYDOWN and event.key == pygame.K_RETURN:
                     game_state = "menu"
+                    redraw = True
 
         elif game_state == "game_over":
-            window.blit(menu_background, (0, 0))  # Blit the background image
-            show_text(window, "Game Over", 74, black, (width / 2, height / 2 - 50))
-            show_text(window, "Press ENTER to Restart", 36, black, (width / 2, height / 2 + 50))
-            pygame.display.flip()
-
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT:
-                    pygame.quit()
-                    sys.exit()
+            if redraw:
+                draw_game_over(window)
+                show_screen()
+                redraw = False
+
+            timeout = static_screen_timeout(level_pool)
+            for event in wait_for_events(timeout):
+                if is_quit(event):
+                    quit_game(level_pool, frame_profile)
+                if handle_display_event(event) or needs_repaint(event):
+                    redraw = True
                 if event.type == pygame.KEYDOWN and event.key == pygame.K_RETURN:
                     game_state = "menu"
+                    redraw = True
 
 
 if __name__ == "__main__":